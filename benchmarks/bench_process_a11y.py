@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+###
+# Benchmark process_a11y on a synthetic a11y.csv.
+#
+# Generates a file shaped like the output of `./scan --scan=a11y`
+# (every domain's rows written together), then times the streaming
+# A11yProcessor.run() against the old load-everything approach, each
+# in its own process so that peak memory can be compared.
+#
+# Usage:
+#
+#   python -m benchmarks.bench_process_a11y --rows 1000000
+###
+
+import argparse
+import csv
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BASE_DIR)
+sys.path.insert(0, os.path.join(BASE_DIR, "process_a11y"))
+
+from a11y.process_a11y import A11yProcessor  # noqa
+
+CODES = [
+    "WCAG2AA.Principle1.Guideline1_1.1_1_1.H30.2",
+    "WCAG2AA.Principle1.Guideline1_3.1_3_1.F68",
+    "WCAG2AA.Principle1.Guideline1_4.1_4_3.G18.Fail",
+    "WCAG2AA.Principle4.Guideline4_1.4_1_2.H91.A.NoContent",
+    "WCAG2AA.Principle2.Guideline2_4.2_4_1.H64.1",
+]
+
+AGENCIES = [
+    "Administrative Conference of the United States",
+    "Advisory Council on Historic Preservation",
+    "Library of Congress",
+    "U.S Courts",
+    "Non-Federal Agency",
+]
+
+
+def write_synthetic_files(directory, rows, domains):
+    a11y_path = os.path.join(directory, "a11y.csv")
+    domains_path = os.path.join(directory, "domains.csv")
+    rng = random.Random(0)
+
+    with open(domains_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Domain Name", "Domain Type", "Agency", "City", "State"])
+        for i in range(domains):
+            writer.writerow(["site%d.gov" % i, "Federal Agency", AGENCIES[i % len(AGENCIES)], "", ""])
+
+    with open(a11y_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Domain", "Base Domain", "redirectedTo", "typeCode",
+                         "code", "message", "context", "selector"])
+        per_domain = max(1, rows // domains)
+        written = 0
+        i = 0
+        while written < rows:
+            domain = "site%d.gov" % (i % domains) if i < domains else "extra%d.gov" % i
+            for _ in range(min(per_domain, rows - written)):
+                # Some domains come back clean, with a single empty row.
+                if i % 17 == 0:
+                    writer.writerow([domain, domain, domain, "", "", "", "", ""])
+                else:
+                    writer.writerow([
+                        domain, domain, domain, "1", rng.choice(CODES),
+                        "Synthetic error message %d." % rng.randint(0, 999),
+                        "<a href=\"https://%s/\">&nbsp;</a>" % domain,
+                        "#content > div:nth-child(%d) > a" % rng.randint(1, 20),
+                    ])
+                written += 1
+            i += 1
+
+    return a11y_path, domains_path
+
+
+def run_legacy(processor):
+    # What A11yProcessor.run() used to do: every row in memory at once.
+    data = [processor.clean_row(d) for d in processor.a11y_raw]
+    results = {
+        'a11y': processor.make_a11y_data(data),
+        'agencies': processor.make_agency_data(data),
+        'domains': processor.make_domain_data(data),
+    }
+    os.makedirs("results", exist_ok=True)
+    for name, result in results.items():
+        with open("results/%s.json" % name, "w+") as f:
+            json.dump(result, f, indent=2)
+
+
+def measure(mode, a11y_path, domains_path, workdir):
+    os.chdir(workdir)
+    start = time.perf_counter()
+    processor = A11yProcessor(a11y_path, domains_path)
+    if mode == "legacy":
+        run_legacy(processor)
+    else:
+        processor.run()
+    elapsed = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"mode": mode, "seconds": elapsed, "peak_rss_kb": peak}))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark process_a11y on a synthetic a11y.csv.")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--domains", type=int, default=20000)
+    parser.add_argument("--modes", default="streaming,legacy",
+                        help="Comma-separated list of: streaming, legacy.")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    parser.add_argument("--a11y", help=argparse.SUPPRESS)
+    parser.add_argument("--domains-csv", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Child process: run one mode and report.
+    if args.measure:
+        measure(args.measure, args.a11y, args.domains_csv, args.workdir)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        print("Writing %i synthetic rows..." % args.rows)
+        a11y_path, domains_path = write_synthetic_files(directory, args.rows, args.domains)
+        print("a11y.csv is %.1f MB" % (os.path.getsize(a11y_path) / 1e6))
+
+        outputs = {}
+        for mode in args.modes.split(","):
+            workdir = os.path.join(directory, mode)
+            os.makedirs(workdir)
+            raw = subprocess.check_output([
+                sys.executable, "-m", "benchmarks.bench_process_a11y",
+                "--measure", mode, "--a11y", a11y_path,
+                "--domains-csv", domains_path, "--workdir", workdir,
+            ], cwd=BASE_DIR)
+            result = json.loads(raw.decode("utf-8").strip().splitlines()[-1])
+            print("%-10s %8.2fs  peak RSS %8.1f MB  %10.0f rows/s" % (
+                mode, result["seconds"], result["peak_rss_kb"] / 1024,
+                args.rows / result["seconds"]))
+            outputs[mode] = workdir
+
+        # Both approaches must produce identical files.
+        if len(outputs) > 1:
+            for name in ("a11y", "agencies", "domains"):
+                contents = set()
+                for workdir in outputs.values():
+                    with open(os.path.join(workdir, "results", "%s.json" % name)) as f:
+                        contents.add(f.read())
+                print("%s.json identical: %s" % (name, len(contents) == 1))
+
+
+if __name__ == "__main__":
+    main()
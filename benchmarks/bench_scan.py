@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+
+###
+# Benchmark the overhead of `scan` itself: scan_domains() driving
+# scanners that do (almost) nothing, over synthetic domain lists.
+#
+# Scanner kinds:
+#
+#   * noop  - scanners/noop.py;
+#   * sleep - sleeps for --sleep-ms, like a scanner waiting on the network;
+#   * cpu   - spins for --burn-ms of CPU time, holding the GIL.
+#
+# Every combination of --domains, --workers, --scanners (how many
+# copies of the scanner to run) and --kinds is run, each in its own
+# process, and with --sweep-meta, --sweep-sort and --sweep-cache, both
+# with and without that flag. With --cache, the cache is filled by an
+# untimed run first, so the timed run reads from it.
+#
+# For each run, reports domains/sec, the worker time per scan spent
+# outside the scanner (per-scan overhead), peak RSS, and how often
+# writing rows had to wait for the write lock. Results are saved as
+# JSON (--output), and --compare prints the change in domains/sec from
+# an earlier results file, for the runs both have.
+#
+# Usage:
+#
+#   python -m benchmarks.bench_scan --domains 10000,100000,1000000 \
+#       --workers 1,10,100 --scanners 1,4 --kinds noop,sleep,cpu \
+#       --sweep-meta --sweep-sort --sweep-cache
+#
+# Logging is formatted as usual, but written to /dev/null.
+###
+
+import argparse
+import csv
+import datetime
+import importlib.machinery
+import importlib.util
+import itertools
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+
+import publicsuffixlist
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BASE_DIR)
+
+from utils import psl  # noqa: E402
+
+BUNDLED_PSL = os.path.join(os.path.dirname(publicsuffixlist.__file__), "public_suffix_list.dat")
+
+SUFFIXES = ["gov", "fed.us", "ca.gov", "k12.ca.us"]
+
+
+def write_domains(path, count):
+    rng = random.Random(0)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Domain", "Base Domain"])
+        for i in range(count):
+            base = "agency%i.%s" % (i // 20, rng.choice(SUFFIXES))
+            writer.writerow(["host%i.%s" % (i, base), base])
+
+
+# The `scan` script, imported as a module.
+def load_scan():
+    path = os.path.join(BASE_DIR, "scan")
+    loader = importlib.machinery.SourceFileLoader("scan", path)
+    module = importlib.util.module_from_spec(importlib.util.spec_from_loader("scan", loader))
+    loader.exec_module(module)
+    return module
+
+
+class TimedLock(object):
+    """
+    Stands in for scan.WRITE_LOCK, counting how often an acquire had to
+    wait for another thread, and for how long.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.acquires = 0
+        self.contended = 0
+        self.wait = 0.0
+
+    def acquire(self):
+        if not self.lock.acquire(blocking=False):
+            start = time.perf_counter()
+            self.lock.acquire()
+            self.contended += 1
+            self.wait += time.perf_counter() - start
+        self.acquires += 1
+        return True
+
+    def release(self):
+        self.lock.release()
+
+    def stats(self):
+        return {
+            'acquires': self.acquires,
+            'contended': self.contended,
+            'contended_rate': (self.contended / self.acquires) if self.acquires else None,
+            'wait_seconds': self.wait,
+        }
+
+
+class ScanTimer(object):
+    """Total time spent inside scanners' scan() functions."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds = 0.0
+
+    def wrap(self, scan):
+        def timed(domain, environment, options):
+            start = time.perf_counter()
+            try:
+                return scan(domain, environment, options)
+            finally:
+                elapsed = time.perf_counter() - start
+                with self.lock:
+                    self.seconds += elapsed
+        return timed
+
+
+def sleep_scan(seconds):
+    def scan(domain, environment, options):
+        time.sleep(seconds)
+        return {'domain': domain}
+    return scan
+
+
+def cpu_scan(seconds):
+    def scan(domain, environment, options):
+        end = time.thread_time() + seconds
+        while time.thread_time() < end:
+            pass
+        return {'domain': domain}
+    return scan
+
+
+# A scanner module of the given kind, named scanners.<kind><index>.
+def synthetic_scanner(kind, index, config, timer):
+    scanner = types.ModuleType("scanners.%s%i" % (kind, index))
+    if kind == "noop":
+        from scanners import noop
+        scanner.init = noop.init
+        scanner.init_domain = noop.init_domain
+        scanner.scan = noop.scan
+        scanner.to_rows = noop.to_rows
+        scanner.headers = noop.headers
+        # noop.workers would override --workers.
+    else:
+        if kind == "sleep":
+            scanner.scan = sleep_scan(config["sleep_ms"] / 1000)
+        else:
+            scanner.scan = cpu_scan(config["burn_ms"] / 1000)
+        scanner.to_rows = lambda data: [[data['domain']]]
+        scanner.headers = ["Scanned"]
+    scanner.scan = timer.wrap(scanner.scan)
+    return scanner
+
+
+# Child process: run one configuration, and print its results as JSON.
+def measure(config):
+    logging.basicConfig(
+        stream=open(os.devnull, "w"), level=logging.WARNING,
+        format="%(asctime)s %(levelname)s %(message)s")
+
+    scan = load_scan()
+    lock = TimedLock()
+    scan.WRITE_LOCK = lock
+    timer = ScanTimer()
+
+    scanners = [synthetic_scanner(config["kind"], i, config, timer) for i in range(config["scanners"])]
+    options = {
+        "domains": config["domains_csv"],
+        "scan": ",".join(scanner.__name__.split(".")[-1] for scanner in scanners),
+        "workers": config["workers"],
+        "meta": config["meta"],
+        "sort": config["sort"],
+        "cache": config["cache"],
+        "_": {
+            "cache_dir": config["cache_dir"],
+            "results_dir": config["results_dir"],
+        },
+    }
+
+    start = time.perf_counter()
+    scan.scan_domains(scanners, scan.Path(config["domains_csv"]), options)
+    elapsed = time.perf_counter() - start
+
+    scans = config["domains"] * config["scanners"]
+    overhead = (elapsed * config["workers"] - timer.seconds) / scans
+    # ru_maxrss is in kilobytes on Linux.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({
+        'seconds': elapsed,
+        'domains_per_second': config["domains"] / elapsed,
+        'scans_per_second': scans / elapsed,
+        'scanner_seconds': timer.seconds,
+        'overhead_per_scan_us': overhead * 1e6,
+        'peak_rss_kb': peak,
+        'write_lock': lock.stats(),
+        'psl_cache': psl.stats(),
+    }))
+
+
+def run_child(config):
+    raw = subprocess.check_output([
+        sys.executable, "-m", "benchmarks.bench_scan", "--measure", json.dumps(config)
+    ], cwd=BASE_DIR)
+    # scan prints some lines of its own first.
+    return json.loads(raw.decode("utf-8").strip().splitlines()[-1])
+
+
+def key_for(config):
+    return "%(kind)s domains=%(domains)i workers=%(workers)i scanners=%(scanners)i " \
+        "meta=%(meta)s sort=%(sort)s cache=%(cache)s" % config
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=BASE_DIR, stderr=subprocess.DEVNULL
+        ).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def numbers(value):
+    return [int(number) for number in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the overhead of scan itself.")
+    parser.add_argument("--domains", type=numbers, default=[10000],
+                        help="Comma-separated domain counts.")
+    parser.add_argument("--workers", type=numbers, default=[1, 10, 100],
+                        help="Comma-separated worker counts.")
+    parser.add_argument("--scanners", type=numbers, default=[1, 4],
+                        help="Comma-separated numbers of scanners to run at once.")
+    parser.add_argument("--kinds", default="noop",
+                        help="Comma-separated list of: noop, sleep, cpu.")
+    parser.add_argument("--sleep-ms", type=float, default=1.0)
+    parser.add_argument("--burn-ms", type=float, default=0.1)
+    parser.add_argument("--sweep-meta", action="store_true", help="Run with and without --meta.")
+    parser.add_argument("--sweep-sort", action="store_true", help="Run with and without --sort.")
+    parser.add_argument("--sweep-cache", action="store_true", help="Run with and without --cache.")
+    parser.add_argument("--output", help="Where to save results (default: bench_scan-<time>.json).")
+    parser.add_argument("--compare", help="An earlier results file to compare against.")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Child process: run one configuration and report.
+    if args.measure:
+        measure(json.loads(args.measure))
+        return
+
+    started = datetime.datetime.now(datetime.timezone.utc)
+    output = args.output or "bench_scan-%s.json" % started.strftime("%Y%m%dT%H%M%SZ")
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = {key_for(run["config"]): run for run in json.load(f)["runs"]}
+
+    runs = []
+    directory = tempfile.mkdtemp(prefix="bench-scan-")
+    try:
+        domain_files = {}
+        for count in args.domains:
+            domain_files[count] = os.path.join(directory, "domains-%i.csv" % count)
+            write_domains(domain_files[count], count)
+
+        print("%-70s %12s %14s %10s %10s" % (
+            "", "domains/s", "overhead/scan", "peak RSS", "lock wait"))
+        sweep = itertools.product(
+            args.kinds.split(","), args.domains, args.workers, args.scanners,
+            [False, True] if args.sweep_meta else [False],
+            [False, True] if args.sweep_sort else [False],
+            [False, True] if args.sweep_cache else [False])
+        for kind, domains, workers, scanners, meta, sort, cache in sweep:
+            workdir = tempfile.mkdtemp(dir=directory)
+            cache_dir = os.path.join(workdir, "cache")
+            os.makedirs(cache_dir)
+            shutil.copy(BUNDLED_PSL, os.path.join(cache_dir, psl.PSL_FILENAME))
+
+            config = {
+                'kind': kind, 'domains': domains, 'workers': workers,
+                'scanners': scanners, 'meta': meta, 'sort': sort, 'cache': cache,
+                'sleep_ms': args.sleep_ms, 'burn_ms': args.burn_ms,
+                'domains_csv': domain_files[domains],
+                'cache_dir': cache_dir,
+                'results_dir': os.path.join(workdir, "results"),
+            }
+            os.makedirs(config['results_dir'])
+            if cache:
+                run_child({**config, 'cache': False})
+
+            result = run_child(config)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+            change = ""
+            if key_for(config) in previous:
+                before = previous[key_for(config)]["result"]["domains_per_second"]
+                change = "%+.1f%%" % ((result["domains_per_second"] / before - 1) * 100)
+            print("%-70s %12s %12.0fus %8.1fMB %9.2fs %s" % (
+                key_for(config), "{:,.0f}".format(result["domains_per_second"]),
+                result["overhead_per_scan_us"], result["peak_rss_kb"] / 1024,
+                result["write_lock"]["wait_seconds"], change))
+
+            for path_key in ('domains_csv', 'cache_dir', 'results_dir'):
+                del config[path_key]
+            runs.append({'config': config, 'result': result})
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    with open(output, "w") as f:
+        json.dump({
+            'started': started.isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'runs': runs,
+        }, f, indent=2)
+    print("\nResults saved to %s" % output)
+
+
+if __name__ == "__main__":
+    main()
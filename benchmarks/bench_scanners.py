@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+###
+# Benchmark real scanners with no network access, against the
+# stand-in servers in benchmarks/offline: throughput and tail latency
+# for each scanner, over synthetic .gov domains whose servers behave
+# in a configurable mix of ways:
+#
+#   * ok        - answers everything, over HTTP (redirecting) and HTTPS;
+#   * slow      - waits --slow-ms before every HTTP response;
+#   * trickle   - sends response bodies at --trickle-bps bytes/sec;
+#   * hang      - never answers HTTP requests, so scanners time out;
+#   * redirect  - redirects everything to www.<domain>;
+#   * nohttps   - fails the TLS handshake;
+#   * big       - has a sitemap and JSON documents of --big-items entries;
+#   * nxdomain  - doesn't exist;
+#   * dnsslow   - DNS answers after --slow-ms;
+#   * dnsdown   - DNS never answers.
+#
+# Usage:
+#
+#   python -m benchmarks.bench_scanners --scan 200scanner,pagedata,seo,uswds2,trustymail \
+#       --domains 1000 --mix ok=80,slow=5,hang=2,redirect=5,nohttps=3,big=3,nxdomain=2
+#
+# Any other arguments are passed on to scan (e.g. --timeout=5). The
+# servers run in a process of their own, unless --in-process is given.
+# Scanners that download third-party data when they start (like pshtt's
+# preload list) still need that data, or the network, to do so.
+#
+# Results, with the mix and the options, are saved as JSON (--output).
+###
+
+import argparse
+import csv
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BASE_DIR)
+
+from benchmarks import offline  # noqa: E402
+from benchmarks.bench_scan import BUNDLED_PSL, git_commit, load_scan  # noqa: E402
+from utils import psl, scan_utils  # noqa: E402
+
+
+def behaviors(args):
+    slow = args.slow_ms / 1000
+    return {
+        'ok': offline.Host(),
+        'slow': offline.Host(delay=slow),
+        'trickle': offline.Host(rate=args.trickle_bps, sitemap_urls=args.big_items),
+        'hang': offline.Host(hang=True),
+        'redirect': offline.Host(redirect="https://www.%(host)s%(path)s"),
+        'nohttps': offline.Host(https=False),
+        'big': offline.Host(sitemap_urls=args.big_items, json_items=args.big_items),
+        'nxdomain': offline.Host(exists=False),
+        'dnsslow': offline.Host(dns_delay=slow),
+        'dnsdown': offline.Host(dns_timeout=True),
+    }
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, weight = part.split("=")
+        mix[name] = float(weight)
+    return mix
+
+
+# Domains, and the Hosts for the servers to answer them with.
+def synthetic_hosts(args):
+    kinds = behaviors(args)
+    unknown = set(args.mix) - set(kinds)
+    if unknown:
+        raise ValueError("Unknown behaviors: %s" % ", ".join(sorted(unknown)))
+
+    rng = random.Random(args.seed)
+    names = list(args.mix)
+    weights = [args.mix[name] for name in names]
+    domains, hosts, assigned = [], {}, {}
+    for i in range(args.domains):
+        domain = "agency%i.gov" % i
+        kind = rng.choices(names, weights)[0]
+        domains.append(domain)
+        hosts[domain] = kinds[kind]
+        assigned[kind] = assigned.get(kind, 0) + 1
+    return domains, offline.Hosts(hosts), assigned
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+# Throughput and latency for one scanner, from its CSV and meta.json.
+def summarize(results_dir, name, domains, durations):
+    latencies, errors, seen = [], 0, set()
+    with open(os.path.join(results_dir, "%s.csv" % name), encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            # Scanners may write more than one row per domain.
+            if row["Domain"] in seen:
+                continue
+            seen.add(row["Domain"])
+            if row.get("Local Duration"):
+                latencies.append(float(row["Local Duration"]))
+            if row.get("Local Errors"):
+                errors += 1
+
+    seconds = float(durations[name]["duration"])
+    return {
+        'seconds': seconds,
+        'domains_per_second': domains / seconds if seconds else None,
+        'errors': errors,
+        'latency': {
+            'p50': percentile(latencies, 0.5),
+            'p90': percentile(latencies, 0.9),
+            'p99': percentile(latencies, 0.99),
+            'max': max(latencies) if latencies else None,
+        },
+    }
+
+
+def run_scan(args, extra, domains, endpoints, directory):
+    domains_csv = os.path.join(directory, "domains.csv")
+    with open(domains_csv, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Domain"])
+        for domain in domains:
+            writer.writerow([domain])
+
+    cache_dir = os.path.join(directory, "cache")
+    results_dir = os.path.join(directory, "results")
+    os.makedirs(cache_dir)
+    os.makedirs(results_dir)
+    shutil.copy(BUNDLED_PSL, os.path.join(cache_dir, psl.PSL_FILENAME))
+
+    sys.argv = [
+        "scan", domains_csv, "--scan=%s" % args.scan, "--meta",
+        "--output=%s" % directory, "--ca_file=%s" % endpoints['ca_file']
+    ] + extra
+    options, unknown = scan_utils.options()
+
+    scan = load_scan()
+    offline.install(endpoints)
+    try:
+        scan.run(options, unknown, scan.Path(cache_dir), scan.Path(results_dir))
+    finally:
+        offline.uninstall()
+
+    with open(os.path.join(results_dir, "meta.json")) as f:
+        durations = json.load(f)["durations"]
+    return {
+        name: summarize(results_dir, name, len(domains), durations)
+        for name in args.scan.split(",")
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark real scanners against local stand-in servers.")
+    parser.add_argument("--scan", default="200scanner,pagedata,seo,uswds2,trustymail")
+    parser.add_argument("--domains", type=int, default=200)
+    parser.add_argument("--mix", type=parse_mix,
+                        default=parse_mix("ok=80,slow=5,hang=2,redirect=5,nohttps=3,big=3,nxdomain=2"),
+                        help="Comma-separated behavior=weight pairs.")
+    parser.add_argument("--slow-ms", type=float, default=500)
+    parser.add_argument("--trickle-bps", type=int, default=64 * 1024)
+    parser.add_argument("--big-items", type=int, default=50000)
+    parser.add_argument("--smtp-delay-ms", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--in-process", action="store_true",
+                        help="Run the servers in this process.")
+    parser.add_argument("--output", help="Where to save results (default: bench_scanners-<time>.json).")
+    args, extra = parser.parse_known_args()
+
+    logging.basicConfig(
+        stream=open(os.devnull, "w"), level=logging.WARNING,
+        format="%(asctime)s %(levelname)s %(message)s")
+
+    started = datetime.datetime.now(datetime.timezone.utc)
+    output = args.output or "bench_scanners-%s.json" % started.strftime("%Y%m%dT%H%M%SZ")
+    domains, hosts, assigned = synthetic_hosts(args)
+    network_options = {'smtp_delay': args.smtp_delay_ms / 1000}
+
+    directory = tempfile.mkdtemp(prefix="bench-scanners-")
+    network, server = None, None
+    try:
+        if args.in_process:
+            network = offline.Network(hosts, **network_options).__enter__()
+            endpoints = network.endpoints
+        else:
+            context = multiprocessing.get_context("spawn")
+            connection, child = context.Pipe()
+            server = context.Process(
+                target=offline.serve, args=(hosts, child), kwargs=network_options, daemon=True)
+            server.start()
+            endpoints = connection.recv()
+
+        print("%i domains: %s" % (len(domains), ", ".join(
+            "%s %i" % (kind, count) for kind, count in sorted(assigned.items()))))
+        start = time.perf_counter()
+        scanners = run_scan(args, extra, domains, endpoints, directory)
+        elapsed = time.perf_counter() - start
+    finally:
+        if network is not None:
+            network.__exit__()
+        if server is not None:
+            connection.send("stop")
+            server.join(10)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print("\n%-12s %10s %10s %10s %10s %10s %8s" % (
+        "", "domains/s", "p50", "p90", "p99", "max", "errors"))
+    for name, result in scanners.items():
+        latency = result["latency"]
+        print("%-12s %10.1f %9.3fs %9.3fs %9.3fs %9.3fs %8i" % (
+            name, result["domains_per_second"] or 0,
+            latency["p50"] or 0, latency["p90"] or 0, latency["p99"] or 0, latency["max"] or 0,
+            result["errors"]))
+    print("\nTotal: %.1fs" % elapsed)
+
+    with open(output, "w") as f:
+        json.dump({
+            'started': started.isoformat(),
+            'commit': git_commit(),
+            'config': {
+                'scan': args.scan, 'domains': args.domains, 'mix': args.mix,
+                'assigned': assigned, 'slow_ms': args.slow_ms,
+                'trickle_bps': args.trickle_bps, 'big_items': args.big_items,
+                'smtp_delay_ms': args.smtp_delay_ms, 'seed': args.seed,
+                'in_process': args.in_process, 'scan_arguments': extra,
+            },
+            'seconds': elapsed,
+            'scanners': scanners,
+        }, f, indent=2)
+    print("Results saved to %s" % output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+
+###
+# Microbenchmarks for the per-domain glue in utils/ (and scan's
+# copy_environment, and the rdns gatherer's line filter), which runs
+# once or more for every domain and scanner in a run.
+#
+# For each benchmark, reports calls per second (the best of --repeat
+# runs of at least --min-time seconds each, with the garbage collector
+# on) and, measured separately with tracemalloc:
+#
+#   * peak KiB  - the most memory a single call had allocated at once;
+#   * blocks    - memory blocks still allocated after a call, on average
+#                 (anything above 0 is being kept, e.g. by a cache).
+#
+# CPython doesn't count allocations as such, so these stand in for it.
+#
+# Fixtures are sized like the real thing: the PSL bundled with
+# publicsuffixlist, a Chrome preload list of --preload entries in the
+# environment (as pshtt's init puts there), sslyze results for four
+# hosts with their cipher lists, sslyze-width CSV rows, and domain
+# lists and rdns dumps of --rows lines.
+#
+# Usage:
+#
+#   python -m benchmarks.bench_utils [--filter json] [--save-baseline]
+#   python -m benchmarks.bench_utils --baseline benchmarks/baselines/bench_utils.json
+#
+# With --baseline, every benchmark is compared to the stored one and
+# flagged as a regression if its calls/sec fell by more than
+# --threshold, or its peak memory per call grew by more than that (and
+# by more than 1 KiB). Then the exit status is 1 if anything regressed.
+# Calls/sec only compare on the same machine and Python; the baseline
+# records both, and says so if they differ.
+###
+
+import argparse
+import csv
+import datetime
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from pathlib import Path
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, BASE_DIR)
+
+from benchmarks.bench_scan import BUNDLED_PSL, git_commit, load_scan  # noqa: E402
+from benchmarks.rdns import synthetic_line  # noqa: E402
+from gatherers import rdns  # noqa: E402
+from utils import fast_cache, psl, scan_utils, utils  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(BASE_DIR, "benchmarks", "baselines", "bench_utils.json")
+
+SUFFIXES = ["gov", "fed.us", "ca.gov", "k12.ca.us", "com", "co.uk", "s3.amazonaws.com"]
+
+TLS_VERSIONS = ["sslv2", "sslv3", "tlsv1.0", "tlsv1.1", "tlsv1.2", "tlsv1.3"]
+
+# The width of an sslyze CSV row, not counting Domain and Base Domain.
+SSLYZE_COLUMNS = 43
+
+# The Local ... columns --meta adds.
+META = {
+    'errors': [], 'start_time': 1700000000.123456, 'end_time': 1700000001.654321,
+    'duration': 1.530865, 'retries': 0, 'retry_delay': 0,
+}
+
+
+def hostnames(count, rng):
+    names = []
+    for i in range(count):
+        labels = ["host%i" % rng.randrange(100)] * rng.randrange(3)
+        labels += ["agency%i" % rng.randrange(count), rng.choice(SUFFIXES)]
+        names.append(".".join(labels))
+    return names
+
+
+# One host's worth of sslyze results, as its scan() returns them.
+def sslyze_host(hostname, port, rng):
+    return {
+        'hostname': hostname,
+        'port': port,
+        'starttls_smtp': port != 443,
+        'ip': "10.%i.%i.%i" % (rng.randrange(256), rng.randrange(256), rng.randrange(256)),
+        'protocols': {version: rng.random() < 0.5 for version in TLS_VERSIONS},
+        'config': {
+            key: rng.random() < 0.2
+            for key in ("any_dhe", "all_dhe", "any_rc4", "all_rc4", "any_3des", "any_export",
+                        "any_NULL", "any_MD5", "any_less_than_128_bits", "any_anon")
+        },
+        'certs': {
+            'key_type': "RSA", 'key_length': 2048, 'leaf_signature': "sha256",
+            'any_sha1_served': False, 'any_sha1_constructed': False,
+            'not_before': datetime.datetime(2024, 1, 1), 'not_after': datetime.datetime(2025, 1, 1),
+            'served_issuer': "CN=Example Issuing CA %i,O=Example,C=US" % rng.randrange(10),
+            'constructed_issuer': "CN=Example Root CA,O=Example,C=US",
+            'ev': {'asserted': False, 'trusted': False, 'trusted_oids': [], 'trusted_browsers': []},
+        },
+        'ciphers': [
+            "TLS_ECDHE_RSA_WITH_%s_%i_%s_SHA%i" % (
+                rng.choice(["AES", "CAMELLIA", "ARIA"]), rng.choice([128, 256]),
+                rng.choice(["GCM", "CBC"]), rng.choice([256, 384]))
+            for i in range(60)
+        ],
+        'errors': "",
+        'shared_from': None,
+    }
+
+
+def sslyze_result(domain, rng):
+    hosts = [("www.%s" % domain, 443), (domain, 443), ("mail.%s" % domain, 25), ("mail.%s" % domain, 587)]
+    return [sslyze_host(hostname, port, rng) for hostname, port in hosts]
+
+
+def write_csv(path, header, rows):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+class Discard(object):
+    """Somewhere for csv.writer to write to, that keeps nothing."""
+
+    def write(self, text):
+        return len(text)
+
+
+class Fixtures(object):
+    """
+    What the benchmarks run against, built once (in a temporary
+    directory) and shared by all of them.
+    """
+
+    def __init__(self, directory, args):
+        self.directory = directory
+        self.args = args
+        self.rng = random.Random(args.seed)
+
+        self.cache_dir = os.path.join(directory, "cache")
+        os.makedirs(self.cache_dir)
+        shutil.copy(BUNDLED_PSL, os.path.join(self.cache_dir, psl.PSL_FILENAME))
+        psl.load(self.cache_dir)
+
+        self.domains = ["agency%i.%s" % (i, self.rng.choice(SUFFIXES)) for i in range(args.rows)]
+        self.hostnames = hostnames(args.distinct, self.rng)
+
+        # A domains CSV, in no particular order.
+        self.domains_csv = os.path.join(directory, "domains.csv")
+        shuffled = list(self.domains)
+        self.rng.shuffle(shuffled)
+        write_csv(self.domains_csv, ["Domain", "Base Domain"], [[domain, domain] for domain in shuffled])
+
+        # An unsorted sslyze-width results CSV, for sort_csv.
+        self.results_csv = os.path.join(directory, "results.csv")
+        self.unsorted_csv = os.path.join(directory, "results-unsorted.csv")
+        write_csv(self.unsorted_csv, ["Domain", "Base Domain"] + ["Column %i" % i for i in range(SSLYZE_COLUMNS)], [
+            [domain, domain] + ["value %i" % i for i in range(SSLYZE_COLUMNS)] for domain in shuffled
+        ])
+
+        # Cached sslyze results, for data_for.
+        self.sslyze = sslyze_result("agency0.gov", self.rng)
+        os.makedirs(os.path.join(self.cache_dir, "sslyze"))
+        self.cached = self.domains[:args.cached]
+        for domain in self.cached:
+            scan_utils.write(
+                scan_utils.json_for(sslyze_result(domain, self.rng)),
+                scan_utils.cache_path(domain, "sslyze", cache_dir=self.cache_dir))
+
+        # A scan environment, as pshtt's init leaves it.
+        self.environment = {
+            'scan_method': "local",
+            'preload_list': ["preloaded%i.%s" % (i, self.rng.choice(SUFFIXES)) for i in range(args.preload)],
+            'preload_pending': ["pending%i.gov" % i for i in range(args.preload // 50)],
+            **fast_cache.environment_for("pshtt", {}),
+        }
+
+        self.rdns_lines = [synthetic_line(self.rng).encode("utf-8") for i in range(args.rows)]
+        self._scan = None
+
+    @property
+    def scan(self):
+        if self._scan is None:
+            self._scan = load_scan()
+        return self._scan
+
+
+# Each benchmark takes the Fixtures and returns what to call, with no
+# arguments, once per call measured.
+BENCHMARKS = []
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+
+def cycle(values):
+    # A callable returning the next of `values` each time, round and round.
+    state = {'i': -1}
+    count = len(values)
+
+    def next_value():
+        state['i'] = (state['i'] + 1) % count
+        return values[state['i']]
+    return next_value
+
+
+@benchmark("base_domain_for (repeating)")
+def bench_base_domain_cached(fixtures):
+    names = cycle(fixtures.hostnames[:1000])
+    return lambda: scan_utils.base_domain_for(names(), cache_dir=fixtures.cache_dir)
+
+
+@benchmark("base_domain_for (distinct)")
+def bench_base_domain_distinct(fixtures):
+    # More distinct hostnames than the LRU cache holds, so every call misses.
+    names = cycle(hostnames(psl.suffix_list.base_domain_for.cache_info().maxsize * 2, random.Random(1)))
+    return lambda: utils.base_domain_for(names(), cache_dir=fixtures.cache_dir)
+
+
+@benchmark("write_rows (sslyze, 4 rows, --meta)")
+def bench_write_rows(fixtures):
+    scanner = type("Scanner", (), {'headers': ["Column %i" % i for i in range(SSLYZE_COLUMNS)]})
+    rows = [["value %i" % i for i in range(SSLYZE_COLUMNS)] for host in range(4)]
+    writer = csv.writer(Discard())
+    return lambda: scan_utils.write_rows(rows, "agency0.gov", "agency0.gov", scanner, writer, META)
+
+
+@benchmark("write_rows (no data)")
+def bench_write_rows_empty(fixtures):
+    scanner = type("Scanner", (), {'headers': ["Column %i" % i for i in range(SSLYZE_COLUMNS)]})
+    writer = csv.writer(Discard())
+    return lambda: scan_utils.write_rows(None, "agency0.gov", "agency0.gov", scanner, writer)
+
+
+@benchmark("json_for (sslyze)")
+def bench_json_for(fixtures):
+    return lambda: scan_utils.json_for(fixtures.sslyze)
+
+
+@benchmark("from_json (sslyze)")
+def bench_from_json(fixtures):
+    text = scan_utils.json_for(fixtures.sslyze)
+    return lambda: scan_utils.from_json(text)
+
+
+@benchmark("data_for (cached sslyze)")
+def bench_data_for(fixtures):
+    domains = cycle(fixtures.cached)
+    return lambda: scan_utils.data_for(domains(), "sslyze", cache_dir=fixtures.cache_dir)
+
+
+@benchmark("data_for (not cached)")
+def bench_data_for_missing(fixtures):
+    domains = cycle(fixtures.domains[fixtures.args.cached:])
+    return lambda: scan_utils.data_for(domains(), "sslyze", cache_dir=fixtures.cache_dir)
+
+
+@benchmark("cache_path")
+def bench_cache_path(fixtures):
+    domains = cycle(fixtures.domains)
+    return lambda: scan_utils.cache_path(domains(), "sslyze", cache_dir=fixtures.cache_dir)
+
+
+@benchmark("domains_from (CSV, --rows)")
+def bench_domains_from(fixtures):
+    path = Path(fixtures.domains_csv)
+    return lambda: list(scan_utils.domains_from(path))
+
+
+@benchmark("load_domains (CSV, --rows)")
+def bench_load_domains(fixtures):
+    return lambda: utils.load_domains(fixtures.domains_csv)
+
+
+@benchmark("sort_csv (sslyze-width, --rows)")
+def bench_sort_csv(fixtures):
+    # Sorting leaves the file sorted, so each call sorts a fresh copy.
+    def sort():
+        shutil.copyfile(fixtures.unsorted_csv, fixtures.results_csv)
+        scan_utils.sort_csv(fixtures.results_csv)
+    return sort
+
+
+@benchmark("suffix_pattern")
+def bench_suffix_pattern(fixtures):
+    suffixes = [".%s" % suffix for suffix in SUFFIXES]
+    return lambda: utils.suffix_pattern(suffixes)
+
+
+@benchmark("copy_environment (preload list)")
+def bench_copy_environment(fixtures):
+    copy_environment = fixtures.scan.copy_environment
+    return lambda: copy_environment(fixtures.environment)
+
+
+@benchmark("copy_environment (small)")
+def bench_copy_environment_small(fixtures):
+    copy_environment = fixtures.scan.copy_environment
+    environment = {key: value for key, value in fixtures.environment.items() if not key.startswith("preload")}
+    return lambda: copy_environment(environment)
+
+
+@benchmark("rdns.process_lines (--rows lines)")
+def bench_process_lines(fixtures):
+    return lambda: list(rdns.process_lines(fixtures.rdns_lines, rdns.ip_filter, rdns.number_filter, [".gov"]))
+
+
+def calls_per_second(call, min_time, repeat):
+    timer = timeit.Timer(call, setup="import gc; gc.enable()")
+    number, elapsed = timer.autorange()
+    # Scale up to at least min_time a run, from autorange's 0.2s.
+    if elapsed < min_time:
+        number = max(number, int(number * min_time / max(elapsed, 1e-9)))
+    return number / min(timer.repeat(repeat=repeat, number=number))
+
+
+def memory_per_call(call, calls):
+    call()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        peak = 0
+        for i in range(calls):
+            before = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            call()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    for i in range(calls):
+        call()
+    gc.collect()
+    return peak / 1024, (sys.getallocatedblocks() - blocks) / calls
+
+
+def machine():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'system': platform.system(),
+        'processor': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def regressions(result, baseline, threshold):
+    flags = []
+    if result['calls_per_second'] < baseline['calls_per_second'] * (1 - threshold):
+        flags.append("slower")
+    if result['peak_kib'] > max(baseline['peak_kib'] * (1 + threshold), baseline['peak_kib'] + 1):
+        flags.append("memory")
+    return flags
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark utils' per-domain functions.")
+    parser.add_argument("--filter", help="Only run benchmarks whose names contain this.")
+    parser.add_argument("--min-time", type=float, default=0.2,
+                        help="The least time, in seconds, for each timed run.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--memory-calls", type=int, default=20,
+                        help="Calls to measure memory over.")
+    parser.add_argument("--rows", type=int, default=10000,
+                        help="Lines in the domain lists, results CSV and rdns dump.")
+    parser.add_argument("--preload", type=int, default=150000,
+                        help="Entries in the preload list.")
+    parser.add_argument("--distinct", type=int, default=20000,
+                        help="Distinct hostnames to look up base domains for.")
+    parser.add_argument("--cached", type=int, default=1000,
+                        help="Domains with sslyze results in the cache.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baseline", nargs="?", const=DEFAULT_BASELINE,
+                        help="Compare to this stored baseline (default: %(const)s).")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="How much worse than the baseline counts as a regression.")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE,
+                        help="Store the results as a baseline (default: %(const)s).")
+    parser.add_argument("--output", help="Also save the results, as JSON, here.")
+    args = parser.parse_args()
+
+    # sort_csv logs every call.
+    logging.disable(logging.CRITICAL)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['machine'] != machine():
+            print("Note: the baseline is from another machine or Python, so calls/sec may not compare:")
+            print("  %s\n" % json.dumps(baseline['machine']))
+
+    selected = [(name, setup) for name, setup in BENCHMARKS if not args.filter or args.filter in name]
+    directory = tempfile.mkdtemp(prefix="bench-utils-")
+    results = {}
+    regressed = []
+    try:
+        fixtures = Fixtures(directory, args)
+        print("%-38s %14s %10s %10s %10s" % ("", "calls/s", "peak KiB", "blocks", "change"))
+        for name, setup in selected:
+            call = setup(fixtures)
+            result = {
+                'calls_per_second': calls_per_second(call, args.min_time, args.repeat),
+            }
+            result['peak_kib'], result['blocks'] = memory_per_call(call, args.memory_calls)
+            results[name] = result
+
+            change, flags = "", []
+            previous = (baseline or {}).get('results', {}).get(name)
+            if previous:
+                change = "%+.1f%%" % (100 * (result['calls_per_second'] / previous['calls_per_second'] - 1))
+                flags = regressions(result, previous, args.threshold)
+                if flags:
+                    regressed.append(name)
+            print("%-38s %14s %10.1f %10.1f %10s %s" % (
+                name, "{:,.0f}".format(result['calls_per_second']), result['peak_kib'],
+                result['blocks'], change, " ".join("REGRESSION (%s)" % flag for flag in flags)))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    report = {
+        'started': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'commit': git_commit(),
+        'machine': machine(),
+        'config': {
+            'rows': args.rows, 'preload': args.preload, 'distinct': args.distinct,
+            'cached': args.cached, 'seed': args.seed, 'min_time': args.min_time, 'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    for path in (args.output, args.save_baseline):
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            print("\nResults saved to %s" % path)
+
+    if regressed:
+        print("\n%i regression(s): %s" % (len(regressed), ", ".join(regressed)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
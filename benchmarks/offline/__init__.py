@@ -0,0 +1,173 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+
+import dns.nameserver
+import dns.resolver
+
+from utils import resolver
+
+from benchmarks.offline.ca import CertificateAuthority
+from benchmarks.offline.hosts import Host, Hosts  # noqa: F401
+from benchmarks.offline.nameserver import HostsDNSServer
+from benchmarks.offline.smtp import SMTPServer
+from benchmarks.offline.web import WebServer
+
+###
+# Stand-ins for the internet, for running real scanners on a machine
+# with no network access: an authoritative DNS server, HTTP and HTTPS
+# servers (with their own CA), and an SMTP server with STARTTLS, all on
+# localhost, and all answering for every hostname in a Hosts (see
+# hosts.py for what each one can be made to do).
+#
+#   with offline.Network(offline.Hosts(...)) as network:
+#       offline.install(network.endpoints)
+#       ... run scanners, passing --ca_file=network.endpoints['ca_file'] ...
+#       offline.uninstall()
+#
+# install() points every dnspython resolver configured from the system
+# (and so utils/resolver.py, and socket.getaddrinfo through it) at the
+# DNS server, and sends connections to ports 80, 443, 25, 465 and 587
+# of the hosts' address to the servers' real ports instead. It also
+# has requests trust the CA. The servers can run in another process
+# (see serve()), so they don't compete with scanners for the GIL.
+###
+
+# The well-known ports each server stands in for.
+HTTP_PORTS = (80,)
+HTTPS_PORTS = (443,)
+SMTP_PORTS = (25, 465, 587)
+
+
+class Network(object):
+    """
+    Every stand-in server, run in this process until stop().
+    `endpoints` says where they are, for install().
+    """
+
+    def __init__(self, hosts, directory=None, smtp_delay=0, starttls=True):
+        self.hosts = hosts
+        self.temporary = directory is None
+        self.directory = directory or tempfile.mkdtemp(prefix="offline-")
+        self.smtp_delay = smtp_delay
+        self.starttls = starttls
+        self.servers = []
+        self.nameserver = None
+        self.endpoints = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        ca = CertificateAuthority(self.directory)
+        self.nameserver = HostsDNSServer(self.hosts).__enter__()
+        http = WebServer(self.hosts)
+        https = WebServer(self.hosts, ca=ca)
+        smtp = SMTPServer(ca, starttls=self.starttls, delay=self.smtp_delay)
+        self.servers = [http, https, smtp]
+        for server in self.servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        ports = {}
+        for server, well_known in ((http, HTTP_PORTS), (https, HTTPS_PORTS), (smtp, SMTP_PORTS)):
+            ports.update({str(port): server.port for port in well_known})
+        self.endpoints = {
+            'address': self.nameserver.host_address,
+            'dns': [self.nameserver.address, self.nameserver.port],
+            'ports': ports,
+            'ca_file': ca.ca_file,
+        }
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        if self.nameserver is not None:
+            self.nameserver.__exit__()
+        if self.temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+# Run a Network until told to stop, for multiprocessing: sends its
+# endpoints down `connection`, then waits for anything to come back
+# (or for the other end to close).
+def serve(hosts, connection, **options):
+    with Network(hosts, **options) as network:
+        connection.send(network.endpoints)
+        try:
+            connection.recv()
+        except EOFError:
+            pass
+
+
+# What install() replaced, to put back.
+originals = None
+
+
+def install(endpoints):
+    global originals
+
+    nameserver = dns.nameserver.Do53Nameserver(endpoints['dns'][0], endpoints['dns'][1])
+    address = endpoints['address']
+    ports = {int(port): target for port, target in endpoints['ports'].items()}
+    system_getaddrinfo = resolver.system_getaddrinfo
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        results = system_getaddrinfo(host, port, *args, **kwargs)
+        try:
+            target = ports.get(int(port))
+        except (TypeError, ValueError):
+            target = None
+        if target is None:
+            return results
+        return [
+            (family, kind, proto, name, (sockaddr[0], target) + tuple(sockaddr[2:]))
+            if sockaddr[0] == address else (family, kind, proto, name, sockaddr)
+            for family, kind, proto, name, sockaddr in results
+        ]
+
+    def read_resolv_conf(self, f):
+        self.nameservers = [nameserver]
+
+    originals = {
+        'read_resolv_conf': dns.resolver.Resolver.read_resolv_conf,
+        'system_getaddrinfo': system_getaddrinfo,
+        'getaddrinfo': socket.getaddrinfo,
+        'installed': resolver.installed,
+        'ca_bundle': os.environ.get("REQUESTS_CA_BUNDLE"),
+    }
+
+    dns.resolver.Resolver.read_resolv_conf = read_resolv_conf
+    dns.resolver.reset_default_resolver()
+    resolver.system_resolver = None
+    resolver.cache.flush()
+    resolver.system_getaddrinfo = getaddrinfo
+    resolver.install()
+    os.environ["REQUESTS_CA_BUNDLE"] = endpoints['ca_file']
+
+
+def uninstall():
+    global originals
+
+    if originals is None:
+        return
+
+    dns.resolver.Resolver.read_resolv_conf = originals['read_resolv_conf']
+    dns.resolver.reset_default_resolver()
+    resolver.system_resolver = None
+    resolver.cache.flush()
+    resolver.system_getaddrinfo = originals['system_getaddrinfo']
+    if not originals['installed']:
+        resolver.uninstall()
+    socket.getaddrinfo = originals['getaddrinfo']
+    if originals['ca_bundle'] is None:
+        os.environ.pop("REQUESTS_CA_BUNDLE", None)
+    else:
+        os.environ["REQUESTS_CA_BUNDLE"] = originals['ca_bundle']
+    originals = None
@@ -0,0 +1,86 @@
+import datetime
+import os
+import ssl
+import tempfile
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from utils.lru_cache import LRUCache
+
+
+class CertificateAuthority(object):
+    """
+    A self-signed CA that issues a certificate for any hostname on
+    demand, for the TLS servers to present.
+
+    The CA certificate is written to `ca_file` in `directory`, for
+    clients to trust (scan's --ca_file, REQUESTS_CA_BUNDLE). Every
+    certificate shares one key, to keep issuing them cheap, and the
+    contexts for the `maxsize` most recently used hostnames are kept.
+    """
+
+    def __init__(self, directory, name="domain-scan offline CA", maxsize=4096):
+        self.directory = directory
+        self.contexts = LRUCache(maxsize)
+
+        self.key = ec.generate_private_key(ec.SECP256R1())
+        subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, name)])
+        self.cert = self.builder(subject) \
+            .issuer_name(subject) \
+            .public_key(self.key.public_key()) \
+            .add_extension(x509.BasicConstraints(ca=True, path_length=0), critical=True) \
+            .add_extension(x509.KeyUsage(
+                digital_signature=True, content_commitment=False, key_encipherment=False,
+                data_encipherment=False, key_agreement=False, key_cert_sign=True,
+                crl_sign=True, encipher_only=False, decipher_only=False), critical=True) \
+            .add_extension(x509.SubjectKeyIdentifier.from_public_key(self.key.public_key()), critical=False) \
+            .sign(self.key, hashes.SHA256())
+
+        os.makedirs(directory, exist_ok=True)
+        self.ca_file = os.path.join(directory, "ca.pem")
+        with open(self.ca_file, "wb") as f:
+            f.write(self.cert.public_bytes(serialization.Encoding.PEM))
+
+        self.key_file = os.path.join(directory, "key.pem")
+        with open(self.key_file, "wb") as f:
+            f.write(self.key.private_bytes(
+                serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption()))
+
+    @staticmethod
+    def builder(subject):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return x509.CertificateBuilder() \
+            .subject_name(subject) \
+            .serial_number(x509.random_serial_number()) \
+            .not_valid_before(now - datetime.timedelta(days=1)) \
+            .not_valid_after(now + datetime.timedelta(days=90))
+
+    def issue(self, hostname):
+        subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, hostname)])
+        return self.builder(subject) \
+            .issuer_name(self.cert.subject) \
+            .public_key(self.key.public_key()) \
+            .add_extension(x509.SubjectAlternativeName([x509.DNSName(hostname)]), critical=False) \
+            .add_extension(x509.BasicConstraints(ca=False, path_length=None), critical=True) \
+            .add_extension(x509.ExtendedKeyUsage([x509.oid.ExtendedKeyUsageOID.SERVER_AUTH]), critical=False) \
+            .add_extension(x509.AuthorityKeyIdentifier.from_issuer_public_key(self.key.public_key()), critical=False) \
+            .sign(self.key, hashes.SHA256())
+
+    # A server-side SSLContext presenting a certificate for hostname.
+    def context_for(self, hostname):
+        hostname = hostname.rstrip(".").lower()
+        return self.contexts.get(hostname, lambda: self.context(hostname))
+
+    def context(self, hostname):
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        # load_cert_chain() only reads from files.
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".pem") as chain:
+            chain.write(self.issue(hostname).public_bytes(serialization.Encoding.PEM))
+            chain.write(self.cert.public_bytes(serialization.Encoding.PEM))
+            chain.flush()
+            context.load_cert_chain(chain.name, self.key_file)
+        return context
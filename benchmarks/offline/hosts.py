@@ -0,0 +1,155 @@
+import json
+
+
+class Host(object):
+    """
+    How one hostname behaves, across DNS, HTTP, HTTPS and SMTP.
+
+    * exists       - whether it's in DNS at all (NXDOMAIN if not).
+    * dns_delay    - seconds before DNS answers for it.
+    * dns_timeout  - never answer DNS queries for it.
+    * http, https  - whether it answers on port 80 / 443. Over HTTP it
+                     closes the connection without answering, over
+                     HTTPS it fails the TLS handshake.
+    * upgrade      - redirect HTTP to HTTPS.
+    * redirect     - redirect every request to this URL, which may
+                     use %(host)s and %(path)s.
+    * delay        - seconds before each HTTP response.
+    * hang         - read requests but never answer them, so that
+                     clients time out.
+    * rate         - bytes per second to send response bodies at
+                     (0 for as fast as possible).
+    * status       - status code for the home page.
+    * sitemap_urls - how many URLs /sitemap.xml lists.
+    * json_items   - how many entries /data.json and /code.json have.
+    * mail         - whether it has an MX record (mail.<host>), SPF
+                     and DMARC.
+    * pages        - extra pages, as {path: (status, content type, body)}.
+    """
+
+    def __init__(self, exists=True, dns_delay=0, dns_timeout=False, http=True, https=True,
+                 upgrade=True, redirect=None, delay=0, hang=False, rate=0, status=200,
+                 sitemap_urls=10, json_items=10, mail=True, pages=None):
+        self.exists = exists
+        self.dns_delay = dns_delay
+        self.dns_timeout = dns_timeout
+        self.http = http
+        self.https = https
+        self.upgrade = upgrade
+        self.redirect = redirect
+        self.delay = delay
+        self.hang = hang
+        self.rate = rate
+        self.status = status
+        self.sitemap_urls = sitemap_urls
+        self.json_items = json_items
+        self.mail = mail
+        self.pages = pages or {}
+
+    # Where to redirect a request to, if anywhere.
+    def location_for(self, scheme, hostname, path):
+        if self.redirect:
+            location = self.redirect % {'host': hostname, 'path': path}
+            # Don't redirect to where we already are.
+            if location != "%s://%s%s" % (scheme, hostname, path):
+                return location
+        if (scheme == "http") and self.upgrade and self.https:
+            return "https://%s%s" % (hostname, path)
+        return None
+
+    # (status, content type, body) for a path.
+    def page(self, hostname, path):
+        path = path.split("?", 1)[0]
+        if path in self.pages:
+            status, content_type, body = self.pages[path]
+            return status, content_type, body.encode("utf-8") if isinstance(body, str) else body
+
+        if path == "/":
+            return self.status, "text/html; charset=utf-8", home_page(hostname)
+        if path == "/privacy":
+            return 200, "text/html; charset=utf-8", b"<html><head><title>Privacy</title></head></html>"
+        if path == "/robots.txt":
+            return 200, "text/plain", (
+                "User-agent: *\nAllow: /\nSitemap: https://%s/sitemap.xml\n" % hostname).encode("utf-8")
+        if path == "/sitemap.xml":
+            return 200, "application/xml", sitemap(hostname, self.sitemap_urls)
+        if path in ("/data.json", "/code.json"):
+            return 200, "application/json", json_document(hostname, path, self.json_items)
+        if path == USWDS_CSS:
+            return 200, "text/css", b"/*! uswds v2.8.0 */\n.usa-banner{display:block}\n"
+        return 404, "text/html; charset=utf-8", b"<html><head><title>Not Found</title></head></html>"
+
+
+USWDS_CSS = "/assets/css/uswds.min.css"
+
+
+def home_page(hostname):
+    return (
+        '<!DOCTYPE html>\n<html lang="en"><head>'
+        '<meta charset="utf-8">'
+        '<title>%(host)s</title>'
+        '<meta name="description" content="The home page of %(host)s.">'
+        '<meta property="og:title" content="%(host)s">'
+        '<link rel="stylesheet" href="%(css)s">'
+        '</head><body><div class="usa-banner">An official website</div>'
+        '<h1>%(host)s</h1><a href="/privacy">Privacy</a></body></html>'
+        % {'host': hostname, 'css': USWDS_CSS}
+    ).encode("utf-8")
+
+
+def sitemap(hostname, count):
+    urls = "".join(
+        "<url><loc>https://%s/page/%i</loc><lastmod>2020-01-01</lastmod></url>" % (hostname, i)
+        for i in range(count))
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">%s</urlset>' % urls
+    ).encode("utf-8")
+
+
+def json_document(hostname, path, count):
+    if path == "/code.json":
+        document = {
+            'version': "2.0.0",
+            'agency': hostname,
+            'measurementType': {'method': "projects"},
+            'releases': [
+                {'name': "project-%i" % i, 'repositoryURL': "https://%s/code/%i" % (hostname, i),
+                 'permissions': {'licenses': None, 'usageType': "openSource"}}
+                for i in range(count)
+            ],
+        }
+    else:
+        document = {
+            '@type': "dcat:Catalog",
+            'conformsTo': "https://project-open-data.cio.gov/v1.1/schema",
+            'dataset': [
+                {'title': "Dataset %i" % i, 'identifier': "https://%s/data/%i" % (hostname, i),
+                 'description': "Synthetic dataset %i of %s." % (i, hostname)}
+                for i in range(count)
+            ],
+        }
+    return json.dumps(document).encode("utf-8")
+
+
+class Hosts(object):
+    """
+    Every hostname the stand-in servers know about: those given their
+    own Host, and anything else under one of `zones`, which behaves
+    like `default`. Names outside the zones don't exist.
+    """
+
+    def __init__(self, hosts=None, default=None, zones=("gov",)):
+        self.hosts = {name.rstrip(".").lower(): host for name, host in (hosts or {}).items()}
+        self.default = default or Host()
+        self.zones = tuple(zone.strip(".").lower() for zone in zones)
+
+    def host_for(self, hostname):
+        return self.hosts.get(hostname.rstrip(".").lower(), self.default)
+
+    def in_zones(self, hostname):
+        hostname = hostname.rstrip(".").lower()
+        return any((hostname == zone) or hostname.endswith("." + zone) for zone in self.zones)
+
+    def exists(self, hostname):
+        return self.in_zones(hostname) and self.host_for(hostname).exists
@@ -0,0 +1,42 @@
+from tests.stub_dns import StubDNSServer
+
+
+class HostsDNSServer(StubDNSServer):
+    """
+    Answers for every name in a Hosts (see hosts.py): an A record for
+    `address`, and for hosts with mail, an MX record for mail.<host>,
+    SPF and DMARC. Slow and unresponsive hosts are slow and
+    unresponsive here too.
+    """
+
+    def __init__(self, hosts, address="127.0.0.1", ttl=300, negative_ttl=60):
+        super().__init__(negative_ttl=negative_ttl, keep_queries=False)
+        self.hosts = hosts
+        self.host_address = address
+        self.ttl = ttl
+
+    def lookup(self, name, rdtype):
+        if not self.hosts.exists(name):
+            return None
+
+        if rdtype == "A":
+            return self.ttl, [self.host_address]
+        if name.startswith("_dmarc."):
+            if (rdtype == "TXT") and self.hosts.host_for(name[len("_dmarc."):]).mail:
+                return self.ttl, ['"v=DMARC1; p=reject; rua=mailto:dmarc@%s"' % name[len("_dmarc."):]]
+            return None
+        if self.hosts.host_for(name).mail:
+            if rdtype == "MX":
+                return self.ttl, ["10 mail.%s." % name]
+            if rdtype == "TXT":
+                return self.ttl, ['"v=spf1 mx -all"']
+        return None
+
+    def exists(self, name):
+        return self.hosts.exists(name)
+
+    def delay_for(self, name):
+        host = self.hosts.host_for(name)
+        if host.dns_timeout:
+            return None
+        return host.dns_delay
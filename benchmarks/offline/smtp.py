@@ -0,0 +1,90 @@
+import socket
+import socketserver
+import ssl
+import time
+
+
+class Handler(socketserver.StreamRequestHandler):
+
+    def reply(self, *lines):
+        # Every line but the last is a continuation, e.g. "250-".
+        text = "".join(
+            "%s%s%s\r\n" % (line[:3], "-" if i < len(lines) - 1 else " ", line[4:])
+            for i, line in enumerate(lines))
+        self.connection.sendall(text.encode("utf-8"))
+
+    def handle(self):
+        server = self.server
+        tls = False
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if server.delay:
+            time.sleep(server.delay)
+        self.reply("220 %s ESMTP offline" % server.hostname)
+
+        while True:
+            try:
+                line = self.rfile.readline(1024)
+            except (ssl.SSLError, OSError):
+                return
+            if not line:
+                return
+            verb = line.decode("utf-8", "replace").strip().split(" ")[0].upper()
+
+            if verb == "EHLO":
+                extensions = ["250 %s" % server.hostname, "250 SIZE 10240000"]
+                if server.starttls and not tls:
+                    extensions.append("250 STARTTLS")
+                self.reply(*(extensions + ["250 8BITMIME"]))
+            elif verb == "HELO":
+                self.reply("250 %s" % server.hostname)
+            elif verb == "STARTTLS":
+                if tls or not server.starttls:
+                    self.reply("503 Already in TLS" if tls else "502 Not supported")
+                    continue
+                self.reply("220 Ready to start TLS")
+                try:
+                    self.connection = server.context.wrap_socket(self.connection, server_side=True)
+                except (ssl.SSLError, OSError):
+                    return
+                self.rfile = self.connection.makefile("rb")
+                tls = True
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            elif verb in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self.reply("250 OK")
+            else:
+                self.reply("502 Command not recognized")
+
+
+class SMTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    An SMTP server on localhost that offers STARTTLS (unless told not
+    to), with a certificate from `ca` for whatever hostname the client
+    asks for by SNI. It accepts mail, and throws it away. With a delay,
+    it waits that many seconds before its greeting.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, ca, hostname="mail.offline", starttls=True, delay=0):
+        self.ca = ca
+        self.hostname = hostname
+        self.starttls = starttls
+        self.delay = delay
+        self.context = ca.context(hostname)
+        self.context.sni_callback = self.choose_certificate
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.port = self.server_address[1]
+
+    def choose_certificate(self, connection, hostname, context):
+        if hostname is not None:
+            connection.context = self.ca.context_for(hostname)
+        return None
@@ -0,0 +1,128 @@
+import http.server
+import socket
+import socketserver
+import ssl
+import threading
+import time
+
+from utils.lru_cache import LRUCache
+
+# The longest a hanging host holds on to a request, in seconds.
+hang_limit = 300
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "offline"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.respond(body=True)
+
+    def do_HEAD(self):
+        self.respond(body=False)
+
+    def respond(self, body):
+        hostname = (self.headers.get("Host") or "").split(":")[0].lower()
+        host = self.server.hosts.host_for(hostname)
+
+        if (self.server.scheme == "http") and not host.http:
+            self.close_connection = True
+            return
+        if host.hang:
+            self.server.stopping.wait(hang_limit)
+            self.close_connection = True
+            return
+        if host.delay:
+            time.sleep(host.delay)
+
+        location = host.location_for(self.server.scheme, hostname, self.path)
+        if location is not None:
+            self.send_response(301)
+            self.send_header("Location", location)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        status, content_type, content = self.server.page(hostname, self.path)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        if body:
+            self.send_body(content, host.rate)
+
+    def send_body(self, content, rate):
+        if not rate:
+            self.wfile.write(content)
+            return
+
+        # Trickle it out, a tenth of a second's worth at a time.
+        step = max(1, int(rate / 10))
+        for start in range(0, len(content), step):
+            self.wfile.write(content[start:start + step])
+            time.sleep(0.1)
+
+
+class WebServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    An HTTP server on localhost for every host in `hosts` at once,
+    telling them apart by their Host header. With a CA, it's an HTTPS
+    server instead, presenting a certificate for whatever hostname the
+    client asks for (by SNI), unless that host doesn't do HTTPS.
+    """
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, hosts, ca=None, cached_pages=256):
+        self.hosts = hosts
+        self.ca = ca
+        self.scheme = "http" if ca is None else "https"
+        self.stopping = threading.Event()
+        # Pages are generated once and kept for a while, since some
+        # are big and the same ones are asked for again and again.
+        self.pages = LRUCache(cached_pages)
+
+        if ca is not None:
+            # Clients that don't send SNI get a certificate for localhost.
+            self.context = ca.context("localhost")
+            self.context.sni_callback = self.choose_certificate
+
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.port = self.server_address[1]
+
+    def page(self, hostname, path):
+        return self.pages.get(
+            (hostname, path), lambda: self.hosts.host_for(hostname).page(hostname, path))
+
+    def choose_certificate(self, connection, hostname, context):
+        if hostname is None:
+            return None
+        if not self.hosts.host_for(hostname).https:
+            return ssl.ALERT_DESCRIPTION_HANDSHAKE_FAILURE
+        connection.context = self.ca.context_for(hostname)
+        return None
+
+    # Runs in the request's own thread, so do the TLS handshake here
+    # rather than when accepting the connection.
+    def finish_request(self, request, client_address):
+        # Otherwise, responses can wait on the client's delayed ACK of
+        # the TLS session tickets.
+        request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.ca is None:
+            super().finish_request(request, client_address)
+            return
+
+        try:
+            connection = self.context.wrap_socket(request, server_side=True)
+        except (ssl.SSLError, OSError):
+            return
+        with connection:
+            super().finish_request(connection, client_address)
+
+    def shutdown(self):
+        self.stopping.set()
+        super().shutdown()
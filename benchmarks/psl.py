@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+###
+# Benchmark base domain lookups against the Public Suffix List,
+# reporting calls per second for:
+#
+#   * publicsuffixlist's PublicSuffixList.get_public_suffix(), which
+#     scan and gather used before;
+#   * the compiled trie in utils/psl.py, with nothing cached;
+#   * the same, through its LRU cache, over a set of hostnames that
+#     repeat (as they do across a scan's rows).
+#
+# Usage:
+#
+#   python benchmarks/psl.py [--calls 1000000] [--distinct 20000]
+#
+# Uses the copy of the PSL bundled with publicsuffixlist.
+###
+
+import argparse
+import codecs
+import os
+import random
+import sys
+import time
+
+import publicsuffixlist
+from publicsuffixlist.compat import PublicSuffixList
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from utils import psl  # noqa: E402
+
+BUNDLED_PSL = os.path.join(os.path.dirname(publicsuffixlist.__file__), "public_suffix_list.dat")
+
+SUFFIXES = ["gov", "fed.us", "ca.gov", "com", "co.uk", "k12.ca.us", "s3.amazonaws.com"]
+
+
+def hostnames(count, rng):
+    names = []
+    for i in range(count):
+        labels = ["host%i" % rng.randrange(100)] * rng.randrange(3)
+        labels += ["agency%i" % rng.randrange(count), rng.choice(SUFFIXES)]
+        names.append(".".join(labels))
+    return names
+
+
+def measure(name, calls, run):
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    print("%-32s %8.2fs %14s calls/s" % (name, elapsed, "{:,.0f}".format(calls / elapsed)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark base domain lookups.")
+    parser.add_argument("--calls", type=int, default=1000000)
+    parser.add_argument("--distinct", type=int, default=20000,
+                        help="How many different hostnames to look up.")
+    args = parser.parse_args()
+
+    rng = random.Random(18)
+    distinct = hostnames(args.distinct, rng)
+    names = [rng.choice(distinct) for i in range(args.calls)]
+
+    with codecs.open(BUNDLED_PSL, encoding="utf-8") as lines:
+        rules = list(lines)
+
+    start = time.perf_counter()
+    compat = PublicSuffixList(rules)
+    print("PublicSuffixList loaded in %.3fs" % (time.perf_counter() - start))
+    start = time.perf_counter()
+    suffix_list = psl.SuffixList(rules)
+    print("psl.SuffixList compiled in %.3fs\n" % (time.perf_counter() - start))
+
+    print("%i calls, %i distinct hostnames\n" % (args.calls, args.distinct))
+
+    def old():
+        for name in names:
+            compat.get_public_suffix(name)
+
+    def trie():
+        for name in names:
+            suffix_list.find_base_domain(name)
+
+    def cached():
+        for name in names:
+            suffix_list.base_domain_for(name)
+
+    measure("PublicSuffixList", args.calls, old)
+    measure("trie, uncached", args.calls, trie)
+    measure("trie, LRU cache", args.calls, cached)
+    print("\nLRU cache: %s" % suffix_list.stats())
+
+
+if __name__ == '__main__':
+    main()
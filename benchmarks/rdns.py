@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+###
+# Benchmark the rdns gatherer on a synthetic Rapid7-style reverse DNS
+# dump, reporting lines per second for:
+#
+#   * the old approach, parsing every line as JSON;
+#   * the suffix prefilter, in one process;
+#   * the suffix prefilter, with the file read in chunks by a pool
+#     of worker processes;
+#   * the suffix prefilter, reading a gzipped copy of the file.
+#
+# Usage:
+#
+#   python benchmarks/rdns.py [--size-mb 2048] [--workers N] [--keep DIR]
+#
+# The file is generated in a temporary directory (or DIR, where it's
+# reused if already there), with about 1 line in 1000 for .gov.
+###
+
+import argparse
+import gzip
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from gatherers import rdns  # noqa: E402
+
+SUFFIXES = [".gov"]
+
+TLDS = ["com", "net", "org", "edu", "io", "de", "br", "jp"]
+
+
+def synthetic_line(rng):
+    ip = "%i.%i.%i.%i" % tuple(rng.randrange(1, 255) for i in range(4))
+    roll = rng.random()
+    if roll < 0.001:
+        value = "host%i.agency%i.gov" % (rng.randrange(10000), rng.randrange(100))
+    elif roll < 0.002:
+        value = "%s.ip.agency%i.gov" % (ip.replace(".", "-"), rng.randrange(100))
+    else:
+        value = "%s.static.isp%i.%s" % (ip.replace(".", "-"), rng.randrange(1000), rng.choice(TLDS))
+    return json.dumps({
+        "timestamp": str(1510189589 + rng.randrange(100000)),
+        "name": ip, "value": value, "type": "ptr"
+    }, separators=(",", ":")) + "\n"
+
+
+def generate(path, size):
+    rng = random.Random(18)
+    # Repeat a block of distinct lines, which is much faster than
+    # generating every line and doesn't change what's measured.
+    block = "".join(synthetic_line(rng) for i in range(200000)).encode("utf-8")
+    with open(path, "wb") as out:
+        written = 0
+        while written < size:
+            out.write(block)
+            written += len(block)
+
+
+def count_lines(path):
+    with open(path, "rb") as lines:
+        return sum(block.count(b"\n") for block in iter(lambda: lines.read(1 << 24), b""))
+
+
+# The gatherer before the prefilter: every line parsed as JSON.
+def json_every_line(path):
+    found = 0
+    with open(path) as lines:
+        for line in lines:
+            value = json.loads(line)["value"]
+            if (rdns.ip_filter.search(value) is None) and (rdns.number_filter.search(value) is None):
+                found += 1
+    return found
+
+
+def measure(name, lines, run):
+    start = time.perf_counter()
+    found = run()
+    elapsed = time.perf_counter() - start
+    print("%-28s %8.1fs %14s lines/s %10i found" % (
+        name, elapsed, "{:,.0f}".format(lines / elapsed), found))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the rdns gatherer.")
+    parser.add_argument("--size-mb", type=int, default=2048)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--keep", help="Directory to keep (and reuse) the generated files in.")
+    parser.add_argument("--skip-json", action="store_true",
+                        help="Don't time the slow JSON-every-line approach.")
+    args = parser.parse_args()
+
+    directory = args.keep or tempfile.mkdtemp(prefix="rdns-benchmark-")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "rdns-%imb.json" % args.size_mb)
+    gz_path = path + ".gz"
+
+    try:
+        if not os.path.exists(path):
+            print("Generating %s..." % path)
+            generate(path, args.size_mb * 1024 * 1024)
+        if not os.path.exists(gz_path):
+            print("Compressing %s..." % gz_path)
+            with open(path, "rb") as source, gzip.open(gz_path, "wb", compresslevel=1) as out:
+                shutil.copyfileobj(source, out, 1 << 24)
+
+        lines = count_lines(path)
+        print("%s: %i MB, %s lines, %i worker(s)\n" % (
+            path, os.path.getsize(path) // (1024 * 1024), "{:,}".format(lines), args.workers))
+
+        def prefilter(target, workers):
+            return lambda: sum(1 for record in rdns.process_file(target, SUFFIXES, workers))
+
+        if not args.skip_json:
+            measure("json.loads every line", lines, lambda: json_every_line(path))
+        measure("prefilter, 1 process", lines, prefilter(path, 1))
+        if args.workers > 1:
+            measure("prefilter, %i processes" % args.workers, lines, prefilter(path, args.workers))
+        measure("prefilter, gzip", lines, prefilter(gz_path, 1))
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
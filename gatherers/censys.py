@@ -1,8 +1,9 @@
 import csv
+import datetime
 import json
 import logging
 import os
-from typing import List
+from typing import Iterator, List, Optional
 
 from google.cloud import bigquery
 from google.oauth2 import service_account
@@ -15,6 +16,8 @@ from utils import utils
 #
 # --timeout: Override the 10 minute job timeout (specify in seconds).
 # --cache: Use locally cached export data instead of hitting BigQuery.
+# --incremental: Only ask for certificates added since the last run,
+#   and add their hostnames to the cached export data.
 
 # Gathers hostnames from Censys.io via the Google BigQuery API.
 #
@@ -32,37 +35,28 @@ from utils import utils
 # Note that the web console access is based on access given to a Google account,
 # but BigQuery API access via this script depends on access given to
 # Google Cloud *service account* credentials.
+#
+# Results are written to the cached export as they're paged in from
+# BigQuery, rather than all being held in memory first. With
+# --incremental, the latest time a certificate was added to Censys'
+# dataset (its metadata.added_at) is stored alongside the export as a
+# "high-water mark", and the next run only asks for certificates added
+# after it, appending their hostnames to the export. That keeps the
+# cost of each run (in BigQuery bytes, memory and time) down to what
+# has changed. A full query is run when there's no mark yet, or it was
+# made for different suffixes.
 
 # Defaults to 10 minute timeout.
 default_timeout = 60 * 60 * 10
 
+# Rows fetched from BigQuery per page.
+page_size = 10000
+
 
 class Gatherer(Gatherer):
 
     def gather(self):
 
-        # Returns a parsed, processed Google service credentials object.
-        credentials = load_credentials()
-
-        if credentials is None:
-            logging.warning("No BigQuery credentials provided.")
-            logging.warning("Set BIGQUERY_CREDENTIALS or BIGQUERY_CREDENTIALS_PATH environment variables.")
-            exit(1)
-
-        # When using this form of instantiation, the client won't pull
-        # the project_id out of the creds, has to be set explicitly.
-        client = bigquery.Client(
-            project=credentials.project_id,
-            credentials=credentials
-        )
-
-        # Allow override of default timeout (in seconds).
-        timeout = int(self.options.get("timeout", default_timeout))
-
-        # Construct the query.
-        query = query_for(self.suffixes)
-        logging.debug("Censys query:\n%s\n" % query)
-
         # Plan to store in cache/censys/export.csv.
         download_path = utils.cache_path(
             "export", "censys", ext="csv", cache_dir=self.cache_dir)
@@ -75,47 +69,165 @@ class Gatherer(Gatherer):
         # But by default, fetch new data from the BigQuery API,
         # and write it to the expected download location.
         else:
+            # A client can be passed in (for testing), otherwise one
+            # is made with the credentials from the environment.
+            client = self.extra.get("client") or client_for_environment()
+
+            # Allow override of default timeout (in seconds).
+            timeout = int(self.options.get("timeout", default_timeout))
+
             # Ensure cache destination exists.
             utils.mkdir_p(os.path.dirname(download_path))
 
-            logging.warning("Kicking off SQL query job.")
-
-            rows = None
+            export(client, self.suffixes, download_path, timeout,
+                   incremental=self.options.get("incremental", False))
 
-            # Actually execute the query.
-            try:
-                # Executes query and loads all results into memory.
-                query_job = client.query(query)
-                iterator = query_job.result(timeout=timeout)
-                rows = list(iterator)
-            except google.api_core.exceptions.Forbidden:
-                logging.warning("Access denied to Censys' BigQuery tables.")
-            except:
-                logging.warning(utils.format_last_exception())
-                logging.warning("Error talking to BigQuery, aborting.")
+        # Whether we downloaded it fresh or not, read from the cached data.
+        for domain in read_export(download_path):
+            yield domain
+
+
+# Returns a BigQuery client using the credentials given in the
+# environment, or exits if there aren't any.
+def client_for_environment():
+    # Returns a parsed, processed Google service credentials object.
+    credentials = load_credentials()
+
+    if credentials is None:
+        logging.warning("No BigQuery credentials provided.")
+        logging.warning("Set BIGQUERY_CREDENTIALS or BIGQUERY_CREDENTIALS_PATH environment variables.")
+        exit(1)
+
+    # When using this form of instantiation, the client won't pull
+    # the project_id out of the creds, has to be set explicitly.
+    return bigquery.Client(
+        project=credentials.project_id,
+        credentials=credentials
+    )
+
+
+# Run the query and write the hostnames from each certificate to the
+# export CSV as they come in (dupes and all, to be de-duped by the
+# central gathering script). With `incremental`, only certificates
+# added since the high-water mark are asked for and their hostnames
+# appended to the export.
+def export(client, suffixes: List[str], download_path: str, timeout: int,
+           incremental: bool = False) -> None:
+    mark_path = high_water_mark_path(download_path)
+
+    since = None
+    if incremental and os.path.exists(download_path):
+        since = read_high_water_mark(mark_path, suffixes)
+    if since is not None:
+        logging.warning("Asking for certificates added since %s." % since)
+    elif incremental:
+        logging.warning("No high-water mark for these suffixes, running the full query.")
+
+    # Construct the query.
+    query = query_for(suffixes, incremental=incremental, since=since)
+    logging.debug("Censys query:\n%s\n" % query)
+
+    # New hostnames are added to the end of the existing export. A
+    # full export is written to a new file, which only replaces the
+    # old one once it's complete.
+    if since is not None:
+        output_path = download_path
+        output_file = open(output_path, 'a', newline='')
+    else:
+        output_path = "%s.tmp" % download_path
+        output_file = open(output_path, 'w', newline='')
+    output_writer = csv.writer(output_file)
+    if since is None:
+        output_writer.writerow(["Domain"])  # will be skipped on read
+
+    logging.warning("Kicking off SQL query job.")
+
+    rows = 0
+    latest = since
+    try:
+        # Rows are fetched a page at a time as they're iterated over.
+        query_job = client.query(query)
+        for row in query_job.result(timeout=timeout, page_size=page_size):
+            rows += 1
+            domains = (row['common_name'] or []) + (row['dns_names'] or [])
+            for domain in domains:
+                output_writer.writerow([domain])
+
+            if incremental:
+                added_at = timestamp_for(row['added_at'])
+                if (latest is None) or (added_at > latest):
+                    latest = added_at
+    except google.api_core.exceptions.Forbidden:
+        logging.warning("Access denied to Censys' BigQuery tables.")
+        output_file.close()
+        exit(1)
+    except:
+        logging.warning(utils.format_last_exception())
+        logging.warning("Error talking to BigQuery, aborting.")
+        output_file.close()
+        exit(1)
+
+    # End CSV writing.
+    output_file.close()
+    if output_path != download_path:
+        os.replace(output_path, download_path)
+    logging.warning("Cached hostnames from %i result rows." % rows)
+
+    # Only move the mark once the export has everything before it.
+    if incremental:
+        write_high_water_mark(mark_path, suffixes, latest)
+    elif os.path.exists(mark_path):
+        # A full export written without tracking the mark means the
+        # mark no longer describes it.
+        os.remove(mark_path)
+
+
+# Hostnames in the cached export, read one at a time.
+def read_export(download_path: str) -> Iterator[str]:
+    with open(download_path, newline='') as csvfile:
+        for row in csv.reader(csvfile):
+            # Skip empty rows, and the header row.
+            if (not row) or (not row[0].strip()):
+                continue
+            domain = row[0].lower()
+            if domain == "domain":
+                continue
+            yield domain
+
+
+def high_water_mark_path(download_path: str) -> str:
+    return os.path.join(os.path.dirname(download_path), "high-water-mark.json")
+
+
+# The stored high-water mark, if there is one for these suffixes.
+def read_high_water_mark(mark_path: str, suffixes: List[str]) -> Optional[str]:
+    if not os.path.exists(mark_path):
+        return None
 
-            # At this point, the job is complete and we need to download
-            # the resulting CSV URL in results_url.
-            logging.warning("Caching results of SQL query.")
+    mark = json.loads(utils.read(mark_path))
+    if sorted(mark.get("suffixes", [])) != sorted(suffixes):
+        return None
+    return mark.get("added_at")
 
-            download_file = open(download_path, 'w', newline='')
-            download_writer = csv.writer(download_file)
-            download_writer.writerow(["Domain"])  # will be skipped on read
 
-            # Parse the rows and write them out as they were returned (dupes
-            # and all), to be de-duped by the central gathering script.
-            for row in rows:
-                domains = row['common_name'] + row['dns_names']
-                for domain in domains:
-                    download_writer.writerow([domain])
+def write_high_water_mark(mark_path: str, suffixes: List[str], added_at: Optional[str]) -> None:
+    if added_at is None:
+        # Nothing has ever been found, so there's nothing to go on from.
+        return
+    utils.write(utils.json_for({
+        "suffixes": sorted(suffixes),
+        "added_at": added_at
+    }), mark_path)
 
-            # End CSV writing.
-            download_file.close()
 
-        # Whether we downloaded it fresh or not, read from the cached data.
-        for domain in utils.load_domains(download_path):
-            if domain:
-                yield domain
+# BigQuery returns TIMESTAMPs as (UTC) datetimes; store and compare
+# them as ISO 8601 strings, which sort the same way.
+def timestamp_for(value) -> str:
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return value.strftime("%Y-%m-%d %H:%M:%S.%f+00:00")
+    return str(value)
 
 
 # Constructs the query to run in BigQuery, against Censys'
@@ -135,12 +247,20 @@ class Gatherer(Gatherer):
 #     OR sans LIKE "%.gov")
 #   OR (common_names LIKE "%.fed.us"
 #     OR sans LIKE "%.fed.us");
-def query_for(suffixes: List[str]) -> str:
-
-    select = "\n".join([
-        "    parsed.subject.common_name,",
+#
+# For --incremental, each certificate's metadata.added_at is selected as
+# well, and with `since`, only certificates added after then are asked
+# for.
+def query_for(suffixes: List[str], incremental: bool = False,
+              since: Optional[str] = None) -> str:
+
+    select_columns = [
+        "    parsed.subject.common_name",
         "    parsed.extensions.subject_alt_name.dns_names",
-    ])
+    ]
+    if incremental:
+        select_columns.append("    metadata.added_at")
+    select = ",\n".join(select_columns)
 
     from_clause = "\n".join([
         "    `censys-io.certificates_public.certificates`,",
@@ -158,6 +278,13 @@ def query_for(suffixes: List[str]) -> str:
     # Join the individual suffix clauses into one WHERE clause.
     where = str.join("\n    OR ", [suffix_query(suffix) for suffix in suffixes])
 
+    # Only certificates added since the high-water mark.
+    if since is not None:
+        where = "\n".join([
+            "(%s)" % where,
+            "    AND metadata.added_at > TIMESTAMP(\"%s\")" % since,
+        ])
+
     query = "\n".join([
         "SELECT",
         select,
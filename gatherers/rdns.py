@@ -1,7 +1,11 @@
+import gzip
+import io
 import json
 import logging
+import multiprocessing
+import os
 import re
-from typing import Generator, List, Pattern
+from typing import BinaryIO, Generator, Iterable, List, Optional, Pattern, Tuple, Union
 
 from gatherers.gathererabc import Gatherer
 
@@ -9,12 +13,14 @@ from gatherers.gathererabc import Gatherer
 #
 # Given a path to a (local) "JSON Lines" formatted file,
 # based on Rapid7's Reverse DNS data, pull out the domains
-# that match the given suffixes.
+# that match the given suffixes. The file may be gzipped.
 #
-# Bearing in mind that the gathering system currently loads
-# all domains into memory in order to dedupe them, it may be
-# easiest to use this on a file that has been pre-filtered in
-# some way (such as by grepping for the intended suffix).
+# These files are huge, and almost none of their lines are for the
+# suffixes we want, so the raw bytes are searched for the suffixes a
+# block at a time, and only the few lines that match are parsed as
+# JSON. Uncompressed files are also split into chunks that are read in
+# parallel, by a pool of --rdns-workers processes (by default, one per
+# CPU).
 
 # Best-effort filter for hostnames which are just reflected IPs.
 # IP addresses often use dots or dashes.
@@ -26,6 +32,9 @@ ip_filter = re.compile(r"^(\w+[\-\.]?)?\d+[\-\.]\d+[\-\.]\d+[\-\.]\d+")
 # is just a best-effort to cut down noise.)
 number_filter = re.compile(r"^[\d\-]+\.")
 
+# Size in bytes of each chunk of an uncompressed file given to a worker.
+chunk_size = 64 * 1024 * 1024
+
 
 class Gatherer(Gatherer):
 
@@ -41,19 +50,39 @@ class Gatherer(Gatherer):
             logging.warning("--rdns is required to be a path to a local file.")
             exit(1)
 
-        with open(path) as lines:
-            logging.debug("\tReading %s..." % path)
+        workers = int(self.options.get("rdns_workers", os.cpu_count() or 1))
+
+        logging.debug("\tReading %s..." % path)
+        for record in process_file(path, self.suffixes, workers):
+            yield record
 
-            for record in process_lines(lines, ip_filter, number_filter):
-                yield record
 
+# Each suffix as it would end a "value" in the raw JSON, e.g. b'.gov"'.
+def suffix_markers(suffixes: Optional[List[str]]) -> Optional[Tuple[bytes, ...]]:
+    if not suffixes:
+        return None
+    return tuple(("%s\"" % suffix).encode("utf-8") for suffix in suffixes)
 
-def process_lines(lines: List[str], ip_filter: Pattern,
-                  number_filter: Pattern) -> Generator[str, str, None]:
+
+def process_lines(lines: Iterable[Union[str, bytes]], ip_filter: Pattern,
+                  number_filter: Pattern,
+                  suffixes: Optional[List[str]] = None) -> Generator[str, str, None]:
+    markers = suffix_markers(suffixes)
     for line in lines:
+        # Skip lines that can't be for one of our suffixes without
+        # parsing them. (This doesn't catch every line we'll end up
+        # dropping, just the vast majority of them.)
+        if markers is not None:
+            raw = line if isinstance(line, bytes) else line.encode("utf-8")
+            if not any(marker in raw for marker in markers):
+                continue
+
         record = json.loads(line)
         # logging.debug("\t%s" % record["value"])
 
+        if (markers is not None) and (not record["value"].endswith(tuple(suffixes))):
+            continue
+
         # Filter out IP-like reflected addresses.
         is_ip = (ip_filter.search(record["value"]) is not None)
 
@@ -62,3 +91,101 @@ def process_lines(lines: List[str], ip_filter: Pattern,
 
         if (not is_ip) and (not is_number):
             yield record["value"]
+
+
+# Search whole blocks of a binary stream for the suffix markers at a
+# time, rather than looking at every line, yielding just the lines that
+# contain one. With no markers, yields every line.
+def candidate_lines(stream: BinaryIO, markers: Optional[Tuple[bytes, ...]],
+                    block_size: int = 4 * 1024 * 1024) -> Generator[bytes, None, None]:
+    if markers is None:
+        yield from stream
+        return
+
+    rest = b""
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        # Hold back any partial line at the end for the next block.
+        block = rest + block
+        cut = block.rfind(b"\n") + 1
+        block, rest = block[:cut], block[cut:]
+        yield from lines_containing(block, markers)
+
+    yield from lines_containing(rest, markers)
+
+
+# The lines of a block of text that contain any of the markers, in order.
+def lines_containing(block: bytes, markers: Tuple[bytes, ...]) -> List[bytes]:
+    spans = set()
+    for marker in markers:
+        found = block.find(marker)
+        while found != -1:
+            start = block.rfind(b"\n", 0, found) + 1
+            end = block.find(b"\n", found)
+            end = len(block) if end == -1 else end + 1
+            spans.add((start, end))
+            found = block.find(marker, end)
+    return [block[start:end] for start, end in sorted(spans)]
+
+
+# Byte ranges covering a file, of about `size` bytes each.
+def chunks_for(path: str, size: Optional[int] = None) -> List[Tuple[int, int]]:
+    size = size or chunk_size
+    total = os.path.getsize(path)
+    return [(start, min(start + size, total)) for start in range(0, total, size)]
+
+
+# The lines that start within a byte range of a file, as one block. (A
+# line that spans the end of the range belongs to this one; the next
+# range skips it.)
+def read_chunk(path: str, start: int, end: int) -> bytes:
+    with open(path, "rb") as lines:
+        position = start
+        if start > 0:
+            # Skip the rest of the line the range starts in, unless
+            # it starts right at the beginning of one.
+            lines.seek(start - 1)
+            position = start - 1 + len(lines.readline())
+
+        if position >= end:
+            return b""
+        block = lines.read(end - position)
+        if not block.endswith(b"\n"):
+            block += lines.readline()
+        return block
+
+
+# Run in a worker process: the hostnames in one chunk of a file.
+def process_chunk(args: Tuple[str, int, int, Optional[List[str]]]) -> List[str]:
+    path, start, end, suffixes = args
+    lines = candidate_lines(io.BytesIO(read_chunk(path, start, end)), suffix_markers(suffixes))
+    return list(process_lines(lines, ip_filter, number_filter, suffixes))
+
+
+def process_file(path: str, suffixes: Optional[List[str]] = None,
+                 workers: int = 1) -> Generator[str, None, None]:
+    markers = suffix_markers(suffixes)
+
+    # Compressed files can only be read from the start, so are read
+    # as one stream.
+    if path.endswith(".gz"):
+        with gzip.open(path, "rb") as lines:
+            yield from process_lines(
+                candidate_lines(lines, markers), ip_filter, number_filter, suffixes)
+        return
+
+    chunks = chunks_for(path)
+    if workers <= 1 or len(chunks) <= 1:
+        with open(path, "rb") as lines:
+            yield from process_lines(
+                candidate_lines(lines, markers), ip_filter, number_filter, suffixes)
+        return
+
+    logging.debug("\tReading %i chunks with %i workers..." % (len(chunks), workers))
+    # Gatherers run in threads, which don't mix well with fork().
+    with multiprocessing.get_context("spawn").Pool(workers) as pool:
+        tasks = [(path, start, end, suffixes) for start, end in chunks]
+        for records in pool.imap(process_chunk, tasks):
+            yield from records
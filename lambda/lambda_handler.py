@@ -2,7 +2,7 @@ import importlib
 import sys
 import logging
 
-from utils import utils
+from utils import resolver, utils
 
 # Central handler for all Lambda events.
 def handler(event, context):
@@ -25,6 +25,10 @@ def handler(event, context):
         logging.error("[%s] Scanner not found, or had an error during loading.\n\tERROR: %s\n\t%s" % (name, exc_type, exc_value))
         exit(1) # ?
 
+    # Warm containers keep the DNS cache between invocations.
+    if not options.get('no_dns_cache'):
+        resolver.install()
+
     # Same method call as when run locally.
     data = scanner.scan(domain, environment, options)
 
@@ -3,6 +3,7 @@ import csv
 import json
 
 from collections import defaultdict
+from itertools import groupby, islice
 from statistics import mean
 
 from utils.utils import mkdir_p, results_dir
@@ -37,27 +38,84 @@ class A11yProcessor(object):
         ]
     }
 
-    def __init__(self, a11y_path, domains_path):
-        self.a11y_raw = self.read_csv(a11y_path)
+    # Number of a11y.csv rows cleaned and aggregated at a time.
+    CHUNK_SIZE = 10000
+
+    def __init__(self, a11y_path, domains_path, chunk_size=CHUNK_SIZE):
+        self.a11y_path = a11y_path
+        self.chunk_size = chunk_size
         self.domain_raw = self.read_csv(domains_path)
         self.domain_to_agency = {d[0].lower(): d[2] for d in self.domain_raw}
         self.agency_to_branch = {a: b for b in self.BRANCHES for a in self.BRANCHES[b]}
 
+    @property
+    def a11y_raw(self):
+        # Only read into memory on request: run() streams the file.
+        return self.read_csv(self.a11y_path)
+
     def run(self):
-        data = [self.clean_row(d) for d in self.a11y_raw]
+        mkdir_p(results_dir({}))
+
+        # a11y.json holds every error row, so it is written out one
+        # domain at a time while the per-domain counts are tallied.
+        # The agency and domain summaries only need those counts.
+        path = '{}/{}.json'.format(results_dir({}), 'a11y')
+        with open(path, 'w+') as f:
+            if self.is_grouped_by_domain(self.a11y_path):
+                domain_stats = self.write_a11y_data(f, self.iter_clean_rows())
+            else:
+                # Rows for a domain are spread out, so they can't be
+                # written out as they are read: fall back to memory.
+                data = list(self.iter_clean_rows())
+                json.dump(self.make_a11y_data(data), f, indent=2)
+                domain_stats = self.make_domain_data(data)['data']
 
         parsed_datasets = [
-            ('a11y', self.make_a11y_data(data)),
-            ('agencies', self.make_agency_data(data)),
-            ('domains', self.make_domain_data(data)),
+            ('agencies', self.summarize_agencies(domain_stats)),
+            ('domains', {'data': domain_stats}),
         ]
 
-        mkdir_p(results_dir({}))
         for name, data in parsed_datasets:
             path = '{}/{}.json'.format(results_dir({}), name)
             with open(path, 'w+') as f:
                 json.dump(data, f, indent=2)
 
+    def iter_clean_rows(self):
+        rows = self.iter_csv(self.a11y_path)
+        while True:
+            chunk = [self.clean_row(d) for d in islice(rows, self.chunk_size)]
+            if not chunk:
+                return
+            yield from chunk
+
+    def write_a11y_data(self, f, data):
+        """
+        Stream the a11y.json document for rows grouped by domain to f,
+        producing the same output as json.dump(make_a11y_data(data)).
+
+        Returns the make_domain_data() entries for the rows.
+        """
+        domain_stats = {}
+
+        f.write('{\n  "data": {')
+        first = True
+        for domain, rows in groupby(data, key=lambda d: d['domain']):
+            errors = defaultdict(list)
+            for d in rows:
+                self.add_domain_stats(domain_stats, d)
+                if 'error' in d:
+                    errors[d['error']].append(d['error_details'])
+                else:
+                    errors = defaultdict(list)
+
+            entry = json.dumps(domain)
+            entry += ': ' + json.dumps(errors, indent=2).replace('\n', '\n    ')
+            f.write(('\n    ' if first else ',\n    ') + entry)
+            first = False
+        f.write('}\n}' if first else '\n  }\n}')
+
+        return list(domain_stats.values())
+
     def clean_row(self, row):
         domain = row[0].lower()
         agency = self.domain_to_agency.get(domain, 'N/A')
@@ -93,9 +151,12 @@ class A11yProcessor(object):
         return {'data': json.loads(json.dumps(results))}
 
     def make_agency_data(self, data):
+        return self.summarize_agencies(self.make_domain_data(data)['data'])
+
+    def summarize_agencies(self, domain_data):
         # first, group domain stats by agency
         data_by_agency = defaultdict(list)
-        for d in self.make_domain_data(data)['data']:
+        for d in domain_data:
             data_by_agency[d['agency']].append(d)
 
         # then, compute summary stats across groups
@@ -122,22 +183,25 @@ class A11yProcessor(object):
     def make_domain_data(self, data):
         results = {}
         for d in data:
-            dom = d['domain']
-            if dom not in results:
-                results[dom] = {
-                    'agency': d['agency'],
-                    'branch': d['branch'],
-                    'canonical': dom,
-                    'domain': dom,
-                    'errors': 0,
-                    'errorlist': {e: 0 for e in self.ERRORS.values()}
-                }
-            if 'error' in d:
-                results[dom]['errors'] += 1
-                results[dom]['errorlist'][d['error']] += 1
+            self.add_domain_stats(results, d)
 
         return {'data': list(results.values())}
 
+    def add_domain_stats(self, results, d):
+        dom = d['domain']
+        if dom not in results:
+            results[dom] = {
+                'agency': d['agency'],
+                'branch': d['branch'],
+                'canonical': dom,
+                'domain': dom,
+                'errors': 0,
+                'errorlist': {e: 0 for e in self.ERRORS.values()}
+            }
+        if 'error' in d:
+            results[dom]['errors'] += 1
+            results[dom]['errorlist'][d['error']] += 1
+
     def get_error_category(self, code):
         error_id = code.split('.')[2].split('Guideline')[1]
         return self.ERRORS.get(error_id, 'Other Errors')
@@ -149,6 +213,27 @@ class A11yProcessor(object):
             next(reader)  # TODO: make header row skip configurable
             return [row for row in reader]
 
+    @staticmethod
+    def iter_csv(filename):
+        with open(filename, 'r') as f:
+            reader = csv.reader(f)
+            next(reader)  # TODO: make header row skip configurable
+            yield from reader
+
+    @classmethod
+    def is_grouped_by_domain(cls, filename):
+        # scan writes all of a domain's rows together, but check.
+        seen = set()
+        previous = None
+        for row in cls.iter_csv(filename):
+            domain = row[0].lower()
+            if domain != previous:
+                if domain in seen:
+                    return False
+                seen.add(domain)
+                previous = domain
+        return True
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
@@ -1,3 +1,7 @@
+import io
+import json
+import os
+import tempfile
 import unittest
 
 from .context import a11y  # noqa
@@ -44,6 +48,34 @@ class ProcessA11yTestCase(unittest.TestCase):
             'Other Errors'
         )
 
+    def test_streamed_a11y_data(self):
+        data = [self.a11y.clean_row(d) for d in self.a11y.a11y_raw]
+        streamed = io.StringIO()
+        domain_stats = self.a11y.write_a11y_data(streamed, iter(data))
+        self.assertEqual(
+            streamed.getvalue(),
+            json.dumps(self.a11y.make_a11y_data(data), indent=2)
+        )
+        self.assertEqual(domain_stats, self.a11y.make_domain_data(data)['data'])
+
+    def test_streamed_a11y_data_empty(self):
+        streamed = io.StringIO()
+        self.assertEqual(self.a11y.write_a11y_data(streamed, iter([])), [])
+        self.assertEqual(streamed.getvalue(), json.dumps({'data': {}}, indent=2))
+
+    def test_grouped_by_domain(self):
+        self.assertTrue(A11yProcessor.is_grouped_by_domain(self.a11y_filename))
+
+        rows = self.a11y.a11y_raw
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('Domain,Base Domain,redirectedTo,typeCode,code,message,context,selector\n')
+            for row in [rows[0], ['achp.gov'] + rows[0][1:], rows[1]]:
+                f.write(','.join('"%s"' % c.replace('"', '""') for c in row) + '\n')
+        try:
+            self.assertFalse(A11yProcessor.is_grouped_by_domain(f.name))
+        finally:
+            os.remove(f.name)
+
 
 if __name__ == '__main__':
     unittest.main()
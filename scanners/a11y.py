@@ -75,6 +75,11 @@ def init(environment, options):
 # data says so, adjust scan URL for some domains.
 def init_domain(domain, environment, options):
     cache_dir = options.get("_", {}).get("cache_dir", "./cache")
+    # If pre-resolution (--preresolve) found no addresses, skip it.
+    if utils.domain_doesnt_resolve(domain, environment):
+        logging.debug("\tSkipping, domain doesn't resolve.")
+        return False
+
     # If we've got pshtt data, use it to cut down work.
     if (
         utils.domain_is_redirect(domain, cache_dir=cache_dir) or
@@ -18,6 +18,11 @@ user_agent = "github.com/18f/domain-scan, csp.py"
 
 def init_domain(domain, environment, options):
     cache_dir = options.get("_", {}).get("cache_dir", "./cache")
+    # If pre-resolution (--preresolve) found no addresses, skip it.
+    if utils.domain_doesnt_resolve(domain, environment):
+        logging.debug("\tSkipping, domain doesn't resolve.")
+        return False
+
     # If we have data from pshtt, skip if it's not a live domain.
     if utils.domain_not_live(domain, cache_dir=cache_dir):
         logging.debug("\tSkipping, domain not reachable during inspection.")
@@ -1,3 +1,7 @@
+import logging
+
+from utils import utils
+
 # Evaluate DAP participation using Chrome headless.
 
 # Can also be run in Lambda.
@@ -10,6 +14,11 @@ scan_headless = True
 
 # make sure we have the domain/url stuff set up properly
 def init_domain(domain, environment, options):
+    # If pre-resolution (--preresolve) found no addresses, skip it.
+    if utils.domain_doesnt_resolve(domain, environment):
+        logging.debug("\tSkipping, domain doesn't resolve.")
+        return False
+
     # To scan, we need a URL, not just a domain.
     url = None
     if not (domain.startswith('http://') or domain.startswith('https://')):
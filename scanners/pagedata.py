@@ -9,6 +9,8 @@ from urllib.parse import urlparse
 import ijson
 import requests
 
+from utils import trace
+
 ###
 # Very simple scanner that gets some basic info from a list of pages on a domain.
 
@@ -67,6 +69,8 @@ def scan(domain: str, environment: dict, options: dict) -> dict:
     # Perform the "task".
     for page in environment['pages']:
         url = "https://" + domain + page
+        # With --trace, a span for each page.
+        page_span = trace.span(page, url=url).start()
         results[page] = {}
         results[page]['opendata_conforms_to'] = ''
         results[page]['codegov_measurementtype'] = ''
@@ -173,6 +177,7 @@ def scan(domain: str, environment: dict, options: dict) -> dict:
             except Exception:
                 logging.debug("got error while scraping %s", domain)
 
+        page_span.finish(responsecode=results[page]['responsecode'])
         logging.debug('memory usage after page %s: %d', url, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
 
     logging.debug('memory usage for pagedata %s: %d', "https://" + domain, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
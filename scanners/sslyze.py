@@ -4,17 +4,35 @@
 # If data exists for a domain from `pshtt`, will check results
 # and only process domains with valid HTTPS, or broken chains.
 #
+# Connectivity checks that fail and scan commands that time out are
+# retried after a delay. Run locally, the domain is handed back to the
+# scan runner to retry later rather than holding up a worker.
+#
 # Supported options:
 #
-# --sslyze-serial - If set, will use a synchronous (single-threaded
-#   in-process) scanner. Defaults to true.
+# --sslyze-serial - If set, will send each of a host's scan commands
+#   to sslyze on its own, one after another, instead of all of them as
+#   a single request. Defaults to false.
 # --sslyze-certs - If set, will use the CertificateInfoScanner and
 #   return certificate info. Defaults to true.
+# --sslyze-connections-per-server - The maximum number of concurrent
+#   connections sslyze opens to any one server. Defaults to 5.
+# --sslyze-concurrent-servers - The maximum number of servers sslyze
+#   scans at the same time. Defaults to the number of workers.
+# --sslyze-dedup - Scan each TLS endpoint only once, and share the
+#   result with every other domain that leads to it. Either "endpoint",
+#   to match on resolved IP, port and SNI name, or "canonical", to
+#   match on the (canonical) hostname and port. Off by default, and
+#   only applies to local scans.
 ###
 
+import copy
 import logging
 import datetime
+import queue
+import threading
 import time
+from concurrent.futures import Future
 from typing import Any
 from pathlib import Path  # Python3
 
@@ -40,11 +58,13 @@ from sslyze.errors import ConnectionToServerFailed  # type: ignore
 from sslyze.plugins.certificate_info.implementation import (  # type: ignore
     CertificateInfoExtraArguments,
 )
+from sslyze.plugins.certificate_info._symantec import SymantecDistructTester  # type: ignore
 from sslyze.plugins.scan_commands import ScanCommand  # type: ignore
 
 import idna
 import cryptography
 import cryptography.hazmat.backends.openssl
+from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.serialization import Encoding
 from cryptography.hazmat.primitives.asymmetric import ec, dsa, rsa
 
@@ -52,9 +72,9 @@ import re
 
 import dns
 import dns.resolver
-import socket
 
-from utils import FAST_CACHE_KEY, utils
+from utils import FAST_CACHE_KEY, IN_FLIGHT_KEY, fast_cache, resolver, trace, utils
+from utils.lru_cache import LRUCache
 
 # Number of seconds to wait during sslyze connection check.
 # Not much patience here, and very willing to move on.
@@ -67,6 +87,75 @@ lambda_support = True
 # for verifying the cert chain
 CA_FILE = None
 
+# The cipher suite scan commands run against every host, in the order
+# their results are returned by scan_server().
+CIPHER_SUITE_SCAN_COMMANDS = [
+    ScanCommand.SSL_2_0_CIPHER_SUITES,
+    ScanCommand.SSL_3_0_CIPHER_SUITES,
+    ScanCommand.TLS_1_0_CIPHER_SUITES,
+    ScanCommand.TLS_1_1_CIPHER_SUITES,
+    ScanCommand.TLS_1_2_CIPHER_SUITES,
+    ScanCommand.TLS_1_3_CIPHER_SUITES,
+]
+
+# Seconds to wait before each retry of a connectivity check that
+# failed, or of scan commands that timed out.
+retry_delays = [10, 30]
+
+# The sslyze engine shared by every worker thread in this process.
+# Created by the first scan that needs it.
+engine = None
+engine_lock = threading.Lock()
+
+# How many sslyze Scanners the engine runs side by side.
+engine_scanners = 4
+
+
+class SharedResults(object):
+    """
+    Scan results shared between domains that lead to the same TLS
+    endpoint, for --sslyze-dedup.
+
+    The first worker to claim a key scans it; any others that claim
+    the same key meanwhile wait for that scan to finish rather than
+    repeating it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.results = {}
+        self.in_flight = {}
+
+    # Return (domain, data) if the endpoint has already been scanned,
+    # or None if the caller now owns the scan and must release() it.
+    def claim(self, key):
+        while True:
+            with self.lock:
+                if key in self.results:
+                    return self.results[key]
+                scanning = self.in_flight.get(key)
+                if scanning is None:
+                    self.in_flight[key] = threading.Event()
+                    return None
+            scanning.wait()
+
+    # Finish a claim, with the result or with None if there isn't one
+    # to share (so the next worker to claim the key scans it instead).
+    def release(self, key, domain=None, data=None):
+        with self.lock:
+            if data is not None:
+                self.results[key] = (domain, copy.deepcopy(data))
+            self.in_flight.pop(key).set()
+
+
+shared_results = SharedResults()
+
+
+# Set up the fast cache, loading any STARTTLS mail server results kept
+# from earlier runs (with --fast-cache-ttl).
+def init(environment, options):
+    return fast_cache.environment_for('sslyze', options)
+
 
 # If we have pshtt data, use it to skip some domains, and to adjust
 # scan hostnames to canonical URLs where we can.
@@ -99,16 +188,21 @@ def init_domain(domain, environment, options):
             else:
                 hostname = domain
 
-            hosts_to_scan.append({
-                'hostname': hostname,
-                'port': 443,
-                'starttls_smtp': False
-            })
+            # Don't wait out a connection timeout on a hostname that
+            # pre-resolution (--preresolve) found has no addresses.
+            if utils.host_doesnt_resolve(hostname, environment):
+                logging.warning('\t{} does not resolve'.format(hostname))
+            else:
+                hosts_to_scan.append({
+                    'hostname': hostname,
+                    'port': 443,
+                    'starttls_smtp': False
+                })
 
     # If we have trustymail data, see if there are any mail servers
     # that support STARTTLS that we should scan
     mail_servers_to_test = utils.domain_mail_servers_that_support_starttls(domain, cache_dir=cache_dir)
-    for mail_server in mail_servers_to_test:
+    for mail_server in sorted(mail_servers_to_test):
         # Check if we already have results for this mail server,
         # possibly from a different domain.
         #
@@ -119,8 +213,13 @@ def init_domain(domain, environment, options):
         # often use the same SMTP servers, so it makes sense to check
         # if we have already hit this mail server when testing a
         # different domain.
+        #
+        # If another worker is scanning this mail server right now,
+        # wait for its result rather than connecting to it as well.
         cached_value = None
         if FAST_CACHE_KEY in environment:
+            if IN_FLIGHT_KEY in environment:
+                environment[IN_FLIGHT_KEY].claim(mail_server, domain, environment[FAST_CACHE_KEY])
             cached_value = environment[FAST_CACHE_KEY].get(mail_server, None)
 
         if cached_value is None:
@@ -153,8 +252,18 @@ def scan(domain, environment, options):
         'starttls_smtp': False
     }
 
+    # Progress on each host from earlier attempts at this domain, if
+    # the scan was deferred to retry some of them.
+    retry_state = environment.get('retry_state') or {}
+    deferred = []
+
     retVal = []
     for host_to_scan in environment.get('hosts_to_scan', [default_host]):
+        key = "{}:{}".format(host_to_scan.get('hostname'), host_to_scan.get('port'))
+        state = retry_state.setdefault(key, {})
+        if 'data' in state:
+            retVal.append(state['data'])
+            continue
 
         data = {
             'hostname': host_to_scan.get('hostname'),
@@ -164,11 +273,16 @@ def scan(domain, environment, options):
             'protocols': {},
             'config': {},
             'certs': {},
-            'errors': []
+            'errors': [],
+            'shared_from': None
         }
 
         # Run the SSLyze scan on the given hostname.
-        response = run_sslyze(data, environment, options)
+        try:
+            response = run_sslyze_shared(domain, data, environment, options, state)
+        except utils.DeferredRetry as retry:
+            deferred.append(retry)
+            continue
 
         # Error condition.
         if response is None:
@@ -179,14 +293,40 @@ def scan(domain, environment, options):
         # Join all errors into a string before returning.
         data['errors'] = ' '.join(data['errors'])
 
+        state['data'] = data
         retVal.append(data)
 
+    # Come back to any hosts that need another try once the longest
+    # of their delays has passed.
+    if deferred:
+        raise utils.DeferredRetry(
+            max(retry.delay for retry in deferred),
+            " ".join(retry.reason for retry in deferred),
+            state=retry_state
+        )
+
     # Return the scan results together with the already-cached results
     # (if there were any)
     retVal.extend(environment['cached_data'])
     return retVal
 
 
+# Stop the shared sslyze engine once all domains have been scanned,
+# and report how well the certificate cache did.
+def finalize(environment, options):
+    global engine
+
+    with engine_lock:
+        if engine is not None:
+            engine.stop()
+            engine = None
+
+    stats = cert_cache.stats()
+    if stats['hit_rate'] is not None:
+        logging.warning("Certificate cache: {} hits, {} misses ({:.0%} hit rate).".format(
+            stats['hits'], stats['misses'], stats['hit_rate']))
+
+
 def post_scan(domain: str, data: Any, environment: dict, options: dict):
     """Post-scan hook for sslyze
 
@@ -279,7 +419,9 @@ def to_rows(data):
 
             str.join(', ', row.get('ciphers', [])),
 
-            row.get('errors')
+            row.get('errors'),
+
+            row.get('shared_from')
         ])
 
     return retVal
@@ -316,7 +458,9 @@ headers = [
 
     "Accepted Ciphers",
 
-    "Errors"
+    "Errors",
+
+    "Shared Result From"
 ]
 
 
@@ -325,39 +469,74 @@ headers = [
 # Certificate PEM data must be separately parsed using
 # the Python cryptography module.
 
-def run_sslyze(data, environment, options):
-    # Each sslyze worker can use a sync or parallel mode.
-    #
-    # SynchronousScanner can show memory leaks when parsing certs,
-    # so local scanning defaults to using ConcurrentScanner.
-    #
-    # And Lambda can't use multiprocessing.Queue, so in the cloud,
-    # this default cannot be overridden.
-    scan_method = environment.get("scan_method", "local")
-
-    if scan_method == "lambda":
-        sync = True
+# With --sslyze-dedup, reuse the result of any other domain's scan of
+# the same endpoint, or scan it and share the result.
+def run_sslyze_shared(domain, data, environment, options, state):
+    mode = options.get("sslyze_dedup")
+    if not mode or environment.get("scan_method") != "local":
+        return run_sslyze(data, environment, options, state)
+
+    hostname, port = data['hostname'], data['port']
+    if mode == "endpoint":
+        if 'server_location' not in state:
+            try:
+                state['server_location'] = ServerNetworkLocationViaDirectConnection.with_ip_address_lookup(hostname=hostname, port=port)
+            except Exception:
+                # Let the scan itself report the failure.
+                return run_sslyze(data, environment, options, state)
+        key = (state['server_location'].ip_address, port, hostname, data['starttls_smtp'])
+    elif mode == "canonical":
+        key = (hostname, port, data['starttls_smtp'])
     else:
-        sync = eval(options.get("sslyze_serial", "True"))
+        raise ValueError("Unknown --sslyze-dedup mode: {}".format(mode))
+
+    shared = shared_results.claim(key)
+    if shared is not None:
+        source, shared_data = shared
+        logging.debug("\t{}:{} Using result shared from {}.".format(hostname, port, source))
+        data.update(copy.deepcopy(shared_data))
+        data['shared_from'] = source
+        return data
 
-    # Initialize either a synchronous or concurrent scanner.
-    server_info, scanner = init_sslyze(data['hostname'], data['port'], data['starttls_smtp'], options, sync=sync)
+    response = None
+    try:
+        response = run_sslyze(data, environment, options, state)
+    finally:
+        shared_results.release(key, domain, response)
+    return response
+
+
+def run_sslyze(data, environment, options, state):
+    hostname, port = data['hostname'], data['port']
+
+    server_info = state.get('server_info')
+    while server_info is None:
+        try:
+            with trace.span("connectivity", hostname=hostname, port=port):
+                server_info = init_sslyze(hostname, port, data['starttls_smtp'], options, retry=('connect' in state), server_location=state.get('server_location'))
+        except ConnectionToServerFailed:
+            # Usually pshtt has already established that we can connect
+            # to the site, so let's try again a couple of times.
+            if retry_later(environment, state, 'connect', "{}:{} Server connectivity check failed.".format(hostname, port)):
+                continue
+            logging.warning("\t{}:{} Server connectivity not established during test.".format(hostname, port))
+        break
 
     if server_info is None:
         data['errors'].append("Connectivity not established.")
         try:
-            data['ip'] = socket.gethostbyname(data['hostname'])
+            data['ip'] = resolver.gethostbyname(data['hostname'])
         except:
             pass
         return data
     
+    state['server_info'] = server_info
     data['ip'] = server_info.server_location.ip_address
 
-    # Whether sync or concurrent, get responses for all scans.
-    if sync:
-        sslv2, sslv3, tlsv1, tlsv1_1, tlsv1_2, tlsv1_3, certs, reneg = scan_serial(scanner, server_info, data, options)
-    else:
-        sslv2, sslv3, tlsv1, tlsv1_1, tlsv1_2, tlsv1_3, certs, reneg = scan_parallel(scanner, server_info, data, options)
+    # Every scan command for the host goes to sslyze as one request,
+    # unless --sslyze-serial.
+    sslv2, sslv3, tlsv1, tlsv1_1, tlsv1_2, tlsv1_3, certs, reneg = scan_server(
+        get_engine(environment, options), server_info, data, environment, options, state)
 
     # Analyze protocols if all the scanners functioned.
     # Very difficult to draw conclusions if some worked and some did not, but try to be as fault tolerant as possible.
@@ -495,8 +674,7 @@ def analyze_certs(certs):
 
             try:
                 # TODO: served certs are not necessarily in order so may need to check order
-                highest_served = parse_cert(served_chain[-1])
-                issuer = cert_issuer_name(highest_served)
+                issuer = cert_info(served_chain[-1])['issuer']
                 if issuer:
                     data['certs']['served_issuer'] = issuer
                 else:
@@ -506,8 +684,7 @@ def analyze_certs(certs):
 
             try:
                 if (constructed_chain and (len(constructed_chain) > 0)):
-                    highest_constructed = parse_cert(constructed_chain[-1])
-                    issuer = cert_issuer_name(highest_constructed)
+                    issuer = cert_info(constructed_chain[-1])['issuer']
                     if issuer:
                         data['certs']['constructed_issuer'] = issuer
                     else:
@@ -515,58 +692,46 @@ def analyze_certs(certs):
             except Exception as err:
                 logging.debug("\t\t Error getting certificate constructed issuer: {}".format(err))
         
-            leaf = parse_cert(served_chain[0])
-            leaf_key = leaf.public_key()
+            leaf = cert_info(served_chain[0])
 
-            if hasattr(leaf_key, "key_size"):
-                data['certs']['key_length'] = leaf_key.key_size
-            elif hasattr(leaf_key, "curve"):
-                data['certs']['key_length'] = leaf_key.curve.key_size
-            else:
-                data['certs']['key_length'] = None
+            data['certs']['key_length'] = leaf['key_length']
 
-            if(data['certs']['key_length'] < 2048):
+            # Some key types (like Ed25519) have no size to compare.
+            if data['certs']['key_length'] is None:
+                data['certs']['certificate_less_than_2048'] = None
+            elif(data['certs']['key_length'] < 2048):
                 data['certs']['certificate_less_than_2048'] = True
             else:
                 data['certs']['certificate_less_than_2048'] = False
 
-            if isinstance(leaf_key, rsa.RSAPublicKey):
-                leaf_key_type = "RSA"
-            elif isinstance(leaf_key, dsa.DSAPublicKey):
-                leaf_key_type = "DSA"
-            elif isinstance(leaf_key, ec.EllipticCurvePublicKey):
-                leaf_key_type = "ECDSA"
-            else:
-                leaf_key_type == str(leaf_key.__class__)
-
-            data['certs']['key_type'] = leaf_key_type
+            data['certs']['key_type'] = leaf['key_type']
 
             # Signature of the leaf certificate only.
-            data['certs']['leaf_signature'] = leaf.signature_hash_algorithm.name
+            data['certs']['leaf_signature'] = leaf['signature_hash']
 
-            if(leaf.signature_hash_algorithm.name == "MD5"):
+            if(leaf['signature_hash'] == "MD5"):
                 data['certs']['md5_signed_certificate'] = True
             else:
                 data['certs']['md5_signed_certificate'] = False
 
-            if(leaf.signature_hash_algorithm.name == "SHA1"):
+            if(leaf['signature_hash'] == "SHA1"):
                 data['certs']['sha1_signed_certificate'] = True
             else:
                 data['certs']['sha1_signed_certificate'] = False
 
             # Beginning and expiration dates of the leaf certificate
-            data['certs']['not_before'] = leaf.not_valid_before
-            data['certs']['not_after'] = leaf.not_valid_after
+            data['certs']['not_before'] = leaf['not_before']
+            data['certs']['not_after'] = leaf['not_after']
 
             now = datetime.datetime.now()
-            if (now < leaf.not_valid_before) or (now > leaf.not_valid_after):
+            if (now < leaf['not_before']) or (now > leaf['not_after']):
                 data['certs']['expired_certificate'] = True
             else:
                 data['certs']['expired_certificate'] = False
 
             any_sha1_served = False
             for cert in served_chain:
-                if parse_cert(cert).signature_hash_algorithm.name == "sha1":
+                if cert_info(cert)['signature_hash'] == "sha1":
                     any_sha1_served = True
 
             data['certs']['any_sha1_served'] = any_sha1_served
@@ -574,52 +739,7 @@ def analyze_certs(certs):
             if data['certs'].get('constructed_issuer'):
                 data['certs']['any_sha1_constructed'] = certificate_deployment.verified_chain_has_sha1_signature
 
-            extensions = leaf.extensions
-            oids = []
-            try:
-                ext = extensions.get_extension_for_class(cryptography.x509.extensions.CertificatePolicies)
-                policies = ext.value
-                for policy in policies:
-                    oids.append(policy.policy_identifier.dotted_string)
-            except cryptography.x509.ExtensionNotFound:
-                # If not found, just move on.
-                pass
-
-            data['certs']['ev'] = {
-                'asserted': False,
-                'trusted': False,
-                'trusted_oids': [],
-                'trusted_browsers': []
-            }
-
-            for oid in oids:
-
-                # If it matches the generic EV OID, the certifciate is
-                # asserting that it was issued following the EV guidelines.
-                data['certs']['ev']['asserted'] = (oid == evg_oid)
-
-                # Check which browsers for which the cert is marked as EV.
-                browsers = []
-                if oid in mozilla_ev:
-                    browsers.append("Mozilla")
-                if oid in google_ev:
-                    browsers.append("Google")
-                if oid in microsoft_ev:
-                    browsers.append("Microsoft")
-                if oid in apple_ev:
-                    browsers.append("Apple")
-
-                if len(browsers) > 0:
-                    data['certs']['ev']['trusted'] = True
-
-                    # Log each new OID we observe as marked for EV.
-                    if oid not in data['certs']['ev']['trusted_oids']:
-                        data['certs']['ev']['trusted_oids'].append(oid)
-
-                    # For all matching browsers, log each new one.
-                    for browser in browsers:
-                        if browser not in data['certs']['ev']['trusted_browsers']:
-                            data['certs']['ev']['trusted_browsers'].append(browser)
+            data['certs']['ev'] = copy.deepcopy(leaf['ev'])
 
             # Is this cert issued by Symantec?
             is_symantec_cert = certificate_deployment.verified_chain_has_legacy_symantec_anchor
@@ -628,12 +748,7 @@ def analyze_certs(certs):
                 # The distrust date is no longer passed down from when this
                 # test is originally run, so we have to repeat the test here
                 # to determine it.  It shouldn't get run that often.
-                try:
-                    distrust_timeline = _SymantecDistructTester.get_distrust_timeline(constructed_chain)
-                    data['certs']['symantec_distrust_date'] = distrust_timeline.name
-                except:
-                    data['certs']['symantec_distrust_date'] = "Unknown"
-                    pass
+                data['certs']['symantec_distrust_date'] = symantec_distrust_date(constructed_chain)
             else:
                 data['certs']['symantec_distrust_date'] = None
 
@@ -643,6 +758,124 @@ def analyze_certs(certs):
     return data['certs']
 
 
+# Parsed certificates and the fields derived from them, keyed by
+# SHA-256 fingerprint. Most chains share a handful of intermediates and
+# roots, and many domains serve the same leaf.
+cert_cache = LRUCache(maxsize=4096)
+
+
+def cert_fingerprint(cert):
+    return cert.fingerprint(hashes.SHA256())
+
+
+# Everything analyze_certs needs to know about a single certificate,
+# memoized by fingerprint.
+def cert_info(cert):
+    return cert_cache.get(cert_fingerprint(cert), lambda: analyze_cert(cert))
+
+
+def analyze_cert(cert):
+    parsed = parse_cert(cert)
+    key = parsed.public_key()
+
+    if hasattr(key, "key_size"):
+        key_length = key.key_size
+    elif hasattr(key, "curve"):
+        key_length = key.curve.key_size
+    else:
+        key_length = None
+
+    if isinstance(key, rsa.RSAPublicKey):
+        key_type = "RSA"
+    elif isinstance(key, dsa.DSAPublicKey):
+        key_type = "DSA"
+    elif isinstance(key, ec.EllipticCurvePublicKey):
+        key_type = "ECDSA"
+    else:
+        key_type = str(key.__class__)
+
+    if parsed.signature_hash_algorithm is not None:
+        signature_hash = parsed.signature_hash_algorithm.name
+    else:
+        signature_hash = None
+
+    oids = []
+    try:
+        ext = parsed.extensions.get_extension_for_class(cryptography.x509.extensions.CertificatePolicies)
+        policies = ext.value
+        for policy in policies:
+            oids.append(policy.policy_identifier.dotted_string)
+    except cryptography.x509.ExtensionNotFound:
+        # If not found, just move on.
+        pass
+
+    return {
+        'parsed': parsed,
+        'issuer': cert_issuer_name(parsed),
+        'key_type': key_type,
+        'key_length': key_length,
+        'signature_hash': signature_hash,
+        'not_before': parsed.not_valid_before,
+        'not_after': parsed.not_valid_after,
+        'ev': ev_status(oids)
+    }
+
+
+# Given a certificate's policy OIDs, whether it asserts EV and which
+# browsers trust it for EV.
+def ev_status(oids):
+    ev = {
+        'asserted': False,
+        'trusted': False,
+        'trusted_oids': [],
+        'trusted_browsers': []
+    }
+
+    for oid in oids:
+
+        # If it matches the generic EV OID, the certifciate is
+        # asserting that it was issued following the EV guidelines.
+        ev['asserted'] = (oid == evg_oid)
+
+        # Check which browsers for which the cert is marked as EV.
+        browsers = []
+        if oid in mozilla_ev:
+            browsers.append("Mozilla")
+        if oid in google_ev:
+            browsers.append("Google")
+        if oid in microsoft_ev:
+            browsers.append("Microsoft")
+        if oid in apple_ev:
+            browsers.append("Apple")
+
+        if len(browsers) > 0:
+            ev['trusted'] = True
+
+            # Log each new OID we observe as marked for EV.
+            if oid not in ev['trusted_oids']:
+                ev['trusted_oids'].append(oid)
+
+            # For all matching browsers, log each new one.
+            for browser in browsers:
+                if browser not in ev['trusted_browsers']:
+                    ev['trusted_browsers'].append(browser)
+
+    return ev
+
+
+# The Symantec distrust date for a verified chain, memoized by the
+# fingerprints of the certificates in it.
+def symantec_distrust_date(chain):
+    def distrust_date():
+        try:
+            return SymantecDistructTester.get_distrust_timeline(chain).name
+        except Exception:
+            return "Unknown"
+
+    key = ("symantec",) + tuple(cert_fingerprint(cert) for cert in chain)
+    return cert_cache.get(key, distrust_date)
+
+
 # Given the cert sub-obj from the sslyze JSON, use
 # the cryptography module to parse its PEM contents.
 def parse_cert(cert):
@@ -679,8 +912,31 @@ def supported_protocol(result):
     return result.is_tls_protocol_version_supported
 
 
+# Wait and then try something again, if there are retries left.
+#
+# When the scan runner supports it, rather than sleeping in this worker
+# raise DeferredRetry so the whole domain is retried later. `state`
+# counts the attempts made at each `step`, and is kept across attempts.
+def retry_later(environment, state, step, reason):
+    attempts = state.get(step, 0)
+    if attempts >= len(retry_delays):
+        return False
+
+    delay = retry_delays[attempts]
+    state[step] = attempts + 1
+    if environment.get('deferred_retries'):
+        raise utils.DeferredRetry(delay, reason, state=state)
+
+    logging.debug("\t{} Trying again in {}s...".format(reason, delay))
+    time.sleep(delay)
+    return True
+
+
 # SSlyze initialization boilerplate
-def init_sslyze(hostname, port, starttls_smtp, options, sync=False):
+#
+# Raises ConnectionToServerFailed if the connectivity check fails, so
+# that the caller can decide whether to try again.
+def init_sslyze(hostname, port, starttls_smtp, options, retry=False, server_location=None):
     global network_timeout, CA_FILE
 
     server_info = None
@@ -688,217 +944,225 @@ def init_sslyze(hostname, port, starttls_smtp, options, sync=False):
     if options.get('ca_file'):
         CA_FILE = options['ca_file']
 
+    # Be a bit more patient when trying again.
+    timeout = network_timeout * 2 if retry else network_timeout
+
     if starttls_smtp:
         tls_wrapped_protocol = ProtocolWithOpportunisticTlsEnum.SMTP
-        sslyze_configuration = ServerNetworkConfiguration(tls_server_name_indication = hostname, tls_opportunistic_encryption = tls_wrapped_protocol, network_timeout = network_timeout)
+        sslyze_configuration = ServerNetworkConfiguration(tls_server_name_indication=hostname, tls_opportunistic_encryption=tls_wrapped_protocol, network_timeout=timeout)
     else:
-        sslyze_configuration = ServerNetworkConfiguration(tls_server_name_indication = hostname, network_timeout = network_timeout)
-            
-    
+        sslyze_configuration = ServerNetworkConfiguration(tls_server_name_indication=hostname, network_timeout=timeout)
+
     try:
-        # logging.debug("\tTesting connectivity with timeout of %is." % network_timeout)
-        server_location = ServerNetworkLocationViaDirectConnection.with_ip_address_lookup(hostname=hostname, port=port)
+        # logging.debug("\tTesting connectivity with timeout of %is." % timeout)
+        if server_location is None:
+            server_location = ServerNetworkLocationViaDirectConnection.with_ip_address_lookup(hostname=hostname, port=port)
         server_tester = ServerConnectivityTester()
         server_info = server_tester.perform(server_location, sslyze_configuration)
-       
     except ConnectionToServerFailed:
-        # Usually pshtt has already established that we can connect to the site, so let's try again a couple of times
-        try:
-            logging.debug("\t{}:{} Server connectivity check failed. Trying again...".format(hostname, port))
-            time.sleep(10)
-            server_location = ServerNetworkLocationViaDirectConnection.with_ip_address_lookup(hostname=hostname, port=port)
-            server_tester = ServerConnectivityTester()
-            server_info = server_tester.perform(network_timeout=(network_timeout*2))
-        except Exception as err:
-            try:
-                logging.debug("\t{}:{} Server connectivity check failed. Trying again...".format(hostname, port))
-                time.sleep(30)
-                server_location = ServerNetworkLocationViaDirectConnection.with_ip_address_lookup(hostname=hostname, port=port)
-                server_tester = ServerConnectivityTester()
-            except Exception as err:
-                logging.warning("\t{}:{} Server connectivity not established during test.".format(hostname, port))
-                return None, None
+        logging.debug("\t{}:{} Server connectivity check failed.".format(hostname, port))
+        raise
     except dns.exception.DNSException as err:
         logging.warning("\t{}:{} DNS exception when performing sslyze server connectivity info check.".format(hostname, port))
         logging.debug("\t:{}:{} DNS exception: {}".format(hostname, port, err))
-        return None, None
+        return None
     except Exception as err:
         utils.notify(err)
         logging.warning("\t{}:{} Unknown exception when performing server connectivity info.".format(hostname, port))
-        return None, None
+        return None
 
-    scanner = Scanner()
+    return server_info
 
-    return server_info, scanner
 
+# Return the shared sslyze engine, starting it if necessary.
+def get_engine(environment, options):
+    global engine
 
-# Run each scan in-process, one at a time.
-# Takes longer, but no multi-process funny business.
-def scan_serial(scanner, server_info, data, options):
-    errors = 0
-    hostname = server_info.server_location.hostname
+    with engine_lock:
+        if engine is None:
+            connections = options.get("sslyze_connections_per_server")
+            servers = options.get("sslyze_concurrent_servers", environment.get("workers"))
+            engine = SslyzeEngine(
+                per_server_connections=int(connections) if connections else None,
+                concurrent_servers=int(servers) if servers else None
+            )
+        return engine
 
-    def run_scan(scan_type, command, errors, retry=True, command_extra_args=None):
-        if(errors >= 2):
-            logging.warning("{}: Too many errors, aborting rest of scans.".format(hostname))
-            return None, errors
-        logging.debug("\t\t{} scan.".format(scan_type))
-        result = None
-        try:
-            if command_extra_args:
-                scan_request = ServerScanRequest(server_info=server_info, scan_commands=[command], scan_commands_extra_arguments=command_extra_args)
-            else:
-                scan_request = ServerScanRequest(server_info=server_info, scan_commands=[command])
-            scanner.queue_scan(scan_request)
-            # Retrieve results from generator object
-            scan_results = [x for x in scanner.get_results()][0]
-            result = scan_results.scan_commands_results[command]
-        except Exception as err:
-            if retry and "timed out" in str(err):
-                logging.debug("\t\t{}: Timed out during {} scan.  Trying one more time...".format(hostname, scan_type))
-                time.sleep(10)
-                try:
-                    scan_request = ServerScanRequest(server_info=server_info, scan_commands=[command], scan_commands_extra_arguments=command_extra_args)
-                    scanner.queue_scan(scan_request)
-                    # Retrieve results from generator object
-                    scan_results = [x for x in scanner.get_results()][0]
-                    result = scan_results.scan_commands_results[command]
-                except Exception as err2:
-                    if retry and "timed out" in str(err2):
-                        logging.debug("\t\t{}: Timed out during {} scan.  Trying one more time...".format(hostname, scan_type))
-                        time.sleep(30)
-                        try:
-                            scan_request = ServerScanRequest(server_info=server_info, scan_commands=[command], scan_commands_extra_arguments=command_extra_args)
-                            scanner.queue_scan(scan_request)
-                            # Retrieve results from generator object
-                            scan_results = [x for x in scanner.get_results()][0]
-                            result = scan_results.scan_commands_results[command]
-                        except Exception:
-                            pass
-            if not result:
-                logging.warning("\t\t{}: Error during {} scan.".format(hostname, scan_type))
-                logging.debug("\t\t{}: Exception during {} scan: {}".format(hostname, scan_type, err))
-                errors = errors + 1
-        return result, errors
-
-    logging.debug("\t{}: Running scans in serial.".format(hostname))
-    sslv2, errors = run_scan("SSLv2", ScanCommand.SSL_2_0_CIPHER_SUITES, errors)
-    sslv3, errors = run_scan("SSLv3", ScanCommand.SSL_3_0_CIPHER_SUITES, errors)
-    tlsv1, errors = run_scan("TLSv1.0", ScanCommand.TLS_1_0_CIPHER_SUITES, errors)
-    tlsv1_1, errors = run_scan("TLSv1.1", ScanCommand.TLS_1_1_CIPHER_SUITES, errors)
-    tlsv1_2, errors = run_scan("TLSv1.2", ScanCommand.TLS_1_2_CIPHER_SUITES, errors)
-    tlsv1_3, errors = run_scan("TLSv1.3", ScanCommand.TLS_1_3_CIPHER_SUITES, errors)
-
-    certs = None
-    if errors < 2 and options.get("sslyze_certs", True) is True:
-        command = ScanCommand.CERTIFICATE_INFO
-        command_extra_args = None
-        if CA_FILE is not None:
-            command_extra_args = {
-                command: CertificateInfoExtraArguments(custom_ca_file=Path(CA_FILE))
-            }
-        certs, errors = run_scan("Certificate Info", ScanCommand.CERTIFICATE_INFO, errors, retry=True, command_extra_args=command_extra_args)
-    else:
-        certs = None
 
-    reneg = None
-    if options.get("sslyze_reneg", True) is True:
-        reneg, errors = run_scan("Renegotiation", ScanCommand.SESSION_RENEGOTIATION, errors, retry=False)
-    else:
-        reneg = None
+class SslyzeEngine(object):
+    """
+    A few long-lived sslyze Scanners shared by all of the worker threads.
+
+    Worker threads each submit a ServerScanRequest and block until its
+    result comes back. Each Scanner has a dispatcher thread that, once
+    it's free, hands every request queued so far to its Scanner at once,
+    so that sslyze scans many servers in parallel within its own
+    connection limits, and routes each ServerScanResult back to the
+    thread that asked for it. A slow server only holds up the requests
+    that went to the same Scanner; the other dispatchers carry on taking
+    new ones.
+
+    A Scanner that raises is thrown away, and the next request gets a
+    new one, since sslyze may have left it halfway through a scan.
+    """
 
-    logging.debug("\t{}: Done scanning.".format(hostname))
+    def __init__(self, per_server_connections=None, concurrent_servers=None,
+                 scanners=engine_scanners, make_scanner=None):
+        # Leave sslyze's own defaults alone for any limit not given.
+        limits = {}
+        if per_server_connections:
+            limits["per_server_concurrent_connections_limit"] = per_server_connections
+        if concurrent_servers:
+            limits["concurrent_server_scans_limit"] = concurrent_servers
+        self.make_scanner = lambda: (make_scanner or Scanner)(**limits)
+        self.requests = queue.Queue()
+        self.dispatchers = [threading.Thread(target=self.dispatch, daemon=True) for i in range(max(1, scanners))]
+        for dispatcher in self.dispatchers:
+            dispatcher.start()
+
+    def scan(self, scan_request):
+        future = Future()
+        self.requests.put((scan_request, future))
+        return future.result()
+
+    def stop(self):
+        for dispatcher in self.dispatchers:
+            self.requests.put(None)
+        for dispatcher in self.dispatchers:
+            dispatcher.join()
+
+    def dispatch(self):
+        scanner = None
+        while True:
+            # Each dispatcher takes one None, and stops.
+            batch = [self.requests.get()]
+            while batch[-1] is not None:
+                try:
+                    batch.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+
+            stopping = batch[-1] is None
+            batch = [item for item in batch if item is not None]
+            if batch:
+                if scanner is None:
+                    scanner = self.make_scanner()
+                if not self.run_batch(scanner, batch):
+                    scanner = None
+            if stopping:
+                return
+
+    # Scan a batch of requests with `scanner`. Returns whether the
+    # scanner can be used again.
+    def run_batch(self, scanner, batch):
+        # Results carry the ServerConnectivityInfo they were requested
+        # with, which identifies the waiting worker.
+        waiting = {id(request.server_info): (request, future) for request, future in batch}
+        usable = True
+        try:
+            for request, future in batch:
+                scanner.queue_scan(request)
 
-    return sslv2, sslv3, tlsv1, tlsv1_1, tlsv1_2, tlsv1_3, certs, reneg
+            for result in scanner.get_results():
+                request, future = waiting.pop(id(result.server_info))
+                future.set_result(result)
+        except Exception as err:
+            logging.warning("sslyze scanner failed, replacing it: %s" % err)
+            for request, future in waiting.values():
+                future.set_exception(err)
+            waiting = {}
+            usable = False
 
+        for request, future in waiting.values():
+            future.set_exception(RuntimeError("sslyze returned no result for %s" % request.server_info.server_location.hostname))
+        return usable
 
-# Run each scan in parallel, using multi-processing.
-# Faster, but can generate many processes.
-def scan_parallel(scanner, server_info, data, options):
-    hostname = server_info.server_location.hostname
-    logging.debug("\t{} Running scans in parallel.".format(hostname))
 
+# The scan commands (and any extra arguments for them) to run.
+def scan_commands_for(options):
+    commands = set(CIPHER_SUITE_SCAN_COMMANDS)
+    extra_args = {}
 
-    def queue(command, extra_args=None):
-        try:
-            if extra_args:
-                scan_request = ServerScanRequest(server_info=server_info, scan_commands=[command], scan_commands_extra_arguments=extra_args)    
-            else:
-                scan_request = ServerScanRequest(server_info=server_info, scan_commands=[command])
-            scanner.queue_scan(scan_request)
-        except Exception:
-            text = ("Unknown exception queueing sslyze command.\n%s" % utils.format_last_exception())
-            data['errors'].append(text)
-            logging.exception("%s %s" % (hostname, text))
-            return None, None, None, None, None, None, None
+    if options.get("sslyze_certs", True) is True:
+        commands.add(ScanCommand.CERTIFICATE_INFO)
+        if CA_FILE is not None:
+            extra_args[ScanCommand.CERTIFICATE_INFO] = CertificateInfoExtraArguments(custom_ca_file=Path(CA_FILE))
 
-    # Initialize commands and result containers
-    sslv2, sslv3, tlsv1, tlsv1_1, tlsv1_2, tlsv1_3, certs, reneg = None, None, None, None, None, None, None, None
+    if options.get("sslyze_reneg", True) is True:
+        commands.add(ScanCommand.SESSION_RENEGOTIATION)
+
+    return commands, extra_args
+
+
+# Have the engine run `commands` against the server: all as a single
+# request, or with `serial`, one request per command, one at a time.
+# Returns the results and errors, by command.
+def run_commands(engine, server_info, commands, extra_args, serial=False):
+    batches = [{command} for command in sorted(commands)] if serial else [commands]
+    results, errors = {}, {}
+    for batch in batches:
+        scan_result = engine.scan(ServerScanRequest(
+            server_info=server_info, scan_commands=batch,
+            scan_commands_extra_arguments={
+                command: args for command, args in extra_args.items() if command in batch
+            }
+        ))
+        results.update(scan_result.scan_commands_results)
+        errors.update(scan_result.scan_commands_errors)
+    return results, errors
 
-    # Queue them all up
 
-    queue(ScanCommand.SSL_2_0_CIPHER_SUITES)
-    queue(ScanCommand.SSL_3_0_CIPHER_SUITES)
-    queue(ScanCommand.TLS_1_0_CIPHER_SUITES)
-    queue(ScanCommand.TLS_1_1_CIPHER_SUITES)
-    queue(ScanCommand.TLS_1_2_CIPHER_SUITES)
-    queue(ScanCommand.TLS_1_3_CIPHER_SUITES)
+# Submit every scan command for the host as a single request (or with
+# --sslyze-serial, one at a time). Commands that time out (apart from
+# the renegotiation test) are re-run, up to once for each of the
+# retry_delays. Results from earlier attempts are kept in `state`.
+def scan_server(engine, server_info, data, environment, options, state):
+    hostname = server_info.server_location.hostname
+    all_commands, extra_args = scan_commands_for(options)
+    serial = str(options.get("sslyze_serial", False)).lower() == "true"
+    commands = state.get('commands', all_commands)
+    results = state.setdefault('results', {})
+
+    logging.debug("\t{}: Running scans.".format(hostname))
+    while commands:
+        # sslyze runs the commands together, so they share one span.
+        with trace.span("scan commands", hostname=hostname, commands=sorted(commands)):
+            try:
+                command_results, command_errors = run_commands(engine, server_info, commands, extra_args, serial)
+            except Exception:
+                text = ("Unknown exception running sslyze scan commands.\n%s" % utils.format_last_exception())
+                data['errors'].append(text)
+                logging.warning("%s %s" % (hostname, text))
+                break
+
+        results.update(command_results)
+
+        commands = {
+            command for command, error in command_errors.items()
+            if command != ScanCommand.SESSION_RENEGOTIATION and "timed out" in scan_command_error_text(error)
+        }
+        state['commands'] = commands
+        if commands and not retry_later(environment, state, 'timeout', "{}: Timed out during {} scan.".format(hostname, ", ".join(sorted(commands)))):
+            break
 
-    if options.get("sslyze-certs", True) is True:
-        command = ScanCommand.CERTIFICATE_INFO
-        if CA_FILE is not None:
-            command_extra_args = { command: CertificateInfoExtraArguments(custom_ca_file=Path(CA_FILE)) }
-            queue(command, command_extra_args)
-        else:
-            queue(command)
+    for command in sorted(all_commands - set(results)):
+        error = ("Scan command failed: %s" % command)
+        logging.warning("\t\t{}: {}".format(hostname, error))
+        data['errors'].append(error)
 
-    if options.get("sslyze-reneg", True) is True:
-        queue(ScanCommand.SESSION_RENEGOTIATION)
-    
-    # Reassign them back to predictable places after they're all done
-    was_error = False
-    for result in scanner.get_results():
-        try:
-            if ScanCommand.SSL_2_0_CIPHER_SUITES in result.scan_commands_results:
-                sslv2 = result.scan_commands_results[ScanCommand.SSL_2_0_CIPHER_SUITES]
-            if ScanCommand.SSL_3_0_CIPHER_SUITES in result.scan_commands_results:
-                sslv3 = result.scan_commands_results[ScanCommand.SSL_3_0_CIPHER_SUITES]
-            if ScanCommand.TLS_1_0_CIPHER_SUITES in result.scan_commands_results:
-                tlsv1 = result.scan_commands_results[ScanCommand.TLS_1_0_CIPHER_SUITES]
-            if ScanCommand.TLS_1_1_CIPHER_SUITES in result.scan_commands_results:
-                tlsv1_1 = result.scan_commands_results[ScanCommand.TLS_1_1_CIPHER_SUITES]
-            if ScanCommand.TLS_1_2_CIPHER_SUITES in result.scan_commands_results:
-                tlsv1_2 = result.scan_commands_results[ScanCommand.TLS_1_2_CIPHER_SUITES]
-            if ScanCommand.TLS_1_3_CIPHER_SUITES in result.scan_commands_results:
-                tlsv1_3 = result.scan_commands_results[ScanCommand.TLS_1_3_CIPHER_SUITES]
-            if ScanCommand.CERTIFICATE_INFO in result.scan_commands_results:
-                certs = result.scan_commands_results[ScanCommand.CERTIFICATE_INFO]
-            if ScanCommand.SESSION_RENEGOTIATION in result.scan_commands_results:
-                reneg = result.scan_commands_results[ScanCommand.SESSION_RENEGOTIATION]
-            
-            for scan_command, error in result.scan_commands_errors.items():
-                error = ("Scan command failed: %s" % scan_command)
-                logging.warning(error)
-                data['errors'].append(error)
-                # return partial data even if errors
-                #return None, None, None, None, None, None, None, None
+    logging.debug("\t{}: Done scanning.".format(hostname))
 
-        except Exception:
-            was_error = True
-            text = ("Exception inside async scanner result processing.\n%s" % utils.format_last_exception())
-            data['errors'].append(text)
-            logging.exception("\t%s" % text)
-            # return partial data even if errors
-
-    # There was an error during async processing.
-    if was_error:
-        # return partial data even if errors
-        #return None, None, None, None, None, None, None, None
-        pass
+    return tuple(
+        results.get(command) for command in CIPHER_SUITE_SCAN_COMMANDS + [
+            ScanCommand.CERTIFICATE_INFO, ScanCommand.SESSION_RENEGOTIATION
+        ]
+    )
 
-    logging.debug("\t{}: Done scanning.".format(hostname))
 
-    return sslv2, sslv3, tlsv1, tlsv1_1, tlsv1_2, tlsv1_3, certs, reneg
+def scan_command_error_text(error):
+    if getattr(error, "exception_trace", None) is None:
+        return str(error)
+    return "".join(error.exception_trace.format())
 
 
 # EV Guidelines OID
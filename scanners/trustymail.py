@@ -1,12 +1,14 @@
 import logging
+import types
 from typing import Any, List
 
 import trustymail
 import trustymail.trustymail as tmail
+import trustymail.domain as tmail_domain
 
 import dns.resolver
 
-from utils import FAST_CACHE_KEY
+from utils import FAST_CACHE_KEY, IN_FLIGHT_KEY, fast_cache, psl, resolver as dns_cache
 
 ###
 # Inspect a site's DNS Mail configuration using DHS NCATS' trustymail tool.
@@ -24,8 +26,20 @@ default_smtp_ports = '25,465,587'
 # Advertise lambda support
 lambda_support = True
 
+# trustymail makes its own dns.resolver.Resolver for every domain, so
+# this stands in for its `dns` module, with a Resolver that uses the
+# shared DNS cache. Everything else (the exceptions in particular) is
+# dnspython's own.
+caching_dns = types.ModuleType(dns.__name__)
+caching_dns.__dict__.update(dns.__dict__)
+caching_dns.resolver = types.ModuleType(dns.resolver.__name__)  # type: ignore
+caching_dns.resolver.__dict__.update(dns.resolver.__dict__)  # type: ignore
+caching_dns.resolver.Resolver = dns_cache.Resolver  # type: ignore
 
-# Initialize dnssec checks once, at the top of the scan.
+
+# Initialize dnssec checks once, at the top of the scan, and set up the
+# fast cache, loading any mail server results kept from earlier runs
+# (with --fast-cache-ttl).
 def init(environment, options):
     try:
         timeout = int(options.get('timeout', default_timeout))
@@ -40,11 +54,14 @@ def init(environment, options):
     except Exception as error:
         logging.debug('Error initializing trustymail dnssec checks: {}'.format(str(error)))
 
+    return fast_cache.environment_for('trustymail', options)
+
 
 # Check the fastcache to determine if we have already tested any of
 # the mail servers when scanning other domains.
 def init_domain(domain, environment, options):
     cached_data = {}
+    all_cached = False
 
     if not options['no_fast_cache']:
         #
@@ -58,7 +75,10 @@ def init_domain(domain, environment, options):
             for port in options.get('smtp_ports', default_smtp_ports).split(',')
         }
         dns_hostnames = list_from_dict_key(options, 'dns')
-        resolver = dns.resolver.Resolver(configure=not dns_hostnames)
+        if options.get('no_dns_cache'):
+            resolver = dns.resolver.Resolver(configure=not dns_hostnames)
+        else:
+            resolver = dns_cache.Resolver(configure=not dns_hostnames)
         if dns_hostnames:
             resolver.nameservers = dns_hostnames
         # else: use the system configuration: `/etc/resolv.conf`
@@ -103,8 +123,8 @@ def init_domain(domain, environment, options):
             for record in mx_records
             for port in smtp_ports
         }
-        # Check if we already have results for all mail servers to be
-        # tested, possibly from a different domain.
+        # Check if we already have results for any of the mail servers
+        # to be tested, possibly from a different domain.
         #
         # I have found that SMTP servers (as compared to HTTP/HTTPS
         # servers) are MUCH more sensitive to having multiple
@@ -114,21 +134,29 @@ def init_domain(domain, environment, options):
         # if we have already hit this mail server when testing a
         # different domain.
         #
-        # Note that we only use the cached data if we have data for
-        # _every_ mail server associated with this domain.
-        cached = FAST_CACHE_KEY in environment and all([
-            mail_server in environment[FAST_CACHE_KEY]
+        # If another worker is testing one of these mail servers right
+        # now, wait for its result rather than connecting to it as well.
+        #
+        # If we have data for _every_ mail server associated with this
+        # domain then the STARTTLS scan can be skipped entirely;
+        # otherwise only the mail servers without data are tested.
+        cache = environment.get(FAST_CACHE_KEY, {})
+        if IN_FLIGHT_KEY in environment:
+            for mail_server in sorted(mail_servers_to_test):
+                environment[IN_FLIGHT_KEY].claim(mail_server, domain, cache)
+        cached_data = {
+            mail_server: cache[mail_server]
             for mail_server in mail_servers_to_test
-        ])
-        if cached:
-            logging.debug('Using cached data for {} mail servers'.format(domain))
-            cached_data = {
-                mail_server: environment[FAST_CACHE_KEY][mail_server]
-                for mail_server in mail_servers_to_test
-            }
+            if mail_server in cache
+        }
+        all_cached = len(cached_data) == len(mail_servers_to_test)
+        if cached_data:
+            logging.debug('Using cached data for {} of {} {} mail servers'.format(
+                len(cached_data), len(mail_servers_to_test), domain))
 
     return {
-        'cached_data': cached_data
+        'cached_data': cached_data,
+        'all_cached': all_cached
     }
 
 
@@ -175,16 +203,30 @@ def scan(domain, environment, options):
     # Do we need to perform the MX and STARTTLS scans or do we have
     # already-cached data for that?
     #
-    # Since we only provide cached data if we have data for _every_
-    # mail server associated with the domain, it suffices to check if
-    # cached_data is empty here,
+    # If we have cached data for _every_ mail server associated with
+    # the domain then the STARTTLS scan is skipped and the cached data
+    # is crowbarred in below.
     cached_data = environment.get('cached_data', {})
-    use_cached_data = len(cached_data) > 0
+    use_cached_data = len(cached_data) > 0 and environment.get('all_cached', True)
     if use_cached_data:
         # This is true because we want the actual MX records, even
         # though we already did the DNS query in init_domain()
         scan_types['mx'] = True
         scan_types['starttls'] = False
+    elif cached_data and smtp_cache:
+        # Otherwise seed trustymail's own SMTP cache with the mail
+        # servers we do have data for, so that its STARTTLS scan only
+        # connects to the rest.  The results are the same as if it had
+        # tested every one of them.
+        for mail_server, cached_result in cached_data.items():
+            tmail._SMTP_CACHE.setdefault(mail_server, {
+                'supports_smtp': cached_result['supports_smtp'],
+                'starttls': cached_result['starttls']
+            })
+
+    # Monkey patching trustymail to make its DNS queries use the
+    # shared DNS cache
+    tmail.dns = dns if options.get('no_dns_cache') else caching_dns
 
     # Monkey patching trustymail to make it cache the PSL where we
     # want
@@ -192,6 +234,14 @@ def scan(domain, environment, options):
     if environment['scan_method'] == 'lambda':
         # Monkey patching trustymail to make the PSL cache read-only
         trustymail.PublicSuffixListReadOnly = True
+    else:
+        # trustymail.domain has its own copy of PublicSuffixListFilename,
+        # so the above doesn't reach it, and it reparses (or downloads)
+        # the PSL for every domain.  Monkey patching it to use the PSL
+        # scan already loaded instead.
+        cache_dir = options.get("_", {}).get("cache_dir", "./cache")
+        tmail_domain.get_public_suffix = tmail.get_public_suffix = \
+            lambda name: psl.base_domain_for(name, cache_dir=cache_dir)
     
     data = tmail.scan(domain, timeout, smtp_timeout, smtp_localhost,
                       smtp_ports, smtp_cache, scan_types,
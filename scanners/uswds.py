@@ -16,6 +16,11 @@ scan_headless = True
 # domains, or to start with the canonical URL right away.
 def init_domain(domain, environment, options):
     cache_dir = options.get("_", {}).get("cache_dir", "./cache")
+    # If pre-resolution (--preresolve) found no addresses, skip it.
+    if utils.domain_doesnt_resolve(domain, environment):
+        logging.debug("\tSkipping, domain doesn't resolve.")
+        return False
+
     # If we have data from pshtt, skip if it's not a live domain.
     if utils.domain_not_live(domain):
         logging.debug("\tSkipping, domain not reachable during inspection.")
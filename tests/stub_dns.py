@@ -0,0 +1,150 @@
+import socket
+import struct
+import threading
+
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+
+
+class StubDNSServer(object):
+    """
+    A tiny authoritative DNS server on localhost, over UDP and TCP.
+
+    `records` maps (name, record type) to (ttl, [record data, ...]).
+    Names that appear under no record type get NXDOMAIN, names that
+    appear under some other type get an empty answer; both come with
+    an SOA giving them a TTL of `negative_ttl`. Unless `keep_queries`
+    is False, every query received is kept in `queries` as (name,
+    record type).
+
+    Subclasses can answer for more than a fixed set of records by
+    overriding lookup() and exists(), and slow answers down (or drop
+    them, to make the client time out) by overriding delay_for().
+    """
+
+    def __init__(self, records=None, negative_ttl=60, keep_queries=True):
+        self.negative_ttl = negative_ttl
+        self.keep_queries = keep_queries
+        self.records = {
+            (name.rstrip(".").lower(), rdtype): value
+            for (name, rdtype), value in (records or {}).items()
+        }
+        self.queries = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.address, self.port = self.sock.getsockname()
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp.bind((self.address, self.port))
+        self.tcp.listen(64)
+        self.threads = [
+            threading.Thread(target=self.serve, daemon=True),
+            threading.Thread(target=self.serve_tcp, daemon=True),
+        ]
+
+    def __enter__(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.sock.close()
+        self.tcp.close()
+
+    # (ttl, [record data, ...]) for a name and record type, or None.
+    def lookup(self, name, rdtype):
+        return self.records.get((name, rdtype))
+
+    def exists(self, name):
+        return any(known == name for known, _ in self.records)
+
+    # Seconds to wait before answering for a name, or None to never answer.
+    def delay_for(self, name):
+        return 0
+
+    def serve(self):
+        while True:
+            try:
+                wire, client = self.sock.recvfrom(65535)
+            except OSError:
+                return
+            self.respond(wire, lambda response: self.sock.sendto(response, client))
+
+    def serve_tcp(self):
+        while True:
+            try:
+                connection, _ = self.tcp.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve_connection, args=(connection,), daemon=True).start()
+
+    def serve_connection(self, connection):
+        def send(response):
+            connection.sendall(struct.pack("!H", len(response)) + response)
+
+        with connection:
+            while True:
+                length = self.read_exactly(connection, 2)
+                if length is None:
+                    return
+                wire = self.read_exactly(connection, struct.unpack("!H", length)[0])
+                if wire is None:
+                    return
+                self.respond(wire, send)
+
+    @staticmethod
+    def read_exactly(connection, size):
+        data = b""
+        while len(data) < size:
+            try:
+                chunk = connection.recv(size - len(data))
+            except OSError:
+                return None
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def respond(self, wire, send):
+        query = dns.message.from_wire(wire)
+        name = query.question[0].name.to_text().rstrip(".").lower()
+        delay = self.delay_for(name)
+        if delay is None:
+            return
+
+        def answer():
+            try:
+                send(self.answer(query).to_wire())
+            except OSError:
+                pass
+
+        if delay:
+            threading.Timer(delay, answer).start()
+        else:
+            answer()
+
+    def answer(self, query):
+        response = dns.message.make_response(query)
+        response.flags |= dns.flags.AA
+        question = query.question[0]
+        name = question.name.to_text().rstrip(".").lower()
+        rdtype = dns.rdatatype.to_text(question.rdtype)
+        if self.keep_queries:
+            self.queries.append((name, rdtype))
+
+        found = self.lookup(name, rdtype)
+        if found is not None:
+            ttl, values = found
+            response.answer.append(dns.rrset.from_text(question.name, ttl, "IN", rdtype, *values))
+            return response
+
+        if not self.exists(name):
+            response.set_rcode(dns.rcode.NXDOMAIN)
+        response.authority.append(dns.rrset.from_text(
+            dns.name.root, self.negative_ttl, "IN", "SOA",
+            "ns.stub. hostmaster.stub. 1 3600 600 86400 %i" % self.negative_ttl))
+        return response
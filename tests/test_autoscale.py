@@ -0,0 +1,72 @@
+from .context import utils  # noqa
+from utils import autoscale
+from utils.scheduler import Scheduler
+
+
+def window(limit, throughput, latency=1.0, error_rate=0.0, timeout_rate=0.0):
+    return {'limit': limit, 'count': 100, 'throughput': throughput, 'latency': latency,
+            'error_rate': error_rate, 'timeout_rate': timeout_rate}
+
+
+def test_climbs_while_throughput_rises():
+    scaler = autoscale.Autoscaler("noop", 1, 40, start=8)
+    scheduler = Scheduler(None, scaler.maximum)
+    scaler.attach(scheduler)
+
+    scaler.adjust(window(8, 10))
+    assert scaler.limit == 10
+    scaler.adjust(window(10, 12))
+    assert scaler.limit == 12
+    # Less throughput: go back the other way.
+    scaler.adjust(window(12, 11))
+    assert scaler.limit == 9
+    assert scheduler.limit == 9
+    assert [change['to'] for change in scaler.report()['adjustments']] == [10, 12, 9]
+
+
+def test_backs_off_on_timeouts_and_errors():
+    scaler = autoscale.Autoscaler("noop", 2, 40, start=20)
+    scaler.adjust(window(20, 10, timeout_rate=0.5))
+    assert scaler.limit == 15
+    assert "timed out" in scaler.history[-1]['reason']
+
+    scaler = autoscale.Autoscaler("noop", 2, 40, start=20)
+    scaler.adjust(window(20, 10, error_rate=0.1))
+    assert scaler.limit == 25
+    scaler.adjust(window(25, 12, error_rate=0.5))
+    assert scaler.limit == 19
+    assert "errors rose" in scaler.history[-1]['reason']
+
+
+def test_flat_throughput():
+    # Slower domains for the same throughput: too many workers.
+    scaler = autoscale.Autoscaler("noop", 1, 40, start=8)
+    scaler.adjust(window(8, 10, latency=1.0))
+    scaler.adjust(window(10, 10, latency=2.0))
+    assert scaler.limit == 8
+
+    # Same speed, same throughput: try more.
+    scaler.adjust(window(8, 10, latency=2.0))
+    assert scaler.limit == 10
+
+
+def test_bounds():
+    scaler = autoscale.Autoscaler("noop", 4, 6, start=100)
+    assert scaler.limit == 6
+    scaler.adjust(window(6, 10))
+    assert scaler.limit == 6
+    assert scaler.history == []
+    for i in range(5):
+        scaler.adjust(window(scaler.limit, 1, timeout_rate=1.0))
+    assert scaler.limit == 4
+
+
+def test_observe():
+    scaler = autoscale.Autoscaler("noop", 1, 10, start=2, interval=0, min_samples=5)
+    for i in range(4):
+        scaler.observe(0.1, ["Connection timed out."])
+    assert scaler.previous is None
+    scaler.observe(0.1)
+    assert scaler.previous['count'] == 5
+    assert scaler.previous['timeout_rate'] == 0.8
+    assert scaler.limit == 1
@@ -0,0 +1,51 @@
+import os
+import random
+
+from .context import utils  # noqa
+from utils.dedup import HostnameDeduper
+
+
+def test_dedup_in_memory(tmp_path):
+    with HostnameDeduper(["censys", "dap"], spill_dir=str(tmp_path)) as hostnames:
+        hostnames.add("b.example.gov", "dap")
+        hostnames.add("a.example.gov", "censys")
+        hostnames.add("b.example.gov", "censys")
+        hostnames.add("a.example.gov", "censys")
+
+        assert list(hostnames) == [
+            ("a.example.gov", ["censys"]),
+            ("b.example.gov", ["censys", "dap"]),
+        ]
+        assert hostnames.spills == []
+
+
+def test_dedup_spills_to_disk(tmp_path):
+    sources = ["censys", "dap", "rdns"]
+    names = ["host%i.example.gov" % i for i in range(200)]
+    seen = [(random.choice(names), random.choice(sources)) for i in range(2000)]
+
+    expected = {}
+    for name, source in seen:
+        expected.setdefault(name, set()).add(source)
+
+    with HostnameDeduper(sources, batch_size=50, spill_dir=str(tmp_path)) as hostnames:
+        for name, source in seen:
+            hostnames.add(name, source)
+        assert len(hostnames.spills) > 1
+
+        assert list(hostnames) == [
+            (name, [source for source in sources if source in expected[name]])
+            for name in sorted(expected)
+        ]
+
+    # Spill files are cleaned up.
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_dedup_awkward_hostnames(tmp_path):
+    names = ['quoted,"name".gov', 'new\nline.gov', 'plain.gov']
+    with HostnameDeduper(["url"], batch_size=1, spill_dir=str(tmp_path)) as hostnames:
+        for name in names:
+            hostnames.add(name, "url")
+
+        assert [name for name, _ in hostnames] == sorted(names)
@@ -0,0 +1,114 @@
+import threading
+import time
+
+from .context import utils  # noqa
+from utils import FAST_CACHE_KEY, IN_FLIGHT_KEY, fast_cache
+from utils.fast_cache import InFlight, PersistentFastCache
+
+
+def test_entries_persist_between_runs(tmp_path):
+    path = str(tmp_path / "fast-cache.sqlite3")
+    cache = PersistentFastCache(path, "trustymail", ttl=60)
+    cache["mx.example.gov:25"] = {'supports_smtp': True, 'starttls': False}
+    cache.close()
+
+    cache = PersistentFastCache(path, "trustymail", ttl=60)
+    assert cache == {"mx.example.gov:25": {'supports_smtp': True, 'starttls': False}}
+
+
+def test_namespaces_are_separate(tmp_path):
+    path = str(tmp_path / "fast-cache.sqlite3")
+    PersistentFastCache(path, "trustymail", ttl=60)["mx.example.gov:25"] = {}
+
+    assert PersistentFastCache(path, "sslyze", ttl=60) == {}
+
+
+def test_expired_entries_are_dropped(tmp_path):
+    path = str(tmp_path / "fast-cache.sqlite3")
+    PersistentFastCache(path, "sslyze", ttl=60)["mx.example.gov:25"] = {}
+    time.sleep(0.05)
+
+    assert PersistentFastCache(path, "sslyze", ttl=0.01) == {}
+
+
+def test_fresh_entry_is_not_overwritten(tmp_path):
+    # Another run stored this entry while we were running.
+    path = str(tmp_path / "fast-cache.sqlite3")
+    ours = PersistentFastCache(path, "sslyze", ttl=60)
+    PersistentFastCache(path, "sslyze", ttl=60)["mx.example.gov:25"] = "first"
+    ours["mx.example.gov:25"] = "second"
+
+    assert PersistentFastCache(path, "sslyze", ttl=60)["mx.example.gov:25"] == "first"
+
+
+def test_concurrent_writers(tmp_path):
+    cache = PersistentFastCache(str(tmp_path / "fast-cache.sqlite3"), "sslyze", ttl=60)
+
+    def work(n):
+        for i in range(50):
+            cache["%i:%i" % (n, i)] = i
+
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(PersistentFastCache(cache.path, "sslyze", ttl=60)) == 200
+
+
+def test_environment_for(tmp_path):
+    options = {"_": {"cache_dir": str(tmp_path)}, "no_fast_cache": False}
+    environment = fast_cache.environment_for("sslyze", options)
+    assert environment[FAST_CACHE_KEY] == {}
+    assert not isinstance(environment[FAST_CACHE_KEY], PersistentFastCache)
+    assert isinstance(environment[IN_FLIGHT_KEY], InFlight)
+
+    options["fast_cache_ttl"] = 3600
+    environment = fast_cache.environment_for("sslyze", options)
+    assert isinstance(environment[FAST_CACHE_KEY], PersistentFastCache)
+
+    options["no_fast_cache"] = True
+    assert fast_cache.environment_for("sslyze", options) == {}
+
+
+def test_in_flight_coalesces_concurrent_scans():
+    in_flight = InFlight()
+    cache = {}
+    scans = []
+    started = threading.Event()
+
+    def work(domain):
+        if in_flight.claim("mx.example.gov:25", domain, cache):
+            scans.append(domain)
+            started.set()
+            time.sleep(0.1)
+            cache["mx.example.gov:25"] = domain
+        in_flight.release(domain)
+
+    first = threading.Thread(target=work, args=("a.gov",))
+    first.start()
+    started.wait()
+    others = [threading.Thread(target=work, args=(d,)) for d in ("b.gov", "c.gov")]
+    for thread in others:
+        thread.start()
+    for thread in [first] + others:
+        thread.join()
+
+    assert scans == ["a.gov"]
+    assert in_flight.stats() == {'claimed': 1, 'coalesced': 2, 'timed_out': 0}
+
+
+def test_in_flight_released_without_result():
+    # If the owner didn't cache anything, the next worker scans it.
+    in_flight = InFlight()
+    assert in_flight.claim("mx.example.gov:25", "a.gov", {})
+    in_flight.release("a.gov")
+    assert in_flight.claim("mx.example.gov:25", "b.gov", {})
+
+
+def test_in_flight_timeout():
+    in_flight = InFlight(timeout=0.01)
+    assert in_flight.claim("mx.example.gov:25", "a.gov", {})
+    assert in_flight.claim("mx.example.gov:25", "b.gov", {})
+    assert in_flight.stats()['timed_out'] == 1
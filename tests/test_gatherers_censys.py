@@ -1,3 +1,6 @@
+import datetime
+import json
+
 import pytest
 from .context import gatherers  # noqa
 from gatherers import censys
@@ -44,3 +47,115 @@ CENSYS_TWO_SUFFIX_QUERY = "\n".join([
 def test_query_for(suffixes, expected):
     result = censys.query_for(suffixes)
     assert result == expected
+
+
+class FakeQueryJob:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def result(self, timeout=None, page_size=None):
+        # Like the real RowIterator, rows come a page at a time.
+        for start in range(0, len(self.rows), page_size):
+            for row in self.rows[start:start + page_size]:
+                yield row
+
+
+class FakeClient:
+    """
+    Stands in for bigquery.Client, answering queries from a list of
+    certificates, and keeping the queries it was asked.
+    """
+
+    def __init__(self, certificates):
+        self.certificates = certificates
+        self.queries = []
+
+    def query(self, query):
+        self.queries.append(query)
+        since = None
+        if "metadata.added_at > TIMESTAMP(" in query:
+            since = query.split("TIMESTAMP(\"")[1].split("\"")[0]
+        rows = []
+        for common_name, dns_names, added_at in self.certificates:
+            if since is not None and censys.timestamp_for(added_at) <= since:
+                continue
+            row = {'common_name': common_name, 'dns_names': dns_names}
+            if "metadata.added_at" in query:
+                row['added_at'] = added_at
+            rows.append(row)
+        return FakeQueryJob(rows)
+
+
+def added(day):
+    return datetime.datetime(2020, 1, day, tzinfo=datetime.timezone.utc)
+
+
+CERTIFICATES = [
+    (["a.example.gov"], ["a.example.gov", "www.a.example.gov"], added(1)),
+    (["b.example.gov"], [], added(3)),
+    ([], ["c.example.gov"], added(2)),
+]
+
+
+def gather(tmpdir, client, **options):
+    gatherer = censys.Gatherer([".gov"], {"output": str(tmpdir), **options}, {"client": client})
+    return list(gatherer.gather())
+
+
+def test_gather_full(tmpdir):
+    client = FakeClient(CERTIFICATES)
+    assert gather(tmpdir, client) == [
+        "a.example.gov", "a.example.gov", "www.a.example.gov", "b.example.gov", "c.example.gov"
+    ]
+    assert "metadata.added_at" not in client.queries[0]
+    assert not tmpdir.join("cache", "censys", "high-water-mark.json").exists()
+
+
+def test_gather_incremental(tmpdir, monkeypatch):
+    monkeypatch.setattr(censys, "page_size", 2)
+    client = FakeClient(CERTIFICATES[:2])
+    first = gather(tmpdir, client, incremental=True)
+    assert "TIMESTAMP(" not in client.queries[0]
+
+    mark = json.loads(tmpdir.join("cache", "censys", "high-water-mark.json").read())
+    assert mark == {"suffixes": [".gov"], "added_at": "2020-01-03 00:00:00.000000+00:00"}
+
+    # A certificate added later, and one added before the mark that
+    # was already exported.
+    client.certificates.append(([], ["d.example.gov"], added(4)))
+    second = gather(tmpdir, client, incremental=True)
+    assert "metadata.added_at > TIMESTAMP(\"2020-01-03 00:00:00.000000+00:00\")" in client.queries[1]
+    assert second == first + ["d.example.gov"]
+
+    mark = json.loads(tmpdir.join("cache", "censys", "high-water-mark.json").read())
+    assert mark["added_at"] == "2020-01-04 00:00:00.000000+00:00"
+
+    # Nothing new.
+    assert gather(tmpdir, client, incremental=True) == second
+
+
+def test_gather_incremental_other_suffixes(tmpdir):
+    client = FakeClient(CERTIFICATES)
+    gather(tmpdir, client, incremental=True)
+
+    gatherer = censys.Gatherer([".gov", ".fed.us"], {"output": str(tmpdir), "incremental": True}, {"client": client})
+    list(gatherer.gather())
+    assert "TIMESTAMP(" not in client.queries[1]
+
+
+def test_query_for_since():
+    query = censys.query_for([".gov"], incremental=True, since="2020-01-03 00:00:00.000000+00:00")
+    assert query == "\n".join([
+        "SELECT",
+        "    parsed.subject.common_name,",
+        "    parsed.extensions.subject_alt_name.dns_names,",
+        "    metadata.added_at",
+        "FROM",
+        "    `censys-io.certificates_public.certificates`,",
+        "    UNNEST(parsed.subject.common_name) AS common_names,",
+        "    UNNEST(parsed.extensions.subject_alt_name.dns_names) AS sans",
+        "WHERE",
+        "    ((common_names LIKE \"%.gov\"",
+        "      OR sans LIKE \"%.gov\"))",
+        "    AND metadata.added_at > TIMESTAMP(\"2020-01-03 00:00:00.000000+00:00\")",
+    ])
@@ -1,3 +1,5 @@
+import gzip
+import io
 import pytest
 from .context import gatherers  # noqa
 from gatherers import rdns
@@ -52,3 +54,62 @@ from gatherers import rdns
 def test_query_for(data, expected):
     result = rdns.process_lines(data, rdns.ip_filter, rdns.number_filter)
     assert list(result) == expected
+
+
+LINES = [
+    '{"timestamp":"1510189589","name":"148.165.34.19","value":"www.bart.gov","type":"ptr"}',
+    '{"timestamp":"1510189590","name":"166.2.164.127","value":"z-166-2-164-127.ip.fs.fed.us","type":"ptr"}',
+    '{"timestamp":"1510189591","name":"137.79.24.39","value":"wildcard.jpl.nasa.gov","type":"ptr"}',
+    '{"timestamp":"1510189591","name":"8.8.8.8","value":"dns.google","type":"ptr"}',
+    '{"timestamp":"1510189591","name":"1.2.3.4","value":"gov.example.com","type":"ptr"}',
+    '{"timestamp":"1510189598","name":"139.169.172.113","value":"host.jsc.nasa.gov","type":"ptr"}',
+    '{"timestamp":"1510189599","name":"134.67.230.238","value":"unassigned.epa.gov","type":"ptr"}',
+    '{"timestamp":"1510189599","name":"134.67.230.239","value":"something.fed.us","type":"ptr"}',
+]
+
+GOV = ["www.bart.gov", "wildcard.jpl.nasa.gov", "host.jsc.nasa.gov", "unassigned.epa.gov"]
+
+
+def test_suffix_prefilter():
+    lines = [line.encode("utf-8") for line in LINES] + [b"not even json"]
+    result = rdns.process_lines(lines, rdns.ip_filter, rdns.number_filter, [".gov"])
+    assert list(result) == GOV
+
+
+@pytest.fixture
+def rdns_file(tmpdir):
+    path = tmpdir.join("rdns.json")
+    path.write("\n".join(LINES * 50) + "\n")
+    return str(path)
+
+
+# Chunk boundaries in the middle of lines, at the start of some lines,
+# and (with tiny chunks) several to a line.
+@pytest.mark.parametrize("size", [1000, len(LINES[0]) + 1, 7])
+def test_process_file_in_chunks(rdns_file, size):
+    chunks = rdns.chunks_for(rdns_file, size)
+    assert len(chunks) > 10
+
+    result = []
+    for start, end in chunks:
+        result += rdns.process_chunk((rdns_file, start, end, [".gov"]))
+    assert result == GOV * 50
+
+
+def test_process_file_with_workers(rdns_file, monkeypatch):
+    monkeypatch.setattr(rdns, "chunk_size", 1000)
+    assert list(rdns.process_file(rdns_file, [".gov"], workers=2)) == GOV * 50
+
+
+def test_candidate_lines():
+    data = ("\n".join(LINES) + "\n").encode("utf-8")
+    lines = rdns.candidate_lines(io.BytesIO(data), rdns.suffix_markers([".gov"]), block_size=100)
+    assert list(lines) == [line.encode("utf-8") + b"\n" for line in LINES if '.gov"' in line]
+
+
+def test_process_gzipped_file(tmpdir):
+    path = str(tmpdir.join("rdns.json.gz"))
+    with gzip.open(path, "wt") as out:
+        out.write("\n".join(LINES) + "\n")
+
+    assert list(rdns.process_file(path, [".gov"])) == GOV
@@ -0,0 +1,53 @@
+import threading
+
+from .context import utils  # noqa
+from utils.lru_cache import LRUCache
+
+
+def test_hits_and_misses():
+    cache = LRUCache(maxsize=10)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return "value"
+
+    assert cache.get("a", compute) == "value"
+    assert cache.get("a", compute) == "value"
+    assert len(calls) == 1
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'size': 1, 'hit_rate': 0.5}
+
+
+def test_no_lookups_has_no_hit_rate():
+    assert LRUCache().stats()['hit_rate'] is None
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.get("a", lambda: 1)
+    cache.get("b", lambda: 2)
+    # Touch "a" so that "b" is the oldest.
+    cache.get("a", lambda: None)
+    cache.get("c", lambda: 3)
+
+    assert len(cache) == 2
+    assert cache.get("a", lambda: None) == 1
+    assert cache.get("b", lambda: "recomputed") == "recomputed"
+
+
+def test_concurrent_use():
+    cache = LRUCache(maxsize=50)
+
+    def work():
+        for i in range(1000):
+            assert cache.get(i % 100, lambda: i % 100) == i % 100
+
+    threads = [threading.Thread(target=work) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = cache.stats()
+    assert stats['hits'] + stats['misses'] == 8000
+    assert stats['size'] == 50
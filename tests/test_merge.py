@@ -0,0 +1,183 @@
+import argparse
+import csv
+import json
+import os
+import shutil
+import time
+import types
+from importlib.machinery import SourceFileLoader
+from importlib.util import module_from_spec, spec_from_loader
+
+import publicsuffixlist
+import pytest
+
+from .context import utils  # noqa
+from utils import fast_cache, merge, phases, psl, scan_utils, work_queue
+
+BUNDLED_PSL = os.path.join(os.path.dirname(publicsuffixlist.__file__), "public_suffix_list.dat")
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    shutil.copy(BUNDLED_PSL, str(tmp_path / psl.PSL_FILENAME))
+    monkeypatch.setattr(psl, "suffix_list", None)
+    return str(tmp_path)
+
+
+def test_parse_shard():
+    assert scan_utils.parse_shard("2/5") == (2, 5)
+    for value in ("0/5", "6/5", "2", "a/b"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            scan_utils.parse_shard(value)
+
+
+def test_shards_partition_by_base_domain(cache_dir):
+    domains = ["%s.agency%i.gov" % (sub, i) for i in range(50) for sub in ("www", "mail", "x.y")]
+    shards = [
+        list(scan_utils.domains_in_shard(domains, (index, 4), cache_dir=cache_dir))
+        for index in range(1, 5)
+    ]
+    assert sorted(sum(shards, [])) == sorted(domains)
+    assert all(shards)
+    # Every subdomain goes where its base domain does.
+    for index, shard in enumerate(shards, 1):
+        for domain in shard:
+            base = ".".join(domain.split(".")[-2:])
+            assert scan_utils.shard_for(base, 4, cache_dir=cache_dir) == index
+    assert list(scan_utils.domains_in_shard(domains, None)) == domains
+
+
+def write_shard(path, index, rows, timings, cache_files):
+    results = path / "results"
+    results.mkdir(parents=True)
+    with open(str(results / "noop.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Domain", "Base Domain", "Value"])
+        writer.writerows(rows)
+
+    stats = phases.PhaseStats()
+    for scan in timings:
+        stats.record({"scan": scan, "total": scan})
+    meta = {
+        'start_time': "2026-01-01T00:0%i:00Z" % index,
+        'end_time': "2026-01-01T01:0%i:00Z" % index,
+        'duration': "3600.000000",
+        'durations': {'noop': {
+            'start_time': "2026-01-01T00:0%i:00Z" % index,
+            'end_time': "2026-01-01T01:0%i:00Z" % index,
+            'duration': "3600.000000",
+            'retries': index, 'retry_delay': 1.5,
+            'phases': stats.summary(), 'phase_histograms': stats.state(),
+            'in_flight': {'claimed': 1, 'coalesced': 2, 'timed_out': 0},
+        }},
+        'command': "./scan domains.csv --scan=noop --shard %i/2" % index,
+        'scan_uuid': "uuid-%i" % index,
+        'shard': {'index': index, 'count': 2},
+        'psl_cache': {'hits': 3, 'misses': 1, 'size': 10, 'hit_rate': 0.75},
+    }
+    (results / "meta.json").write_text(json.dumps(meta))
+
+    for name, contents in cache_files.items():
+        cached = path / "cache" / name
+        cached.parent.mkdir(parents=True, exist_ok=True)
+        cached.write_text(contents)
+
+
+def test_merge(tmp_path):
+    write_shard(tmp_path / "one", 1, [["b.gov", "b.gov", "2"], ["d.gov", "d.gov", "4"]], [0.1, 0.2], {
+        "noop/b.gov.json": "{}", "noop/d.gov.json": "{}", "preresolve.json": '{"b.gov": {}, "d.gov": {}}',
+    })
+    write_shard(tmp_path / "two", 2, [["c.gov", "c.gov", "3"], ["a.gov", "a.gov", "1"]], [0.3, 5.0], {
+        "noop/a.gov.json": "{}", "noop/c.gov.json": "{}", "preresolve.json": '{"a.gov": {}, "c.gov": {}}',
+    })
+    output = tmp_path / "merged"
+
+    metadata = merge.merge([str(tmp_path / "one"), str(tmp_path / "two")], str(output), sort=True)
+
+    with open(str(output / "results" / "noop.csv"), newline="") as f:
+        assert list(csv.reader(f)) == [
+            ["Domain", "Base Domain", "Value"],
+            ["a.gov", "a.gov", "1"], ["b.gov", "b.gov", "2"], ["c.gov", "c.gov", "3"], ["d.gov", "d.gov", "4"],
+        ]
+    assert sorted(os.listdir(str(output / "cache" / "noop"))) == ["a.gov.json", "b.gov.json", "c.gov.json", "d.gov.json"]
+    assert sorted(json.loads((output / "cache" / "preresolve.json").read_text())) == ["a.gov", "b.gov", "c.gov", "d.gov"]
+
+    assert json.loads((output / "results" / "meta.json").read_text()) == json.loads(scan_utils.json_for(metadata))
+    assert metadata['start_time'] == "2026-01-01T00:01:00Z"
+    assert metadata['end_time'] == "2026-01-01T01:02:00Z"
+    assert metadata['duration'] == "3660.000000"
+    assert [shard['scan_uuid'] for shard in metadata['shards']] == ["uuid-1", "uuid-2"]
+    assert metadata['psl_cache'] == {'hits': 6, 'misses': 2, 'size': 10, 'hit_rate': 0.75}
+
+    noop = metadata['durations']['noop']
+    assert noop['retries'] == 3
+    assert noop['retry_delay'] == 3.0
+    assert noop['in_flight'] == {'claimed': 2, 'coalesced': 4, 'timed_out': 0}
+    assert noop['phases']['scan']['count'] == 4
+    assert noop['phases']['scan']['max'] == 5.0
+    assert noop['phases']['scan']['total'] == pytest.approx(5.6)
+
+
+def test_merge_fast_caches(tmp_path):
+    entries = {
+        "one": {"mx.a.gov:25": "one", "mx.shared.gov:25": "one"},
+        "two": {"mx.b.gov:25": "two", "mx.shared.gov:25": "two"},
+    }
+    for index, (shard, shard_entries) in enumerate(sorted(entries.items()), 1):
+        write_shard(tmp_path / shard, index, [], [0.1], {})
+        (tmp_path / shard / "cache").mkdir()
+        cache = fast_cache.PersistentFastCache(
+            str(tmp_path / shard / "cache" / fast_cache.FAST_CACHE_FILENAME), "trustymail", ttl=3600)
+        for key, value in shard_entries.items():
+            cache[key] = value
+        cache.close()
+
+    merge.merge([str(tmp_path / "one"), str(tmp_path / "two")], str(tmp_path / "merged"))
+
+    merged = fast_cache.PersistentFastCache(
+        str(tmp_path / "merged" / "cache" / fast_cache.FAST_CACHE_FILENAME), "trustymail", ttl=3600)
+    assert dict(merged) == {"mx.a.gov:25": "one", "mx.b.gov:25": "two", "mx.shared.gov:25": "one"}
+    merged.close()
+
+
+def test_merge_checks_shards(tmp_path):
+    write_shard(tmp_path / "one", 1, [["a.gov", "a.gov", "1"]], [0.1], {})
+    with pytest.raises(ValueError):
+        merge.merge([str(tmp_path / "one"), str(tmp_path / "one")], str(tmp_path / "merged"))
+
+    # Different columns can't go in one CSV.
+    write_shard(tmp_path / "two", 2, [], [0.1], {})
+    with open(str(tmp_path / "two" / "results" / "noop.csv"), "w") as f:
+        f.write("Domain,Base Domain,Other\n")
+    with pytest.raises(ValueError):
+        merge.merge([str(tmp_path / "one"), str(tmp_path / "two")], str(tmp_path / "merged"))
+
+
+def test_given_up_tasks_rows_fit_the_header(cache_dir, tmp_path):
+    # ./scan has no .py extension to import it by.
+    loader = SourceFileLoader("scan", os.path.join(os.path.dirname(__file__), "..", "scan"))
+    scan = module_from_spec(spec_from_loader("scan", loader))
+    loader.exec_module(scan)
+    scanner = types.ModuleType("scanners.two")
+    scanner.headers = ["One", "Two"]
+    options = {'meta': True, 'meta_phases': True, '_': {'results_dir': str(tmp_path)}}
+
+    queue = work_queue.open_queue(str(tmp_path / "queue.db"))
+    queue.add("two", ["poison.gov"])
+    for i in range(work_queue.default_max_leases):
+        queue.lease("worker-%i" % i, "two", 0.01)
+        time.sleep(0.02)
+    assert queue.lease("worker", "two", 60) is None
+
+    handle = scan_utils.begin_csv_writing(
+        scanner, options, (scan.PREFIX_HEADERS, scan.LOCAL_HEADERS, scan.LAMBDA_HEADERS),
+        phase_hdrs=phases.PHASE_HEADERS)
+    scan.write_queue_results(queue, scanner, "two", handle['writer'], options, cache_dir)
+    handle['file'].close()
+    queue.close()
+
+    with open(handle['filename'], newline='') as f:
+        header, row = list(csv.reader(f))
+    assert len(row) == len(header)
+    assert row[:2] == ["poison.gov", "poison.gov"]
+    assert "expired 3 times" in row[header.index("Local Errors")]
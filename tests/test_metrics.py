@@ -0,0 +1,96 @@
+import threading
+import urllib.request
+
+from .context import utils  # noqa
+from utils import FAST_CACHE_KEY, metrics
+
+
+def samples(text):
+    found = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            found[name] = float(value)
+    return found
+
+
+def test_scanner_counts():
+    registry = metrics.Registry()
+    live = registry.scanner("noop", {FAST_CACHE_KEY: {'a': 1, 'b': 2}}, total=5)
+
+    live.begin()
+    live.end({'errors': []})
+    live.begin()
+    live.end({'errors': ["Connection timed out."], 'lambda': {'retries': 2}})
+    live.begin()
+    live.end({'errors': [], 'phases': {'cache_read': 0.1}}, skipped=False)
+    live.begin()
+    live.end({'errors': []}, skipped=True)
+    # One put off to retry later, still in flight again when rendered.
+    live.begin()
+    live.defer()
+    live.begin(first_attempt=False)
+
+    snapshot = live.snapshot()
+    assert snapshot['started'] == 5
+    assert snapshot['in_flight'] == 1
+    assert snapshot['queued'] == 0
+    assert snapshot['completed'] == 4
+    assert snapshot['errors'] == 1
+    assert snapshot['timeouts'] == 1
+    assert snapshot['error_rate'] == 0.25
+    assert snapshot['retries'] == 1
+
+    found = samples(registry.render())
+    assert found['domain_scan_completed_total{scanner="noop"}'] == 4
+    assert found['domain_scan_skipped_total{scanner="noop"}'] == 1
+    assert found['domain_scan_cache_hits_total{scanner="noop"}'] == 1
+    assert found['domain_scan_lambda_retries_total{scanner="noop"}'] == 2
+    assert found['domain_scan_fast_cache_entries{scanner="noop"}'] == 2
+    assert found['domain_scan_domains_per_second{scanner="noop"}'] > 0
+
+
+def test_queued_while_waiting():
+    live = metrics.ScannerMetrics("noop", total=3)
+    live.begin()
+    live.defer()
+    assert live.snapshot()['queued'] == 3
+    assert live.snapshot()['waiting_to_retry'] == 1
+
+    # Without a total, how many are queued isn't known.
+    assert metrics.ScannerMetrics("noop").snapshot()['queued'] is None
+    assert "domain_scan_queued" not in metrics.Registry().render()
+
+
+def test_threads():
+    live = metrics.ScannerMetrics("noop")
+
+    def work():
+        for i in range(1000):
+            live.begin()
+            live.end({'errors': []})
+
+    threads = [threading.Thread(target=work) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert live.snapshot()['completed'] == 8000
+    assert live.snapshot()['in_flight'] == 0
+
+
+def test_exporters(tmpdir):
+    registry = metrics.Registry()
+    registry.scanner("noop").begin()
+    path = str(tmpdir.join("metrics.prom"))
+
+    exporters = metrics.start_exporters(registry, {'metrics_port': 0, 'metrics_file': path, 'metrics_interval': 60})
+    server = exporters[0]
+    url = "http://%s:%i/metrics" % server.server_address[:2]
+    with urllib.request.urlopen(url) as response:
+        assert response.headers['Content-Type'].startswith("text/plain")
+        assert samples(response.read().decode())['domain_scan_in_flight{scanner="noop"}'] == 1
+
+    metrics.stop_exporters(exporters)
+    with open(path) as f:
+        assert samples(f.read())['domain_scan_started_total{scanner="noop"}'] == 1
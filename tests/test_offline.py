@@ -0,0 +1,95 @@
+import smtplib
+import time
+
+import dns.resolver
+import pytest
+import requests
+
+from .context import utils  # noqa
+from benchmarks import offline
+from utils import resolver
+
+
+HOSTS = offline.Hosts({
+    "slow.gov": offline.Host(delay=0.3),
+    "hang.gov": offline.Host(hang=True),
+    "nohttps.gov": offline.Host(https=False),
+    "moved.gov": offline.Host(redirect="https://www.moved.gov%(path)s"),
+    "big.gov": offline.Host(sitemap_urls=5000, json_items=2000),
+    "gone.gov": offline.Host(exists=False),
+    "nomail.gov": offline.Host(mail=False),
+    "dnsdown.gov": offline.Host(dns_timeout=True),
+})
+
+
+@pytest.fixture(scope="module")
+def network():
+    with offline.Network(HOSTS) as network:
+        offline.install(network.endpoints)
+        yield network
+        offline.uninstall()
+    resolver.cache.flush()
+
+
+def test_https_with_upgrade(network):
+    response = requests.get("http://example.gov/", timeout=5)
+    assert response.url == "https://example.gov/"
+    assert [r.status_code for r in response.history] == [301]
+    assert "<title>example.gov</title>" in response.text
+
+
+def test_redirect(network):
+    response = requests.get("https://moved.gov/data.json", timeout=5)
+    assert response.url == "https://www.moved.gov/data.json"
+    assert response.json()["dataset"][0]["identifier"] == "https://www.moved.gov/data/0"
+
+
+def test_big_documents(network):
+    assert requests.get("https://big.gov/sitemap.xml", timeout=5).text.count("<url>") == 5000
+    assert len(requests.get("https://big.gov/code.json", timeout=5).json()["releases"]) == 2000
+
+
+def test_slow_and_hanging(network):
+    start = time.perf_counter()
+    requests.get("https://slow.gov/", timeout=5)
+    assert time.perf_counter() - start >= 0.3
+
+    with pytest.raises(requests.exceptions.Timeout):
+        requests.get("https://hang.gov/", timeout=0.5)
+
+
+def test_unavailable(network):
+    with pytest.raises(requests.exceptions.SSLError):
+        requests.get("https://nohttps.gov/", timeout=5)
+    assert requests.get("http://nohttps.gov/", timeout=5).url == "http://nohttps.gov/"
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        requests.get("https://gone.gov/", timeout=5)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        requests.get("https://example.com/", timeout=5)
+
+
+def test_dns(network):
+    res = dns.resolver.Resolver()
+    res.lifetime = 1
+    mx = res.resolve("example.gov", "MX", tcp=True)
+    assert [record.to_text() for record in mx] == ["10 mail.example.gov."]
+    dmarc = res.resolve("_dmarc.example.gov", "TXT")
+    assert dmarc[0].to_text().startswith('"v=DMARC1;')
+
+    with pytest.raises(dns.resolver.NoAnswer):
+        res.resolve("nomail.gov", "MX")
+    with pytest.raises(dns.resolver.NXDOMAIN):
+        res.resolve("gone.gov", "A")
+    with pytest.raises(dns.resolver.LifetimeTimeout):
+        res.resolve("dnsdown.gov", "A")
+
+
+def test_smtp_starttls(network):
+    smtp = smtplib.SMTP("mail.example.gov", 25, timeout=5)
+    smtp.ehlo()
+    assert smtp.has_extn("starttls")
+    assert smtp.starttls()[0] == 220
+    smtp.ehlo()
+    assert not smtp.has_extn("starttls")
+    smtp.quit()
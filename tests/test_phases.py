@@ -0,0 +1,99 @@
+import csv
+import io
+import random
+import time
+
+import pytest
+
+from .context import utils  # noqa
+from utils import phases, scan_utils
+
+
+def test_timed_adds_up():
+    timings = {}
+    with phases.timed(timings, "scan"):
+        time.sleep(0.01)
+    with phases.timed(timings, "scan"):
+        time.sleep(0.01)
+    assert 0.02 <= timings["scan"] < 1
+
+    with pytest.raises(ValueError):
+        with phases.timed(timings, "to_rows"):
+            raise ValueError()
+    assert "to_rows" in timings
+
+
+def test_histogram_percentiles():
+    rng = random.Random(0)
+    values = [rng.uniform(0.001, 2.0) for i in range(10000)]
+    histogram = phases.Histogram()
+    for value in values:
+        histogram.add(value)
+
+    ordered = sorted(values)
+    for fraction in (0.5, 0.9, 0.99):
+        exact = ordered[int(fraction * len(ordered)) - 1]
+        assert exact <= histogram.percentile(fraction) <= exact * phases.bucket_ratio ** 2
+
+    summary = histogram.summary()
+    assert summary['count'] == 10000
+    assert summary['max'] == round(max(values), 6)
+    assert summary['total'] == pytest.approx(sum(values), abs=1e-3)
+    assert summary['p50'] <= summary['p90'] <= summary['p99'] <= summary['max']
+
+
+def test_histogram_edges():
+    histogram = phases.Histogram()
+    assert histogram.percentile(0.5) is None
+    assert histogram.summary() == {'count': 0}
+
+    histogram.add(0.0)
+    histogram.add(0.25)
+    assert histogram.percentile(0.5) <= phases.bucket_start
+    assert histogram.percentile(1.0) == 0.25
+
+
+def test_phase_stats():
+    stats = phases.PhaseStats()
+    stats.record({"init_domain": 0.1, "scan": 1.0, "total": 1.2})
+    stats.record({"scan": 3.0, "write": 0.001, "total": 3.1})
+
+    summary = stats.summary()
+    assert set(summary) == {"init_domain", "scan", "write", "total"}
+    assert summary["scan"]["count"] == 2
+    assert summary["scan"]["max"] == 3.0
+    assert summary["init_domain"]["count"] == 1
+
+
+class MockScanner:
+    headers = ['field_a', 'field_b']
+
+
+def test_write_rows_with_phases():
+    meta = {
+        'errors': [], 'start_time': 1521990106, 'end_time': 1521990206, 'duration': 100,
+        'phases': {'scan': 1.5, 'to_rows': 0.25, 'write': 9.0},
+    }
+    output = io.StringIO()
+    scan_utils.write_rows([['a', 'b']], 'foo.gov', 'foo.gov', MockScanner(), csv.writer(output), meta=meta)
+
+    row = next(csv.reader(io.StringIO(output.getvalue())))
+    columns = dict(zip(phases.PHASE_HEADERS, row[-len(phases.PHASE_HEADERS):]))
+    assert columns['Local Scan Duration'] == "1.500000"
+    assert columns['Local To Rows Duration'] == "0.250000"
+    assert columns['Local Init Domain Duration'] == ""
+    assert len(row) == 2 + 2 + 6 + len(phases.ROW_PHASES)
+
+
+@pytest.mark.parametrize("meta_phases", [False, True])
+def test_begin_csv_writing_phase_headers(tmpdir, meta_phases):
+    scanner = type("scanners.mock", (), {'__name__': "scanners.mock", 'headers': ['field_a']})
+    options = {'meta': True, 'meta_phases': meta_phases, '_': {'results_dir': str(tmpdir)}}
+    handle = scan_utils.begin_csv_writing(
+        scanner, options, (["Domain"], ["Local Errors"], []), phase_hdrs=phases.PHASE_HEADERS)
+    handle['file'].close()
+
+    expected = ["Domain", "field_a", "Local Errors"]
+    if meta_phases:
+        expected += phases.PHASE_HEADERS
+    assert handle['headers'] == expected
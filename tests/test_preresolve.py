@@ -0,0 +1,114 @@
+import dns.resolver
+import pytest
+
+from .context import utils  # noqa
+from .stub_dns import StubDNSServer
+from utils import preresolve, resolver
+from utils import utils as scanner_utils
+
+
+RECORDS = {
+    ("example.gov", "A"): (300, ["192.0.2.1"]),
+    ("example.gov", "MX"): (300, ["10 mail2.example.gov.", "5 mail1.example.gov."]),
+    ("www.example.gov", "AAAA"): (300, ["2001:db8::1"]),
+    ("wwwonly.gov", "MX"): (300, ["10 mail.wwwonly.gov."]),
+    ("www.wwwonly.gov", "A"): (300, ["192.0.2.2"]),
+    ("mailonly.gov", "MX"): (300, ["10 mail.mailonly.gov."]),
+}
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    with StubDNSServer(RECORDS) as server:
+        res = resolver.resolver(nameservers=[server.address])
+        res.port = server.port
+        monkeypatch.setattr(resolver, "system_resolver", res)
+        resolver.cache.flush()
+        yield server
+    resolver.cache.flush()
+
+
+def test_resolve_all(stub):
+    results = preresolve.resolve_all(
+        ["example.gov", "wwwonly.gov", "mailonly.gov", "missing.gov"], concurrency=4)
+
+    assert results["example.gov"] == {
+        'addresses': {"example.gov": ["192.0.2.1"], "www.example.gov": ["2001:db8::1"]},
+        'mx': ["mail1.example.gov", "mail2.example.gov"]
+    }
+    assert results["wwwonly.gov"]['addresses'] == {"wwwonly.gov": [], "www.wwwonly.gov": ["192.0.2.2"]}
+    assert results["mailonly.gov"] == {
+        'addresses': {"mailonly.gov": [], "www.mailonly.gov": []},
+        'mx': ["mail.mailonly.gov"]
+    }
+    assert results["missing.gov"] == {
+        'addresses': {"missing.gov": [], "www.missing.gov": []},
+        'mx': []
+    }
+
+    assert preresolve.summarize(results) == {'resolved': 2, 'unresolved': 2, 'unknown': 0}
+
+
+def test_domains_are_read_as_they_are_needed(stub):
+    queries_seen = []
+
+    def domains():
+        for i in range(20):
+            queries_seen.append(len(stub.queries))
+            yield "agency%i.gov" % i
+        yield "agency0.gov"
+
+    results = preresolve.resolve_all(domains(), concurrency=2)
+
+    assert list(results) == ["agency%i.gov" % i for i in range(20)]
+    # Not every domain was read before the first lookups were made.
+    assert queries_seen[0] == 0
+    assert queries_seen[-1] > 0
+
+
+def test_answers_warm_the_cache(stub):
+    preresolve.resolve_all(["example.gov", "missing.gov"])
+    queries = len(stub.queries)
+
+    assert resolver.gethostbyname("example.gov") == "192.0.2.1"
+    with pytest.raises(dns.resolver.NXDOMAIN):
+        resolver.addresses_for("missing.gov")
+    assert len(stub.queries) == queries
+
+
+def test_failed_lookups_are_unknown(monkeypatch):
+    # Nothing is listening on the discard port.
+    res = resolver.resolver(nameservers=["127.0.0.1"])
+    res.port = 9
+    monkeypatch.setattr(resolver, "system_resolver", res)
+
+    results = preresolve.resolve_all(["example.gov"], timeout=0.5)
+
+    assert results["example.gov"] == {'addresses': {}, 'mx': None}
+    assert preresolve.summarize(results) == {'resolved': 0, 'unresolved': 0, 'unknown': 1}
+    assert not scanner_utils.domain_doesnt_resolve("example.gov", {'dns': results["example.gov"]})
+
+
+def test_domain_doesnt_resolve(stub):
+    results = preresolve.resolve_all(["example.gov", "wwwonly.gov", "mailonly.gov"])
+
+    def doesnt_resolve(domain):
+        return scanner_utils.domain_doesnt_resolve(domain, {'dns': results[domain]})
+
+    assert not doesnt_resolve("example.gov")
+    assert not doesnt_resolve("wwwonly.gov")
+    assert doesnt_resolve("mailonly.gov")
+    assert scanner_utils.host_doesnt_resolve("wwwonly.gov", {'dns': results["wwwonly.gov"]})
+
+    # Without pre-resolution, nothing is skipped.
+    assert not scanner_utils.domain_doesnt_resolve("mailonly.gov", {'dns': None})
+    assert not scanner_utils.domain_doesnt_resolve("mailonly.gov", {})
+
+
+def test_hosts_file_names_are_unknown(stub, monkeypatch):
+    monkeypatch.setattr(resolver, "hosts_file_names", {"example.gov"})
+
+    results = preresolve.resolve_all(["example.gov"])
+
+    assert results["example.gov"]['addresses'] == {"www.example.gov": ["2001:db8::1"]}
+    assert results["example.gov"]['mx'] is None
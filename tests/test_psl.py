@@ -0,0 +1,117 @@
+import codecs
+import os
+import shutil
+import threading
+
+import publicsuffixlist
+import pytest
+from publicsuffixlist.compat import PublicSuffixList
+
+from .context import utils  # noqa
+from utils import psl
+
+BUNDLED_PSL = os.path.join(os.path.dirname(publicsuffixlist.__file__), "public_suffix_list.dat")
+
+
+@pytest.fixture(scope="module")
+def lists():
+    with codecs.open(BUNDLED_PSL, encoding="utf-8") as lines:
+        rules = [line.strip() for line in lines]
+    return psl.SuffixList(rules), PublicSuffixList(rules), rules
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    shutil.copy(BUNDLED_PSL, str(tmp_path / psl.PSL_FILENAME))
+    monkeypatch.setattr(psl, "suffix_list", None)
+    return str(tmp_path)
+
+
+def test_same_as_publicsuffixlist(lists):
+    suffix_list, compat, rules = lists
+
+    names = []
+    for rule in rules:
+        if (rule == "") or rule.startswith("//"):
+            continue
+        rule = rule.lstrip("!").replace("*", "any")
+        names += [rule, "www." + rule, "a.b." + rule]
+
+    for name in names:
+        assert suffix_list.find_base_domain(name) == compat.get_public_suffix(name), name
+
+
+@pytest.mark.parametrize("name", [
+    "x.y.domain.gov",
+    "domain.gov",
+    "gov",
+    "WWW.Domain.GOV",
+    "www.domain.gov.",
+    "www..domain.gov",
+    ".domain.gov",
+    "",
+    "domain.notatld",
+    "a.b.domain.notatld",
+    "city.kawasaki.jp",
+    "www.city.kawasaki.jp",
+    "a.b.kawasaki.jp",
+    "www.ck",
+    "a.www.ck",
+    "a.b.ck",
+    "foo.s3.amazonaws.com",
+    "bücher.example.de",
+    "example.xn--55qx5d",
+    "example.公司",
+])
+def test_edge_cases(lists, name):
+    suffix_list, compat, _ = lists
+    assert suffix_list.find_base_domain(name) == compat.get_public_suffix(name)
+
+
+def test_base_domain_for_is_cached(lists):
+    suffix_list, _, _ = lists
+    suffix_list.base_domain_for.cache_clear()
+
+    for i in range(3):
+        assert suffix_list.base_domain_for("x.y.domain.gov") == "domain.gov"
+
+    stats = suffix_list.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (2, 1, 1)
+
+
+def test_cache_is_bounded():
+    suffix_list = psl.SuffixList(["gov"], maxsize=10)
+    for i in range(100):
+        suffix_list.base_domain_for("host%i.domain.gov" % i)
+    assert suffix_list.stats()["size"] == 10
+
+
+def test_loaded_once(cache_dir, monkeypatch):
+    loads = []
+    load_from_cache = psl.load_from_cache
+
+    def counted(cache_dir):
+        loads.append(cache_dir)
+        return load_from_cache(cache_dir)
+    monkeypatch.setattr(psl, "load_from_cache", counted)
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(psl.base_domain_for("a.domain.gov", cache_dir)))
+        for i in range(20)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["domain.gov"] * 20
+    assert len(loads) == 1
+    assert psl.stats()["hits"] + psl.stats()["misses"] == 20
+
+
+def test_shared_by_utils(cache_dir):
+    from utils import scan_utils, utils as gather_utils
+    assert scan_utils.base_domain_for("www.domain.gov", cache_dir) == "domain.gov"
+    assert gather_utils.base_domain_for("www.domain.gov", cache_dir) == "domain.gov"
+    assert psl.stats()["misses"] == 1
@@ -0,0 +1,119 @@
+import socket
+import time
+
+import pytest
+
+from .context import utils  # noqa
+from .stub_dns import StubDNSServer
+from utils import resolver
+
+
+RECORDS = {
+    ("www.example.gov", "A"): (300, ["192.0.2.10", "192.0.2.11"]),
+    ("www.example.gov", "AAAA"): (300, ["2001:db8::10"]),
+    ("short.example.gov", "A"): (1, ["192.0.2.20"]),
+    ("v4only.example.gov", "A"): (300, ["192.0.2.30"]),
+}
+
+
+class SilentDNSServer(StubDNSServer):
+    """Never answers for dead.example.gov."""
+
+    def delay_for(self, name):
+        return None if name == "dead.example.gov" else 0
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    with SilentDNSServer(RECORDS) as server:
+        res = resolver.resolver(nameservers=[server.address], timeout=1, lifetime=1)
+        res.port = server.port
+        monkeypatch.setattr(resolver, "system_resolver", res)
+        resolver.cache.flush()
+        resolver.cache.reset_statistics()
+        yield server
+    resolver.cache.flush()
+
+
+def test_getaddrinfo(stub):
+    results = resolver.getaddrinfo("www.example.gov", 443, 0, socket.SOCK_STREAM)
+    assert sorted(result[4][0] for result in results) == ["192.0.2.10", "192.0.2.11", "2001:db8::10"]
+    assert all(result[4][1] == 443 for result in results)
+
+    results = resolver.getaddrinfo("www.example.gov", 443, socket.AF_INET, socket.SOCK_STREAM)
+    assert sorted(result[4][0] for result in results) == ["192.0.2.10", "192.0.2.11"]
+
+
+@pytest.mark.parametrize("ipv6_usable", [True, False])
+def test_getaddrinfo_orders_by_family(stub, monkeypatch, ipv6_usable):
+    monkeypatch.setattr(resolver, "ipv6_usable", ipv6_usable)
+    results = resolver.getaddrinfo("www.example.gov", 443, 0, socket.SOCK_STREAM)
+    families = [result[0] for result in results]
+    first, last = (socket.AF_INET6, socket.AF_INET) if ipv6_usable else (socket.AF_INET, socket.AF_INET6)
+    assert families == [first] * families.count(first) + [last] * families.count(last)
+    assert families.count(socket.AF_INET) == 2
+
+
+def test_dns_failures_dont_fall_back(stub, monkeypatch):
+    asked = []
+    system_getaddrinfo = resolver.system_getaddrinfo
+    monkeypatch.setattr(resolver, "system_getaddrinfo", lambda host, *args: asked.append(host) or system_getaddrinfo(host, *args))
+
+    with pytest.raises(socket.gaierror) as error:
+        resolver.getaddrinfo("dead.example.gov", 443, socket.AF_INET)
+    assert error.value.errno == socket.EAI_AGAIN
+    assert asked == []
+
+
+def test_answers_are_cached(stub):
+    for i in range(3):
+        resolver.getaddrinfo("www.example.gov", 443, socket.AF_INET)
+
+    assert stub.queries == [("www.example.gov", "A")]
+    # dnspython also looks for a cached NXDOMAIN before asking, so a
+    # cache miss can count twice.
+    stats = resolver.stats()
+    assert stats['hits'] == 2
+    assert stats['misses'] >= 1
+    assert stats['hit_rate'] == 2 / (2 + stats['misses'])
+
+
+def test_ttls_are_honored(stub):
+    resolver.getaddrinfo("short.example.gov", 80, socket.AF_INET)
+    time.sleep(1.1)
+    resolver.getaddrinfo("short.example.gov", 80, socket.AF_INET)
+
+    assert stub.queries == [("short.example.gov", "A")] * 2
+
+
+def test_negative_answers_are_cached(stub):
+    for i in range(2):
+        with pytest.raises(socket.gaierror):
+            resolver.getaddrinfo("missing.example.gov", 80)
+        # Exists, but only has an A record.
+        results = resolver.getaddrinfo("v4only.example.gov", 80, 0, socket.SOCK_STREAM)
+        assert [result[4][0] for result in results] == ["192.0.2.30"]
+
+    assert sorted(set(stub.queries)) == sorted(stub.queries)
+
+
+def test_ip_addresses_skip_dns(stub):
+    results = resolver.getaddrinfo("127.0.0.1", 80, socket.AF_INET, socket.SOCK_STREAM)
+    assert results[0][4] == ("127.0.0.1", 80)
+    assert resolver.gethostbyname("127.0.0.1") == "127.0.0.1"
+    assert stub.queries == []
+
+
+def test_gethostbyname(stub):
+    assert resolver.gethostbyname("www.example.gov") in ("192.0.2.10", "192.0.2.11")
+
+
+def test_install(stub):
+    resolver.install()
+    try:
+        assert socket.getaddrinfo is resolver.getaddrinfo
+        results = socket.getaddrinfo("v4only.example.gov", 80, socket.AF_INET, socket.SOCK_STREAM)
+        assert results[0][4] == ("192.0.2.30", 80)
+    finally:
+        resolver.uninstall()
+    assert socket.getaddrinfo is resolver.system_getaddrinfo
@@ -174,8 +174,12 @@ def test_determine_scan_workers(scanner, options, w_default, w_max, expected):
                 "debug": False,
                 "lambda": False,
                 "meta": False,
+                "meta_phases": False,
+                "adaptive_workers": False,
                 "scan": "analytics",
                 "no_fast_cache": False,
+                "no_dns_cache": False,
+                "preresolve": False,
                 "serial": False,
                 "sort": False,
                 "dmarc": False,
@@ -201,8 +205,12 @@ def test_determine_scan_workers(scanner, options, w_default, w_max, expected):
                 "debug": False,
                 "lambda": False,
                 "meta": False,
+                "meta_phases": False,
+                "adaptive_workers": False,
                 "scan": "noopabc",
                 "no_fast_cache": False,
+                "no_dns_cache": False,
+                "preresolve": False,
                 "serial": False,
                 "sort": False,
                 "dmarc": False,
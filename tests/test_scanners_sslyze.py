@@ -0,0 +1,117 @@
+import datetime
+import threading
+from types import SimpleNamespace
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives.asymmetric import ed25519
+
+try:
+    from scanners import sslyze
+except ImportError as err:
+    # The scanner needs sslyze 3 or 4 (see requirements-scanners.txt).
+    pytest.skip("Can't import the sslyze scanner: %s" % err, allow_module_level=True)
+
+
+def request_for(hostname):
+    server_info = SimpleNamespace(server_location=SimpleNamespace(hostname=hostname))
+    return SimpleNamespace(server_info=server_info)
+
+
+class StubScanner:
+    """
+    Stands in for sslyze's Scanner. Hosts named "slow" don't finish
+    until `release` is set, and hosts named "broken" make it raise.
+    """
+
+    made = []
+
+    def __init__(self, **limits):
+        self.queued = []
+        self.hostnames = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        StubScanner.made.append(self)
+
+    def queue_scan(self, request):
+        self.queued.append(request)
+        self.hostnames.append(request.server_info.server_location.hostname)
+        self.started.set()
+
+    def get_results(self):
+        queued, self.queued = self.queued, []
+        for request in queued:
+            hostname = request.server_info.server_location.hostname
+            if hostname == "slow":
+                self.release.wait(5)
+            if hostname == "broken":
+                raise RuntimeError("scanner broke")
+            if hostname != "missing":
+                yield SimpleNamespace(server_info=request.server_info, hostname=hostname)
+
+
+@pytest.fixture
+def engine():
+    StubScanner.made = []
+    engine = sslyze.SslyzeEngine(scanners=2, make_scanner=StubScanner)
+    yield engine
+    for scanner in StubScanner.made:
+        scanner.release.set()
+    engine.stop()
+
+
+def test_engine_routes_results(engine):
+    assert engine.scan(request_for("a.gov")).hostname == "a.gov"
+    assert engine.scan(request_for("b.gov")).hostname == "b.gov"
+    with pytest.raises(RuntimeError):
+        engine.scan(request_for("missing"))
+
+
+def test_engine_slow_host_blocks_only_its_scanner(engine):
+    slow = {}
+    thread = threading.Thread(target=lambda: slow.update(result=engine.scan(request_for("slow"))))
+    thread.start()
+    for i in range(500):
+        if StubScanner.made and StubScanner.made[0].started.is_set():
+            break
+        thread.join(0.01)
+
+    # Another request is scanned while the slow one is still going.
+    assert engine.scan(request_for("fast.gov")).hostname == "fast.gov"
+    assert thread.is_alive()
+
+    StubScanner.made[0].release.set()
+    thread.join(5)
+    assert slow['result'].hostname == "slow"
+
+
+def test_engine_replaces_a_broken_scanner(engine):
+    with pytest.raises(RuntimeError, match="scanner broke"):
+        engine.scan(request_for("broken"))
+    broken = StubScanner.made[0]
+
+    # Later scans go to a new scanner, and succeed.
+    for hostname in ("a.gov", "b.gov", "c.gov"):
+        assert engine.scan(request_for(hostname)).hostname == hostname
+    assert broken.hostnames == ["broken"]
+
+
+def test_analyze_certs_without_a_key_size():
+    key = ed25519.Ed25519PrivateKey.generate()
+    name = x509.Name([x509.NameAttribute(x509.oid.NameOID.COMMON_NAME, "ed25519.example.gov")])
+    now = datetime.datetime.utcnow()
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key()) \
+        .serial_number(1).not_valid_before(now - datetime.timedelta(days=1)) \
+        .not_valid_after(now + datetime.timedelta(days=1)).sign(key, None)
+    deployment = SimpleNamespace(
+        received_certificate_chain=[cert], verified_certificate_chain=None,
+        verified_chain_has_sha1_signature=False, verified_chain_has_legacy_symantec_anchor=False,
+    )
+
+    certs = sslyze.analyze_certs(SimpleNamespace(certificate_deployments=[deployment]))
+
+    assert certs['key_length'] is None
+    assert certs['certificate_less_than_2048'] is None
+    # The fields after it are still filled in.
+    assert certs['expired_certificate'] is False
+    assert certs['is_symantec_cert'] is False
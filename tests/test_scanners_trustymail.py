@@ -0,0 +1,103 @@
+import os
+import shutil
+
+import publicsuffixlist
+import pytest
+
+# trustymail.domain can only be imported after trustymail.trustymail.
+import trustymail.trustymail as tmail
+import trustymail.domain as tmail_domain
+
+from scanners import trustymail
+from utils import psl
+
+BUNDLED_PSL = os.path.join(os.path.dirname(publicsuffixlist.__file__), "public_suffix_list.dat")
+
+
+class MockDomain:
+    def __init__(self):
+        self.starttls_results = {}
+        self.mail_servers = []
+        self.ports_tested = set()
+
+    def generate_results(self):
+        return {}
+
+
+@pytest.fixture
+def tmail_scan(monkeypatch):
+    # Record what trustymail was asked to do, and what was in its SMTP
+    # cache at the time, instead of scanning.
+    calls = []
+
+    def scan(domain, timeout, smtp_timeout, smtp_localhost, smtp_ports,
+             smtp_cache, scan_types, dns_hostnames):
+        calls.append({
+            'scan_types': dict(scan_types),
+            'smtp_cache': dict(tmail._SMTP_CACHE)
+        })
+        return MockDomain()
+
+    monkeypatch.setattr(tmail, "scan", scan)
+    monkeypatch.setattr(tmail, "_SMTP_CACHE", {})
+    return calls
+
+
+CACHED = {'supports_smtp': True, 'starttls': False}
+
+
+@pytest.mark.parametrize("environment,options,starttls,seeded", [
+    # Some mail servers cached: only the others get tested.
+    (
+        {'cached_data': {'mx1.example.gov:25': CACHED}, 'all_cached': False},
+        {},
+        True,
+        {'mx1.example.gov:25': CACHED},
+    ),
+    # Without trustymail's SMTP cache, everything gets tested.
+    (
+        {'cached_data': {'mx1.example.gov:25': CACHED}, 'all_cached': False},
+        {'no_smtp_cache': True},
+        True,
+        {},
+    ),
+    # Every mail server cached: no STARTTLS scan at all.
+    (
+        {'cached_data': {'mx1.example.gov:25': CACHED}, 'all_cached': True},
+        {},
+        False,
+        {},
+    ),
+    # Nothing cached.
+    (
+        {'cached_data': {}, 'all_cached': False},
+        {},
+        True,
+        {},
+    ),
+])
+def test_scan_reuses_cached_mail_servers(tmail_scan, environment, options,
+                                         starttls, seeded):
+    environment['scan_method'] = 'local'
+    trustymail.scan('example.gov', environment, options)
+
+    assert tmail_scan[0]['scan_types']['starttls'] is starttls
+    assert tmail_scan[0]['smtp_cache'] == seeded
+
+
+def test_scan_uses_the_shared_psl(tmail_scan, tmp_path, monkeypatch):
+    shutil.copy(BUNDLED_PSL, str(tmp_path / psl.PSL_FILENAME))
+    monkeypatch.setattr(psl, "suffix_list", None)
+    # Put back whatever the scan replaces.
+    monkeypatch.setattr(tmail_domain, "get_public_suffix", tmail_domain.get_public_suffix)
+    monkeypatch.setattr(tmail, "get_public_suffix", tmail.get_public_suffix)
+
+    def get_psl():
+        raise AssertionError("trustymail loaded its own PSL")
+    monkeypatch.setattr(tmail_domain, "get_psl", get_psl)
+
+    environment = {'cached_data': {}, 'all_cached': False, 'scan_method': 'local'}
+    trustymail.scan('example.gov', environment, {'_': {'cache_dir': str(tmp_path)}})
+
+    assert tmail_domain.get_public_suffix("www.agency.gov") == "agency.gov"
+    assert tmail.get_public_suffix("mail.agency.co.uk") == "agency.co.uk"
@@ -0,0 +1,203 @@
+import threading
+import time
+
+from .context import utils  # noqa
+from utils.scheduler import Scheduler
+
+import pytest
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_runs_every_task(workers):
+    done = []
+    lock = threading.Lock()
+
+    def perform(task):
+        with lock:
+            done.append(task)
+
+    Scheduler(perform, workers).run(iter(range(50)))
+    assert sorted(done) == list(range(50))
+
+
+def test_deferred_task_does_not_block_worker():
+    # With a single worker, the other tasks should all run while the
+    # first one waits out its retry delay.
+    order = []
+
+    def perform(task):
+        name, attempt = task
+        order.append((name, attempt, time.monotonic()))
+        if name == "flaky" and attempt == 0:
+            return 0.2, (name, attempt + 1)
+
+    scheduler = Scheduler(perform, 1)
+    start = time.monotonic()
+    scheduler.run([("flaky", 0), ("a", 0), ("b", 0)])
+
+    assert [(name, attempt) for name, attempt, at in order] == [
+        ("flaky", 0), ("a", 0), ("b", 0), ("flaky", 1)
+    ]
+    assert order[-1][2] - start >= 0.2
+    assert scheduler.retries == 1
+    assert scheduler.retry_delay == 0.2
+
+
+def test_waits_for_running_tasks_that_may_defer():
+    # A worker with nothing to do must not quit while another worker's
+    # task might still put itself back on the queue.
+    runs = []
+
+    def perform(task):
+        runs.append(task)
+        if task < 3:
+            time.sleep(0.05)
+            return 0.01, task + 1
+
+    Scheduler(perform, 4).run([0])
+    assert runs == [0, 1, 2, 3]
+
+
+def test_exception_in_task_is_not_fatal():
+    done = []
+
+    def perform(task):
+        if task == 1:
+            raise ValueError(task)
+        done.append(task)
+
+    Scheduler(perform, 2).run([0, 1, 2])
+    assert sorted(done) == [0, 2]
+
+
+def test_error_reading_tasks_is_raised():
+    def tasks():
+        yield 0
+        raise OSError("can't read domains")
+
+    with pytest.raises(OSError):
+        Scheduler(lambda task: None, 2).run(tasks())
+
+
+def test_limit():
+    # Of 8 workers, only as many as the limit run tasks at once, and
+    # raising it lets the rest in.
+    lock = threading.Lock()
+    running, most = [0], []
+    scheduler = Scheduler(None, 8, limit=2)
+
+    def perform(task):
+        with lock:
+            running[0] += 1
+            most.append(running[0])
+        if task == 10:
+            scheduler.set_limit(8)
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+
+    scheduler.perform = perform
+    scheduler.run(iter(range(40)))
+    assert max(most[:10]) <= 2
+    assert max(most) > 2
+    assert scheduler.set_limit(100) == 8
+    assert scheduler.set_limit(0) == 1
+
+
+def test_key_limits():
+    # Tasks are (origin, number); at most one per origin runs at once,
+    # and the others run meanwhile rather than waiting.
+    lock = threading.Lock()
+    running, overlaps, order = {}, [], []
+
+    def perform(task):
+        origin, number = task
+        with lock:
+            running[origin] = running.get(origin, 0) + 1
+            overlaps.append(running[origin])
+            order.append(task)
+        time.sleep(0.02 if origin == "big" else 0.001)
+        with lock:
+            running[origin] -= 1
+
+    tasks = [("big", i) for i in range(4)] + [("small%i" % i, 0) for i in range(10)]
+    scheduler = Scheduler(perform, 4, keys=lambda task: [("origin", task[0])], key_limits={"origin": 1})
+    scheduler.run(tasks)
+
+    assert max(overlaps) == 1
+    assert sorted(order) == sorted(tasks)
+    # The small ones didn't wait for the big ones.
+    assert order.index(("small9", 0)) < order.index(("big", 3))
+    assert scheduler.postponed >= 3
+
+
+def test_key_limits_lookahead():
+    # With nowhere to set tasks aside, workers wait for the limit.
+    lock = threading.Lock()
+    running, overlaps = [0], []
+
+    def perform(task):
+        with lock:
+            running[0] += 1
+            overlaps.append(running[0])
+        time.sleep(0.005)
+        with lock:
+            running[0] -= 1
+
+    scheduler = Scheduler(perform, 4, keys=lambda task: [("ip", "192.0.2.1")], key_limits={"ip": 2}, lookahead=1)
+    scheduler.run(range(20))
+    assert max(overlaps) <= 2
+    assert scheduler.most_set_aside == 1
+
+
+def test_key_limits_retries():
+    runs = []
+
+    def perform(task):
+        name, attempt = task
+        runs.append(task)
+        if attempt == 0:
+            return 0.01, (name, 1)
+
+    scheduler = Scheduler(perform, 3, keys=lambda task: [("origin", "same")], key_limits={"origin": 1})
+    scheduler.run([("a", 0), ("b", 0), ("c", 0)])
+    assert sorted(runs) == [(name, attempt) for name in "abc" for attempt in (0, 1)]
+
+
+def test_tasks_not_ready_yet():
+    # A task source with nothing yet, but more to come, yields None.
+    ready = threading.Event()
+    threading.Timer(0.1, ready.set).start()
+    done = []
+
+    def tasks():
+        while not ready.is_set():
+            yield None
+        yield from range(3)
+
+    start = time.monotonic()
+    Scheduler(done.append, 2, poll=0.01).run(tasks())
+    assert sorted(done) == [0, 1, 2]
+    assert time.monotonic() - start >= 0.1
+
+
+def test_slow_task_source_does_not_hold_up_workers():
+    # Asking for a task can be slow (like leasing one from a busy work
+    # queue); meanwhile, the other worker should still run retries.
+    retried = threading.Event()
+    done = []
+
+    def perform(task):
+        done.append(task)
+        if task == "flaky":
+            return 0.01, "flaky again"
+        if task == "flaky again":
+            retried.set()
+
+    def tasks():
+        yield "flaky"
+        assert retried.wait(5)
+        yield "last"
+
+    Scheduler(perform, 2).run(tasks())
+    assert done == ["flaky", "flaky again", "last"]
@@ -0,0 +1,101 @@
+import json
+import threading
+import time
+
+import pytest
+
+from .context import utils  # noqa
+from utils import phases, trace
+from utils.scheduler import Scheduler, queue_wait
+
+
+@pytest.fixture
+def trace_file(tmpdir):
+    path = str(tmpdir.join("trace.json"))
+    trace.start(path)
+    yield path
+    trace.stop()
+
+
+def events(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def test_off_by_default():
+    assert not trace.enabled()
+    with trace.span("nothing", a=1) as span:
+        span.finish()
+    trace.record("nothing", 0, 1)
+    trace.instant("nothing")
+
+
+def test_spans(trace_file):
+    timings = {}
+    with trace.task("noop example.gov", scanner="noop", domain="example.gov"):
+        with phases.timed(timings, "scan"):
+            with trace.span("page", url="https://example.gov/"):
+                time.sleep(0.01)
+            span = trace.span("by hand").start()
+            span.finish(status=200)
+        trace.instant("deferred", delay=5)
+    trace.stop()
+
+    found = {event['name']: event for event in events(trace_file)}
+    assert found['thread_name']['ph'] == "M"
+    assert found['thread_name']['args']['name'] == threading.current_thread().name
+
+    task, scan, page = found['noop example.gov'], found['scan'], found['page']
+    for event in (task, scan, page, found['by hand']):
+        assert event['ph'] == "X"
+        assert event['cat'] == "noop"
+        assert event['tid'] == task['tid']
+    # Each span nests inside the one around it.
+    assert task['ts'] <= scan['ts'] <= page['ts']
+    assert page['ts'] + page['dur'] <= scan['ts'] + scan['dur'] <= task['ts'] + task['dur']
+    assert page['dur'] >= 10000
+    assert page['args'] == {'scanner': "noop", 'domain': "example.gov", 'url': "https://example.gov/"}
+    assert found['by hand']['args']['status'] == 200
+    assert found['deferred']['ph'] == "i"
+    assert found['deferred']['args']['delay'] == 5
+
+    # Spans outside the task aren't tagged with it.
+    assert trace.context() == {}
+
+
+def test_threads(trace_file):
+    def work(i):
+        with trace.task("task %i" % i, domain="d%i.gov" % i):
+            with trace.span("inner"):
+                pass
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    trace.stop()
+
+    found = events(trace_file)
+    inner = [event for event in found if event['name'] == "inner"]
+    assert sorted(event['args']['domain'] for event in inner) == ["d%i.gov" % i for i in range(8)]
+    assert len([event for event in found if event['name'] == "thread_name"]) == 8
+
+
+def test_queue_wait():
+    waits = {}
+
+    def perform(task):
+        name, attempt = task
+        waits[(name, attempt)] = queue_wait()
+        if name == "retry" and attempt == 0:
+            return 0.05, (name, 1)
+        if name == "slow":
+            time.sleep(0.2)
+        return None
+
+    # One worker: the retry comes due while "slow" is running, so it
+    # waits for it to finish.
+    Scheduler(perform, 1).run(iter([("retry", 0), ("slow", 0)]))
+    assert waits[("retry", 0)] < 0.05
+    assert waits[("retry", 1)] >= 0.1
@@ -0,0 +1,143 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from .context import utils  # noqa
+from utils import work_queue
+from utils.scheduler import Scheduler
+
+
+@pytest.fixture
+def queue(tmpdir):
+    queue = work_queue.open_queue(str(tmpdir.join("queue.db")))
+    yield queue
+    queue.close()
+
+
+def test_add_and_lease(queue):
+    assert queue.add("noop", ["a.gov", "b.gov"]) == 2
+    # Adding them again (say, a restarted coordinator) changes nothing.
+    assert queue.add("noop", ["a.gov", "b.gov", "c.gov"]) == 1
+    queue.add("pshtt", ["a.gov"])
+
+    first = queue.lease("worker-1", "noop", 60)
+    second = queue.lease("worker-2", "noop", 60)
+    assert (first.domain, second.domain) == ("a.gov", "b.gov")
+    assert queue.progress("noop") == {'queued': 1, 'leased': 2, 'done': 0, 'expired_leases': 0}
+
+    queue.complete(first, [["a.gov", "a.gov", "1"]])
+    queue.complete(second, [["b.gov", "b.gov", "2"]])
+    queue.complete(queue.lease("worker-1", "noop", 60), [])
+    assert queue.lease("worker-1", "noop", 60) is None
+    assert queue.finished("noop")
+    assert not queue.finished()
+
+    assert [result.rows for result in queue.results("noop")] == [[["a.gov", "a.gov", "1"]], [["b.gov", "b.gov", "2"]], []]
+
+
+def test_expired_leases(queue):
+    queue.add("noop", ["a.gov"])
+    dead = queue.lease("dead-worker", "noop", 0.05)
+    assert queue.lease("worker", "noop", 60) is None
+
+    # The dead worker's lease runs out, and someone else gets the task.
+    time.sleep(0.1)
+    alive = queue.lease("worker", "noop", 0.05)
+    assert alive.id == dead.id
+    assert queue.progress("noop")['expired_leases'] == 1
+
+    # Renewing keeps it.
+    queue.renew("worker", [alive.id], 60)
+    time.sleep(0.1)
+    assert queue.lease("other-worker", "noop", 60) is None
+
+    # The first to finish it wins.
+    queue.complete(alive, [["from", "alive"]])
+    queue.complete(dead, [["from", "dead"]])
+    assert [result.rows for result in queue.results("noop")] == [[["from", "alive"]]]
+
+
+def test_gives_up(queue):
+    queue.add("noop", ["poison.gov"])
+    for i in range(work_queue.default_max_leases):
+        assert queue.lease("worker-%i" % i, "noop", 0.01) is not None
+        time.sleep(0.02)
+    assert queue.lease("worker", "noop", 60) is None
+    result = next(queue.results("noop"))
+    assert result.rows is None
+    assert "expired 3 times" in result.error
+
+
+def test_only_unfinished_leases_are_renewed(queue):
+    queue.add("noop", ["a.gov", "b.gov", "c.gov"])
+    worker = work_queue.Worker(queue, lease_time=0.3).start()
+    tasks = worker.tasks("noop", lambda task: task)
+    first, second, third = next(tasks), next(tasks), next(tasks)
+
+    # Telling the queue about the first fails (say, the database stays
+    # locked), the second raised, and the third is still being scanned.
+    complete = queue.complete
+
+    def locked(task, rows, error=None):
+        raise sqlite3.OperationalError("database is locked")
+    queue.complete = locked
+    worker.finish(first, [["a.gov"]])
+    queue.complete = complete
+    worker.finish(second, None, "Unknown exception scanning b.gov.")
+
+    # The first's lease runs out, and another worker takes it over,
+    # but the third's is kept alive.
+    time.sleep(0.5)
+    assert queue.lease("other-worker", "noop", 60).id == first.id
+    assert queue.lease("other-worker", "noop", 60) is None
+
+    worker.finish(third, [["c.gov"]])
+    worker.stop()
+    assert [(result.domain, result.rows, result.error) for result in queue.results("noop")] == [
+        ("b.gov", None, "Unknown exception scanning b.gov."),
+        ("c.gov", [["c.gov"]], None),
+    ]
+
+
+def test_reports(queue):
+    queue.report("worker-1", "noop", {'retries': 1})
+    queue.report("worker-2", "noop", {'retries': 2})
+    queue.report("worker-1", "noop", {'retries': 3})
+    assert queue.reports("noop") == [{'retries': 3}, {'retries': 2}]
+
+
+def test_open_queue(tmpdir):
+    path = str(tmpdir.join("sub", "queue.db"))
+    work_queue.open_queue("sqlite://%s" % path).close()
+    with pytest.raises(ValueError):
+        work_queue.open_queue("redis://localhost/0")
+
+
+def test_workers(queue):
+    # Two workers drain the queue between them, one scheduler each.
+    domains = ["d%i.gov" % i for i in range(50)]
+    queue.add("noop", domains)
+    done = []
+    lock = threading.Lock()
+
+    def work():
+        worker = work_queue.Worker(queue, lease_time=5).start()
+
+        def perform(task):
+            with lock:
+                done.append(task.domain)
+            worker.finish(task, [[task.domain]])
+
+        Scheduler(perform, 3, poll=0.01).run(worker.tasks("noop", lambda task: task))
+        worker.stop()
+
+    threads = [threading.Thread(target=work) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(done) == sorted(domains)
+    assert [result.domain for result in queue.results("noop")] == domains
@@ -1,3 +1,7 @@
 # The environment dictionary key whose corresponding value is the fast
 # cache data
 FAST_CACHE_KEY = 'fastcache'
+
+# The environment dictionary key whose corresponding value is the
+# registry of fast cache entries that are being scanned right now
+IN_FLIGHT_KEY = 'inflight'
@@ -0,0 +1,185 @@
+import logging
+import statistics
+import threading
+import time
+
+from utils.metrics import timed_out
+
+###
+# Adaptive concurrency for a scanner (--adaptive-workers): how many of
+# its domains are scanned at once is adjusted as it runs, between
+# --min-workers and --max-workers, from what the last few seconds of
+# domains did.
+#
+# Every `interval` seconds (once enough domains have finished), the
+# window just gone is compared to the one before it:
+#
+#   - Too many timeouts, or a jump in errors right after adding
+#     workers, means the scan is overloading something (the network,
+#     the host running it, the servers being scanned): back off by a
+#     quarter.
+#   - Otherwise this is hill climbing on throughput. If the last
+#     change bought more domains/sec, make another like it; if it cost
+#     some, go the other way.
+#   - If throughput didn't change much, more workers only helped if
+#     the domains aren't taking longer: step down if they are, and
+#     otherwise try a few more workers.
+#
+# So a scan that starts out on dead hosts that fail fast, and moves on
+# to live ones that take their time, gets more workers as that happens,
+# and fewer when they start timing out.
+###
+
+# Seconds per window.
+default_interval = 10.0
+
+# Fewest domains a window needs before it's worth comparing.
+default_min_samples = 10
+
+# Throughput changes smaller than this fraction count as no change.
+tolerance = 0.05
+
+# Back off when more than this fraction of a window's domains time out.
+timeout_threshold = 0.2
+
+# ...or when the fraction with errors rises by more than this after
+# adding workers.
+error_jump = 0.2
+
+# Domains taking this much longer (as a fraction) than in the last
+# window, for no more throughput, is a sign of too many workers.
+latency_slack = 0.5
+
+# Each step changes the limit by this fraction of it (at least 1).
+step_fraction = 0.25
+
+
+class Window(object):
+    """What the domains finished during one window did."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.start = time.monotonic()
+        self.latencies = []
+        self.errors = 0
+        self.timeouts = 0
+
+    def summary(self, now):
+        count = len(self.latencies)
+        elapsed = max(now - self.start, 1e-9)
+        return {
+            'limit': self.limit,
+            'count': count,
+            'throughput': count / elapsed,
+            'latency': statistics.median(self.latencies) if count else 0.0,
+            'error_rate': self.errors / count if count else 0.0,
+            'timeout_rate': self.timeouts / count if count else 0.0,
+        }
+
+
+class Autoscaler(object):
+    """
+    Adjusts a Scheduler's limit, from the domains observe() is told
+    about, between `minimum` and `maximum`.
+    """
+
+    def __init__(self, name, minimum, maximum, start=None,
+                 interval=default_interval, min_samples=default_min_samples):
+        self.name = name
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.start = max(self.minimum, min(start or self.minimum, self.maximum))
+        self.limit = self.start
+        self.interval = interval
+        self.min_samples = min_samples
+        self.scheduler = None
+
+        self.lock = threading.Lock()
+        self.origin = time.monotonic()
+        self.window = Window(self.limit)
+        self.previous = None
+        # +1 while adding workers, -1 while taking them away.
+        self.direction = 1
+        # Every change made, for meta.json.
+        self.history = []
+
+    def attach(self, scheduler):
+        self.scheduler = scheduler
+        self.limit = scheduler.set_limit(self.limit)
+
+    # One domain's attempt took `seconds`, ending with `errors`.
+    def observe(self, seconds, errors=None):
+        errors = errors or []
+        with self.lock:
+            window = self.window
+            window.latencies.append(seconds)
+            window.errors += int(bool(errors))
+            window.timeouts += int(timed_out(errors))
+
+            now = time.monotonic()
+            if (now - window.start) < self.interval or len(window.latencies) < self.min_samples:
+                return
+            self.adjust(window.summary(now))
+
+    # Decide on a new limit from the window just ended, and start the
+    # next one. Called with the lock held.
+    def adjust(self, current):
+        previous, self.previous = self.previous, current
+        step = max(1, int(round(self.limit * step_fraction)))
+
+        if current['timeout_rate'] > timeout_threshold:
+            reason = "%i%% timed out" % round(current['timeout_rate'] * 100)
+            self.direction = -1
+        elif previous is not None and current['limit'] > previous['limit'] and \
+                current['error_rate'] - previous['error_rate'] > error_jump:
+            reason = "errors rose from %i%% to %i%%" % (
+                round(previous['error_rate'] * 100), round(current['error_rate'] * 100))
+            self.direction = -1
+        elif previous is None:
+            reason = "first window"
+            self.direction = 1
+        else:
+            gain = (current['throughput'] / previous['throughput'] - 1) if previous['throughput'] else 1.0
+            slower = current['latency'] > previous['latency'] * (1 + latency_slack)
+            if gain > tolerance:
+                reason = "throughput up %i%%" % round(gain * 100)
+            elif gain < -tolerance:
+                reason = "throughput down %i%%" % round(-gain * 100)
+                self.direction = -self.direction
+            elif slower:
+                reason = "no faster, but each domain slower"
+                self.direction = -1
+            else:
+                reason = "no slower"
+                self.direction = 1
+
+        limit = max(self.minimum, min(self.limit + self.direction * step, self.maximum))
+        if limit != self.limit:
+            logging.warning(
+                "[%s] Concurrency %i -> %i: %s (%.1f domains/s, median %.2fs, %i%% errors, %i%% timeouts)."
+                % (self.name, self.limit, limit, reason, current['throughput'], current['latency'],
+                   round(current['error_rate'] * 100), round(current['timeout_rate'] * 100)))
+            self.history.append({
+                'time': round(time.monotonic() - self.origin, 3),
+                'from': self.limit, 'to': limit, 'reason': reason,
+                'throughput': round(current['throughput'], 3),
+                'latency': round(current['latency'], 6),
+                'error_rate': round(current['error_rate'], 3),
+                'timeout_rate': round(current['timeout_rate'], 3),
+            })
+            self.limit = limit
+            if self.scheduler is not None:
+                self.limit = self.scheduler.set_limit(limit)
+
+        self.window = Window(self.limit)
+
+    # What it settled on, for meta.json and the log.
+    def report(self):
+        with self.lock:
+            return {
+                'minimum': self.minimum,
+                'maximum': self.maximum,
+                'start': self.start,
+                'final': self.limit,
+                'adjustments': self.history,
+            }
@@ -0,0 +1,100 @@
+import csv
+import heapq
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+
+###
+# De-duplicating hostnames that don't all fit in memory.
+#
+# The gatherers can return tens of millions of hostnames between them.
+# Rather than holding every one in a dict, a HostnameDeduper keeps a
+# batch of them in memory, and when the batch is full writes it out to
+# a spill file, sorted. Reading the hostnames back merges the spill
+# files (and whatever's left in memory) in sorted order, combining the
+# entries for the same hostname as it goes.
+#
+# For each hostname, the sources it came from are kept as a bitmask,
+# one bit per source, rather than a list of names.
+###
+
+# Hostnames held in memory before a batch is spilled to disk.
+default_batch_size = 1000000
+
+
+class HostnameDeduper(object):
+    """
+    A sorted set of hostnames, each with the sources it was seen in.
+
+    Add hostnames with add(), then iterate over it (once) to get
+    (hostname, sources) pairs in sorted order, `sources` being the
+    names of the sources in the order they were given. Memory use is
+    bounded by `batch_size`; spill files go in a temporary directory
+    under `spill_dir`, removed by close().
+    """
+
+    def __init__(self, sources, batch_size=default_batch_size, spill_dir=None):
+        self.sources = list(sources)
+        self.bits = {}
+        for source in self.sources:
+            self.bits.setdefault(source, 1 << len(self.bits))
+        self.batch_size = batch_size
+        self.batch = {}
+        self.spill_dir = spill_dir
+        self.tmp_dir = None
+        self.spills = []
+
+    def add(self, hostname, source):
+        self.batch[hostname] = self.batch.get(hostname, 0) | self.bits[source]
+        if len(self.batch) >= self.batch_size:
+            self.spill()
+
+    def spill(self):
+        if self.tmp_dir is None:
+            if self.spill_dir is not None:
+                os.makedirs(self.spill_dir, exist_ok=True)
+            self.tmp_dir = tempfile.mkdtemp(prefix="gather-", dir=self.spill_dir)
+
+        path = os.path.join(self.tmp_dir, "%i.csv" % len(self.spills))
+        logging.debug("Spilling %i hostnames to %s." % (len(self.batch), path))
+        with open(path, 'w', encoding='utf-8', newline='') as spill_file:
+            writer = csv.writer(spill_file)
+            for hostname in sorted(self.batch):
+                writer.writerow([hostname, self.batch[hostname]])
+        self.spills.append(path)
+        self.batch = {}
+
+    def __iter__(self):
+        runs = [read_spill(path) for path in self.spills]
+        runs.append((hostname, self.batch[hostname]) for hostname in sorted(self.batch))
+
+        merged = heapq.merge(*runs, key=lambda entry: entry[0])
+        for hostname, entries in itertools.groupby(merged, key=lambda entry: entry[0]):
+            mask = 0
+            for _, entry_mask in entries:
+                mask |= entry_mask
+            yield hostname, self.sources_for(mask)
+
+    def sources_for(self, mask):
+        return [source for source in self.sources if mask & self.bits[source]]
+
+    def close(self):
+        self.batch = {}
+        self.spills = []
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            self.tmp_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def read_spill(path):
+    with open(path, encoding='utf-8', newline='') as spill_file:
+        for hostname, mask in csv.reader(spill_file):
+            yield hostname, int(mask)
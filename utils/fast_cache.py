@@ -0,0 +1,194 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from utils import FAST_CACHE_KEY, IN_FLIGHT_KEY
+
+###
+# A fast cache that outlives a single run.
+#
+# Normally the fast cache is a plain dict that scanners fill in their
+# post_scan hook and that is thrown away at the end of the run. With
+# --fast-cache-ttl, scanners that support it load a PersistentFastCache
+# in their init function instead. It's still a dict, so scanners use it
+# exactly as before, but every entry is also written to a SQLite
+# database in the cache directory along with when it was written.
+# Entries older than the TTL are ignored on load.
+#
+# Each scanner gets its own namespace in the database. SQLite takes
+# care of locking between concurrent runs sharing the same file.
+#
+# Alongside the fast cache, an InFlight registry keeps track of which
+# entries are being scanned right now, so that domains sharing (say) a
+# mail server don't all probe it at once.
+###
+
+# Name of the database file, in the cache directory.
+FAST_CACHE_FILENAME = "fast-cache.sqlite3"
+
+# Seconds to wait on another process's lock before giving up.
+LOCK_TIMEOUT = 30
+
+# Seconds to wait for another worker to finish scanning a fast cache
+# entry before scanning it anyway.
+default_in_flight_timeout = 300
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fast_cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+)
+"""
+
+
+class PersistentFastCache(dict):
+    """
+    A dict whose items are also stored, with a timestamp, in SQLite.
+
+    Items loaded from (or written to) the database stay for `ttl`
+    seconds. Writing an item over one that is still fresh in the
+    database leaves the database alone, since another run may have
+    stored it while this one was running, and the earlier result is
+    more likely to be correct.
+    """
+
+    def __init__(self, path, namespace, ttl):
+        super().__init__()
+        self.path = path
+        self.namespace = namespace
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=LOCK_TIMEOUT, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(SCHEMA)
+        self.load()
+
+    def load(self):
+        cutoff = time.time() - self.ttl
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM fast_cache WHERE namespace = ? AND updated < ?",
+                (self.namespace, cutoff))
+            rows = self.connection.execute(
+                "SELECT key, value FROM fast_cache WHERE namespace = ?",
+                (self.namespace,)).fetchall()
+
+        for key, value in rows:
+            super().__setitem__(key, json.loads(value))
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO fast_cache (namespace, key, value, updated) "
+                "VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (namespace, key) DO UPDATE "
+                "SET value = excluded.value, updated = excluded.updated "
+                "WHERE fast_cache.updated < ?",
+                (self.namespace, key, json.dumps(value), now, now - self.ttl))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+class InFlight(object):
+    """
+    The fast cache entries some domain's scan has claimed to fill in.
+
+    A worker that needs an entry nobody has cached yet claims it. Any
+    other worker that needs the same entry meanwhile waits (up to a
+    timeout) for the claim to be released, and then uses the cached
+    result instead of scanning it again.
+
+    Claims are made by owner (the domain being scanned) and released
+    all together once that domain's scan, including its post_scan hook,
+    is over. To avoid deadlocks, a worker should claim all the entries
+    it needs in sorted order.
+    """
+
+    def __init__(self, timeout=default_in_flight_timeout):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.claims = {}
+
+        # Entries claimed, entries that came from a scan another worker
+        # was already running, and waits that timed out.
+        self.claimed = 0
+        self.coalesced = 0
+        self.timed_out = 0
+
+    # Return True if `owner` should scan `key` itself, or False if the
+    # result is now in `cache`.
+    def claim(self, key, owner, cache):
+        waited = False
+        while True:
+            with self.lock:
+                if key in cache:
+                    if waited:
+                        self.coalesced += 1
+                    return False
+
+                claim = self.claims.get(key)
+                if claim is None:
+                    self.claims[key] = (owner, threading.Event())
+                    self.claimed += 1
+                    return True
+                if claim[0] == owner:
+                    return True
+                done = claim[1]
+
+            logging.debug("Waiting for another scan of %s to finish." % key)
+            if not done.wait(self.timeout):
+                logging.warning("Timed out waiting for another scan of %s, scanning it again." % key)
+                with self.lock:
+                    self.timed_out += 1
+                return True
+            waited = True
+
+    # Release every claim `owner` holds.
+    def release(self, owner):
+        with self.lock:
+            for key, claim in list(self.claims.items()):
+                if claim[0] == owner:
+                    del self.claims[key]
+                    claim[1].set()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'claimed': self.claimed,
+                'coalesced': self.coalesced,
+                'timed_out': self.timed_out
+            }
+
+
+# For a scanner's init function: the environment entries that set up
+# the scanner's fast cache and its InFlight registry, unless fast
+# caching was turned off. With --fast-cache-ttl, the fast cache is a
+# PersistentFastCache.
+def environment_for(namespace, options):
+    if options.get("no_fast_cache"):
+        return {}
+
+    in_flight = InFlight(float(options.get("fast_cache_wait") or default_in_flight_timeout))
+
+    ttl = options.get("fast_cache_ttl")
+    if ttl is None:
+        return {FAST_CACHE_KEY: {}, IN_FLIGHT_KEY: in_flight}
+
+    cache_dir = options.get("_", {}).get("cache_dir", "./cache")
+    os.makedirs(cache_dir, exist_ok=True)
+    cache = PersistentFastCache(
+        os.path.join(cache_dir, FAST_CACHE_FILENAME), namespace, float(ttl))
+    logging.warning("[%s] Loaded %i fast cache entries from earlier runs." % (namespace, len(cache)))
+
+    return {FAST_CACHE_KEY: cache, IN_FLIGHT_KEY: in_flight}
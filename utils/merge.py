@@ -0,0 +1,269 @@
+import csv
+import filecmp
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import uuid
+
+import strict_rfc3339
+
+from utils import fast_cache, phases, scan_utils
+
+###
+# Combine the output of a scan run in shards (scan --shard i/N) on
+# several machines into what one machine would have written: each
+# scanner's results CSV, meta.json and the cache. See ./merge.
+#
+# Sharding is by base domain, so the shards' domains (and their cache
+# files) don't overlap. Cache files every shard has are merged if they
+# hold entries for the shard's own domains: preresolve.json, and the
+# fast cache database (--fast-cache-ttl). The rest, like the Public
+# Suffix List, are taken from whichever shard wrote them last.
+###
+
+# Cache files that are merged as JSON dicts rather than copied.
+MERGED_CACHE_FILES = ("preresolve.json",)
+
+# Fast cache databases are merged row by row.
+FAST_CACHE_FILES = (fast_cache.FAST_CACHE_FILENAME,)
+
+
+def merge(shard_dirs, output_dir, sort=False, command=None):
+    """
+    Merge the `--output` directories of scan's shards into
+    `output_dir`, sorting the results CSVs by domain if `sort`.
+    Returns the merged meta.json's contents, if the shards had any.
+    """
+    results_dir = os.path.join(output_dir, "results")
+    cache_dir = os.path.join(output_dir, "cache")
+    scan_utils.mkdir_p(results_dir)
+    scan_utils.mkdir_p(cache_dir)
+
+    # Like scan, clear out existing result CSVs, to avoid inconsistent data.
+    for name in os.listdir(results_dir):
+        if name.endswith(".csv"):
+            os.remove(os.path.join(results_dir, name))
+
+    merge_results([os.path.join(shard, "results") for shard in shard_dirs], results_dir, sort=sort)
+    merge_caches([os.path.join(shard, "cache") for shard in shard_dirs], cache_dir)
+
+    metas = []
+    for shard in shard_dirs:
+        path = os.path.join(shard, "results", "meta.json")
+        if os.path.exists(path):
+            metas.append((shard, json.loads(scan_utils.read(path))))
+    if not metas:
+        return None
+    metadata = merge_meta(metas, command=command)
+    scan_utils.write(scan_utils.json_for(metadata), os.path.join(results_dir, "meta.json"))
+    return metadata
+
+
+# Concatenate each scanner's CSV from every shard, under one header.
+def merge_results(results_dirs, output_dir, sort=False):
+    names = sorted({
+        name
+        for results_dir in results_dirs if os.path.isdir(results_dir)
+        for name in os.listdir(results_dir) if name.endswith(".csv")
+    })
+
+    for name in names:
+        filename = os.path.join(output_dir, name)
+        header = None
+        with open(filename, 'w', encoding='utf-8', newline='') as output:
+            writer = csv.writer(output)
+            for results_dir in results_dirs:
+                path = os.path.join(results_dir, name)
+                if not os.path.exists(path):
+                    continue
+                with open(path, encoding='utf-8', newline='') as shard_file:
+                    reader = csv.reader(shard_file)
+                    shard_header = next(reader, None)
+                    if shard_header is None:
+                        continue
+                    if header is None:
+                        header = shard_header
+                        writer.writerow(header)
+                    elif shard_header != header:
+                        raise ValueError(
+                            "%s has different columns than the other shards' %s. "
+                            "Were they scanned with the same options?" % (path, name))
+                    writer.writerows(reader)
+
+        if sort:
+            scan_utils.sort_csv(filename)
+
+
+# Copy every shard's cache into one.
+def merge_caches(cache_dirs, output_dir):
+    merged = {name: {} for name in MERGED_CACHE_FILES}
+    databases = {name: [] for name in FAST_CACHE_FILES}
+
+    for cache_dir in cache_dirs:
+        for root, dirs, files in os.walk(cache_dir):
+            relative = os.path.relpath(root, cache_dir)
+            for name in files:
+                source = os.path.join(root, name)
+                if relative == "." and name in merged:
+                    merged[name].update(json.loads(scan_utils.read(source)))
+                    continue
+                if relative == "." and name in databases:
+                    databases[name].append(source)
+                    continue
+                # SQLite's journal, left by a run that was cut short.
+                if relative == "." and name.rpartition("-")[0] in databases:
+                    continue
+
+                destination = os.path.normpath(os.path.join(output_dir, relative, name))
+                if os.path.exists(destination):
+                    if filecmp.cmp(source, destination, shallow=False):
+                        continue
+                    if os.path.getmtime(source) <= os.path.getmtime(destination):
+                        continue
+                scan_utils.mkdir_p(os.path.dirname(destination))
+                shutil.copy2(source, destination)
+
+    for name, contents in merged.items():
+        if contents:
+            scan_utils.write(scan_utils.json_for(contents), os.path.join(output_dir, name))
+    for name, sources in databases.items():
+        if sources:
+            merge_fast_caches(sources, os.path.join(output_dir, name))
+
+
+# Add every entry of the fast cache databases at `paths` to the one at
+# `output`. Mail servers can be shared by domains in different shards;
+# the first entry for each is kept, like PersistentFastCache does.
+def merge_fast_caches(paths, output):
+    connection = sqlite3.connect(output, timeout=fast_cache.LOCK_TIMEOUT)
+    try:
+        with connection:
+            connection.execute(fast_cache.SCHEMA)
+        for path in paths:
+            if os.path.abspath(path) == os.path.abspath(output):
+                continue
+            connection.execute("ATTACH DATABASE ? AS shard", (path,))
+            try:
+                with connection:
+                    connection.execute(
+                        "INSERT OR IGNORE INTO fast_cache (namespace, key, value, updated) "
+                        "SELECT namespace, key, value, updated FROM shard.fast_cache")
+            finally:
+                connection.execute("DETACH DATABASE shard")
+    finally:
+        connection.close()
+
+
+def timestamp(value):
+    return strict_rfc3339.rfc3339_to_timestamp(value) if value else None
+
+
+# The earliest start, latest end and time between them, of `entries`.
+def span_of(entries):
+    starts = [timestamp(entry.get('start_time')) for entry in entries]
+    ends = [timestamp(entry.get('end_time')) for entry in entries]
+    starts = [start for start in starts if start is not None]
+    ends = [end for end in ends if end is not None]
+    if not (starts and ends):
+        return {}
+    start, end = min(starts), max(ends)
+    return {
+        'start_time': scan_utils.utc_timestamp(start),
+        'end_time': scan_utils.utc_timestamp(end),
+        'duration': scan_utils.just_microseconds(end - start),
+    }
+
+
+def add_counts(entries, keys):
+    return {key: sum(entry.get(key) or 0 for entry in entries) for key in keys}
+
+
+def with_hit_rate(stats):
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = (stats['hits'] / lookups) if lookups else None
+    return stats
+
+
+# One scanner's entry in meta.json's durations, from every shard's.
+def merge_durations(name, entries):
+    merged = span_of(entries)
+    merged.update(add_counts(entries, ('retries',)))
+    merged['retry_delay'] = sum(entry.get('retry_delay') or 0 for entry in entries)
+
+    # The histograms add up exactly; the summaries alone wouldn't.
+    stats = phases.PhaseStats()
+    for entry in entries:
+        if 'phase_histograms' in entry:
+            stats.add_state(entry['phase_histograms'])
+        elif entry.get('phases'):
+            logging.warning("A shard's %s timings have no histograms, so they're left out." % name)
+    merged['phases'] = stats.summary()
+    merged['phase_histograms'] = stats.state()
+
+    in_flight = [entry['in_flight'] for entry in entries if 'in_flight' in entry]
+    if in_flight:
+        merged['in_flight'] = add_counts(in_flight, ('claimed', 'coalesced', 'timed_out'))
+
+    politeness = [entry['politeness'] for entry in entries if 'politeness' in entry]
+    if politeness:
+        merged['politeness'] = {
+            'limits': politeness[0]['limits'],
+            'postponed': sum(entry['postponed'] for entry in politeness),
+            'most_set_aside': max(entry['most_set_aside'] for entry in politeness),
+        }
+
+    # Each shard settles on its own concurrency.
+    concurrency = [entry['concurrency'] for entry in entries if 'concurrency' in entry]
+    if concurrency:
+        merged['concurrency'] = concurrency
+
+    return merged
+
+
+# meta.json for the whole scan, from each (shard directory, meta.json).
+def merge_meta(metas, command=None):
+    shards = [meta.get('shard') for shard_dir, meta in metas]
+    counts = {shard['count'] for shard in shards if shard}
+    if len(counts) > 1:
+        raise ValueError("The shards were split different ways: %s." % sorted(counts))
+    indexes = [shard['index'] for shard in shards if shard]
+    if len(indexes) != len(set(indexes)):
+        raise ValueError("Some shards were given more than once: %s." % sorted(indexes))
+    if counts and len(indexes) < min(counts):
+        logging.warning("Only %i of %i shards were merged." % (len(indexes), min(counts)))
+
+    durations = {}
+    for shard_dir, meta in metas:
+        for name, entry in meta.get('durations', {}).items():
+            durations.setdefault(name, []).append(entry)
+
+    metadata = span_of([meta for shard_dir, meta in metas])
+    metadata['durations'] = {name: merge_durations(name, entries) for name, entries in durations.items()}
+    metadata['command'] = command
+    metadata['scan_uuid'] = str(uuid.uuid4())
+    metadata['shards'] = [{
+        'output': shard_dir,
+        'shard': meta.get('shard'),
+        'scan_uuid': meta.get('scan_uuid'),
+        'command': meta.get('command'),
+        **span_of([meta]),
+    } for shard_dir, meta in metas]
+
+    preresolve = [meta['preresolve'] for shard_dir, meta in metas if 'preresolve' in meta]
+    if preresolve:
+        metadata['preresolve'] = {
+            **span_of(preresolve), **add_counts(preresolve, ('resolved', 'unresolved', 'unknown'))
+        }
+    dns_cache = [meta['dns_cache'] for shard_dir, meta in metas if meta.get('dns_cache')]
+    if dns_cache:
+        metadata['dns_cache'] = with_hit_rate(add_counts(dns_cache, ('hits', 'misses')))
+    psl_cache = [meta['psl_cache'] for shard_dir, meta in metas if meta.get('psl_cache')]
+    if psl_cache:
+        metadata['psl_cache'] = with_hit_rate({
+            **add_counts(psl_cache, ('hits', 'misses')),
+            'size': max(entry['size'] for entry in psl_cache),
+        })
+
+    return metadata
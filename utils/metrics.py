@@ -0,0 +1,312 @@
+import collections
+import http.server
+import logging
+import os
+import threading
+import time
+
+from utils import FAST_CACHE_KEY, IN_FLIGHT_KEY, psl, resolver
+
+###
+# Live metrics for long scans, in Prometheus' text format: served over
+# HTTP on localhost (--metrics-port), and/or rewritten every
+# --metrics-interval seconds to a file (--metrics-file), e.g. for
+# node_exporter's textfile collector, or just for `watch cat`.
+#
+# perform_scan() keeps each scanner's ScannerMetrics up to date as
+# domains start, finish and are put off to retry later. The DNS, PSL
+# and fast cache numbers are read from those caches when the metrics
+# are rendered.
+###
+
+# Seconds between rewrites of --metrics-file.
+default_interval = 15
+
+# Domains/sec is also given over this many of the last seconds.
+recent_window = 60
+
+# Errors that count as timeouts, by what they say.
+TIMEOUT_WORDS = ("timed out", "timeout")
+
+
+# Whether any of a domain's errors are about a timeout.
+def timed_out(errors):
+    return any(word in error.lower() for error in errors for word in TIMEOUT_WORDS)
+
+
+class ScannerMetrics(object):
+    """
+    Counts of one scanner's domains, by how far along they are, and of
+    how they turned out.
+    """
+
+    def __init__(self, name, environment=None, total=None):
+        self.name = name
+        self.environment = environment or {}
+        self.total = total
+        self.lock = threading.Lock()
+        self.start_time = None
+        self.end_time = None
+
+        self.started = 0
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.skipped = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.cache_hits = 0
+        self.retries = 0
+        self.lambda_retries = 0
+        # When recent domains finished, for the recent rate.
+        self.recent = collections.deque()
+
+    def begin(self, first_attempt=True):
+        with self.lock:
+            if self.start_time is None:
+                self.start_time = time.monotonic()
+            if first_attempt:
+                self.started += 1
+            else:
+                self.waiting -= 1
+            self.in_flight += 1
+
+    # The domain was put off, to retry later.
+    def defer(self):
+        with self.lock:
+            self.in_flight -= 1
+            self.waiting += 1
+            self.retries += 1
+
+    # The domain is done with, given its meta from perform_scan().
+    def end(self, meta, skipped=False):
+        errors = meta.get('errors', [])
+        now = time.monotonic()
+        with self.lock:
+            self.in_flight -= 1
+            self.completed += 1
+            self.skipped += int(skipped)
+            self.errors += int(bool(errors))
+            self.timeouts += int(timed_out(errors))
+            self.cache_hits += int('cache_read' in meta.get('phases', {}))
+            self.lambda_retries += meta.get('lambda', {}).get('retries', 0)
+            self.recent.append(now)
+            while self.recent and self.recent[0] < now - recent_window:
+                self.recent.popleft()
+
+    def finish(self):
+        with self.lock:
+            self.end_time = time.monotonic()
+
+    def snapshot(self):
+        with self.lock:
+            now = self.end_time or time.monotonic()
+            elapsed = (now - self.start_time) if self.start_time is not None else 0
+            while self.recent and self.recent[0] < now - recent_window:
+                self.recent.popleft()
+            window = min(elapsed, recent_window)
+            queued = None
+            if self.total is not None:
+                queued = self.total - self.started + self.waiting
+            return {
+                'started': self.started,
+                'in_flight': self.in_flight,
+                'queued': queued,
+                'waiting_to_retry': self.waiting,
+                'completed': self.completed,
+                'skipped': self.skipped,
+                'errors': self.errors,
+                'timeouts': self.timeouts,
+                'cache_hits': self.cache_hits,
+                'retries': self.retries,
+                'lambda_retries': self.lambda_retries,
+                'elapsed': elapsed,
+                'domains_per_second': (self.completed / elapsed) if elapsed else 0.0,
+                'recent_domains_per_second': (len(self.recent) / window) if window else 0.0,
+                'error_rate': (self.errors / self.completed) if self.completed else 0.0,
+                'timeout_rate': (self.timeouts / self.completed) if self.completed else 0.0,
+            }
+
+
+# (name, type, help, key in ScannerMetrics.snapshot())
+SCANNER_METRICS = [
+    ("domain_scan_started_total", "counter", "Domains whose scan has started.", 'started'),
+    ("domain_scan_in_flight", "gauge", "Domains being scanned right now.", 'in_flight'),
+    ("domain_scan_queued", "gauge", "Domains not yet started, or waiting to retry.", 'queued'),
+    ("domain_scan_waiting_to_retry", "gauge", "Domains put off to retry later.", 'waiting_to_retry'),
+    ("domain_scan_completed_total", "counter", "Domains done with, however they turned out.", 'completed'),
+    ("domain_scan_skipped_total", "counter", "Domains the scanner's init_domain() skipped.", 'skipped'),
+    ("domain_scan_errors_total", "counter", "Domains done with errors.", 'errors'),
+    ("domain_scan_timeouts_total", "counter", "Domains done with errors about timeouts.", 'timeouts'),
+    ("domain_scan_cache_hits_total", "counter", "Domains whose results came from the cache (--cache).", 'cache_hits'),
+    ("domain_scan_retries_total", "counter", "Times a domain was put off to retry later.", 'retries'),
+    ("domain_scan_lambda_retries_total", "counter", "Lambda invocations retried.", 'lambda_retries'),
+    ("domain_scan_elapsed_seconds", "gauge", "Seconds since the scanner started.", 'elapsed'),
+    ("domain_scan_domains_per_second", "gauge", "Domains done per second, since the scanner started.",
+     'domains_per_second'),
+    ("domain_scan_recent_domains_per_second", "gauge",
+     "Domains done per second, over the last %i seconds." % recent_window, 'recent_domains_per_second'),
+    ("domain_scan_error_rate", "gauge", "Fraction of domains done with errors.", 'error_rate'),
+    ("domain_scan_timeout_rate", "gauge", "Fraction of domains done with timeouts.", 'timeout_rate'),
+]
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+class Registry(object):
+    """Every scanner's ScannerMetrics, and the shared caches' numbers."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.scanners = collections.OrderedDict()
+
+    def scanner(self, name, environment=None, total=None):
+        with self.lock:
+            self.scanners[name] = ScannerMetrics(name, environment, total)
+            return self.scanners[name]
+
+    def render(self):
+        lines = []
+
+        def family(name, kind, help, samples):
+            samples = [(labels, value) for labels, value in samples if value is not None]
+            if not samples:
+                return
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for labels, value in samples:
+                label_text = ",".join('%s="%s"' % (key, escape(value)) for key, value in labels.items())
+                lines.append("%s%s %s" % (name, "{%s}" % label_text if label_text else "", format_value(value)))
+
+        with self.lock:
+            scanners = list(self.scanners.values())
+        snapshots = [(scanner, scanner.snapshot()) for scanner in scanners]
+
+        for name, kind, help, key in SCANNER_METRICS:
+            family(name, kind, help, [({'scanner': scanner.name}, snapshot[key]) for scanner, snapshot in snapshots])
+
+        # Each scanner's fast cache, shared between its domains.
+        fast_cache_sizes, in_flight_stats = [], []
+        for scanner in scanners:
+            if FAST_CACHE_KEY in scanner.environment:
+                fast_cache_sizes.append(({'scanner': scanner.name}, len(scanner.environment[FAST_CACHE_KEY])))
+            if IN_FLIGHT_KEY in scanner.environment:
+                in_flight_stats.append((scanner.name, scanner.environment[IN_FLIGHT_KEY].stats()))
+        family("domain_scan_fast_cache_entries", "gauge", "Entries in the scanner's fast cache.", fast_cache_sizes)
+        for key, help in (('claimed', "Fast cache entries a domain claimed to fill in."),
+                          ('coalesced', "Times a domain waited for another's fast cache entry instead of scanning."),
+                          ('timed_out', "Times a domain gave up waiting for another's fast cache entry.")):
+            family("domain_scan_fast_cache_%s_total" % key, "counter", help,
+                   [({'scanner': name}, stats[key]) for name, stats in in_flight_stats])
+
+        # The caches every scanner shares.
+        for cache, stats in (('dns', resolver.stats()), ('psl', psl.stats())):
+            if stats is None:
+                continue
+            family("domain_scan_%s_cache_hits_total" % cache, "counter",
+                   "Lookups answered from the %s cache." % cache.upper(), [({}, stats['hits'])])
+            family("domain_scan_%s_cache_misses_total" % cache, "counter",
+                   "Lookups the %s cache couldn't answer." % cache.upper(), [({}, stats['misses'])])
+            family("domain_scan_%s_cache_hit_rate" % cache, "gauge",
+                   "Fraction of lookups answered from the %s cache." % cache.upper(), [({}, stats['hit_rate'])])
+
+        return "\n".join(lines) + "\n"
+
+    # Replace `path` with the metrics, all at once, so that readers
+    # never see half a file.
+    def write(self, path):
+        temporary = "%s.tmp" % path
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(temporary, path)
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Server(http.server.ThreadingHTTPServer):
+    """Serves a Registry's metrics on localhost, at /metrics."""
+
+    daemon_threads = True
+
+    def __init__(self, registry, port, address="127.0.0.1"):
+        self.registry = registry
+        super().__init__((address, port), Handler)
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FileWriter(object):
+    """Rewrites a Registry's metrics to `path` every `interval` seconds."""
+
+    def __init__(self, registry, path, interval=default_interval):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                self.registry.write(self.path)
+            except OSError as err:
+                logging.warning("Couldn't write metrics to %s: %s" % (self.path, err))
+
+    # Stop, leaving the final numbers in the file.
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+        self.registry.write(self.path)
+
+
+# Start whichever of the HTTP server and file writer the options ask
+# for. Returns them, to stop() when the scan is done.
+def start_exporters(registry, options):
+    exporters = []
+    if options.get("metrics_port") is not None:
+        server = Server(registry, int(options["metrics_port"])).start()
+        logging.warning("Serving metrics at http://%s:%i/metrics" % server.server_address[:2])
+        exporters.append(server)
+    if options.get("metrics_file"):
+        interval = float(options.get("metrics_interval") or default_interval)
+        exporters.append(FileWriter(registry, options["metrics_file"], interval).start())
+    return exporters
+
+
+def stop_exporters(exporters):
+    for exporter in exporters:
+        exporter.stop()
@@ -0,0 +1,174 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from utils import trace
+
+###
+# Where each domain's time goes in scan's perform_scan(), phase by
+# phase, and per-scanner latency histograms of the same.
+###
+
+# The phases of perform_scan(), in order. A domain's time in each is
+# added up across its retries.
+PHASES = (
+    "init_domain",  # copying the environment and the scanner's init_domain()
+    "cache_read",   # reading and parsing a cached result, with --cache
+    "scan",         # the scan itself, local or Lambda
+    "post_scan",    # the scanner's post_scan()
+    "cache_write",  # writing the result to the cache
+    "to_rows",      # the scanner's to_rows()
+    "lock_wait",    # waiting for the lock on the scanner's CSV
+    "write",        # writing the rows
+)
+
+# Phases that are over by the time a domain's row is written, and so
+# can be added to it as --meta-phases columns.
+ROW_PHASES = PHASES[:-1]
+
+# Everything perform_scan() spent on a domain, retry delays aside.
+TOTAL = "total"
+
+# Histogram buckets are this much wider than the one before, so
+# percentiles are accurate to within about 5%.
+bucket_ratio = 1.05
+
+# The upper bound of the first bucket, in seconds.
+bucket_start = 1e-6
+
+
+def header_for(phase):
+    # e.g. "init_domain" -> "Local Init Domain Duration"
+    return "Local %s Duration" % phase.replace("_", " ").title()
+
+
+PHASE_HEADERS = [header_for(phase) for phase in ROW_PHASES]
+
+
+def add(phases, phase, seconds):
+    phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+# Add the time spent in the body of the `with` to phases[phase], and
+# trace it (with --trace).
+@contextmanager
+def timed(phases, phase):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        add(phases, phase, end - start)
+        trace.record(phase, start, end)
+
+
+class Histogram(object):
+    """
+    A thread-safe histogram of durations, in log-spaced buckets, so
+    that it stays small however many domains are scanned. The count,
+    total and maximum are exact; percentiles are the upper bound of
+    the bucket they fall in (or the maximum, if that's smaller).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @staticmethod
+    def bucket_for(seconds):
+        if seconds <= bucket_start:
+            return 0
+        return int(math.ceil(math.log(seconds / bucket_start, bucket_ratio)))
+
+    @staticmethod
+    def upper_bound(bucket):
+        return bucket_start * (bucket_ratio ** bucket)
+
+    def add(self, seconds):
+        bucket = self.bucket_for(seconds)
+        with self.lock:
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, fraction):
+        with self.lock:
+            if not self.count:
+                return None
+            rank = max(1, int(math.ceil(fraction * self.count)))
+            seen = 0
+            for bucket in sorted(self.buckets):
+                seen += self.buckets[bucket]
+                if seen >= rank:
+                    return min(self.upper_bound(bucket), self.max)
+            return self.max
+
+    # Everything needed to rebuild the histogram, e.g. to merge it with
+    # another shard's (see utils/merge.py).
+    def state(self):
+        with self.lock:
+            return {
+                'count': self.count,
+                'total': self.total,
+                'max': self.max,
+                'buckets': {str(bucket): count for bucket, count in sorted(self.buckets.items())},
+            }
+
+    # Add in another histogram's state().
+    def add_state(self, state):
+        with self.lock:
+            for bucket, count in state['buckets'].items():
+                self.buckets[int(bucket)] = self.buckets.get(int(bucket), 0) + count
+            self.count += state['count']
+            self.total += state['total']
+            self.max = max(self.max, state['max'])
+
+    def summary(self):
+        if not self.count:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'total': round(self.total, 6),
+            'mean': round(self.total / self.count, 6),
+            'p50': round(self.percentile(0.5), 6),
+            'p90': round(self.percentile(0.9), 6),
+            'p99': round(self.percentile(0.99), 6),
+            'max': round(self.max, 6),
+        }
+
+
+class PhaseStats(object):
+    """A scanner's Histogram for each phase, and for the total."""
+
+    def __init__(self):
+        self.histograms = {phase: Histogram() for phase in PHASES + (TOTAL,)}
+
+    # Add one domain's phases, as timed() left them. Phases the domain
+    # never got to aren't counted.
+    def record(self, phases):
+        for phase, seconds in phases.items():
+            self.histograms[phase].add(seconds)
+
+    def state(self):
+        return {
+            phase: histogram.state()
+            for phase, histogram in self.histograms.items()
+            if histogram.count
+        }
+
+    def add_state(self, state):
+        for phase, histogram_state in state.items():
+            self.histograms[phase].add_state(histogram_state)
+
+    def summary(self):
+        return {
+            phase: histogram.summary()
+            for phase, histogram in self.histograms.items()
+            if histogram.count
+        }
@@ -0,0 +1,136 @@
+import asyncio
+import logging
+
+import dns.asyncresolver
+import dns.exception
+import dns.rdatatype
+import dns.resolver
+
+from utils import resolver
+
+###
+# Resolve every input domain up front (--preresolve).
+#
+# Lots of gathered hostnames no longer exist, and each scanner would
+# otherwise wait out its own timeout to find that out. Before any
+# scanner runs, this looks up A and AAAA records for each domain and its
+# www subdomain, and MX records for the domain, many at a time. The
+# answers land in the shared DNS cache, so scanners that resolve names
+# themselves get them straight away, and the results are handed to
+# scanners (as environment['dns']) so they can skip domains that don't
+# resolve at all.
+###
+
+# Queries in flight at once.
+default_concurrency = 500
+
+# Seconds to spend on each query, retries included.
+default_timeout = 5
+
+ADDRESS_TYPES = (dns.rdatatype.A, dns.rdatatype.AAAA)
+
+
+def async_resolver(timeout):
+    # Same nameservers as the shared resolver, and the same cache.
+    system = resolver.default_resolver()
+    res = dns.asyncresolver.Resolver(configure=False)
+    res.nameservers = system.nameservers
+    res.port = system.port
+    res.cache = resolver.cache
+    res.lifetime = float(timeout)
+    return res
+
+
+# Records of one type for a name, as text. An empty list means the name
+# has none (or doesn't exist), None means we couldn't find out.
+async def query(res, name, rdtype, semaphore):
+    # Names in the hosts file are up to the system resolver.
+    if resolver.in_hosts_file(name):
+        return None
+
+    async with semaphore:
+        try:
+            answer = await res.resolve(name, rdtype, raise_on_no_answer=False)
+        except dns.resolver.NXDOMAIN:
+            return []
+        except dns.exception.DNSException as err:
+            logging.debug("\tPre-resolving %s %s failed: %s" % (name, dns.rdatatype.to_text(rdtype), err))
+            return None
+
+    if answer.rrset is None:
+        return []
+    if rdtype == dns.rdatatype.MX:
+        return sorted(
+            rdata.exchange.to_text().rstrip(".").lower()
+            for rdata in answer.rrset
+        )
+    return [rdata.address for rdata in answer.rrset]
+
+
+async def resolve_domain(res, domain, semaphore):
+    hosts = [domain, "www.%s" % domain]
+    lookups = [
+        query(res, host, rdtype, semaphore)
+        for host in hosts for rdtype in ADDRESS_TYPES
+    ]
+    lookups.append(query(res, domain, dns.rdatatype.MX, semaphore))
+    results = await asyncio.gather(*lookups)
+
+    addresses = {}
+    for i, host in enumerate(hosts):
+        v4, v6 = results[2 * i], results[2 * i + 1]
+        # Leave out hosts we couldn't look up, rather than saying they
+        # have no addresses.
+        if v4 is not None and v6 is not None:
+            addresses[host] = v4 + v6
+
+    return {'addresses': addresses, 'mx': results[-1]}
+
+
+async def resolve_domains(domains, concurrency, timeout):
+    res = async_resolver(timeout)
+    semaphore = asyncio.Semaphore(concurrency)
+    # Domains are handed to `concurrency` workers through a short queue,
+    # so only a few of a long list are being worked on at once. Each is
+    # given a place in `results` (keeping the input order, and skipping
+    # repeats) as it's queued.
+    pending = asyncio.Queue(maxsize=concurrency)
+    results = {}
+
+    async def feed():
+        for domain in domains:
+            if domain not in results:
+                results[domain] = None
+                await pending.put(domain)
+        for i in range(concurrency):
+            await pending.put(None)
+
+    async def work():
+        while True:
+            domain = await pending.get()
+            if domain is None:
+                return
+            results[domain] = await resolve_domain(res, domain, semaphore)
+
+    await asyncio.gather(feed(), *[work() for i in range(concurrency)])
+    return results
+
+
+# Pre-resolve the given domains, returning a dict of domain to
+# {'addresses': {hostname: [address, ...]}, 'mx': [hostname, ...]}.
+def resolve_all(domains, concurrency=default_concurrency, timeout=default_timeout):
+    return asyncio.run(resolve_domains(domains, concurrency, timeout))
+
+
+# How many domains resolved, didn't, or couldn't be checked.
+def summarize(results):
+    summary = {'resolved': 0, 'unresolved': 0, 'unknown': 0}
+    for domain, entry in results.items():
+        hosts = [domain, "www.%s" % domain]
+        if any(entry['addresses'].get(host) for host in hosts):
+            summary['resolved'] += 1
+        elif all(host in entry['addresses'] for host in hosts):
+            summary['unresolved'] += 1
+        else:
+            summary['unknown'] += 1
+    return summary
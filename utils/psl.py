@@ -0,0 +1,174 @@
+import codecs
+import functools
+import logging
+import os
+import threading
+
+from publicsuffixlist import encode_idn
+from publicsuffixlist.update import updatePSL
+
+###
+# Base domains from the Public Suffix List, shared by the whole process.
+#
+# The PSL is loaded once, under a lock, into a trie keyed on labels in
+# reverse order (so "gov", then "ca.gov", ...), and each lookup walks it
+# from the top-level domain down. Results are kept in a bounded LRU
+# cache, since the same hostnames come up again and again (every row of
+# every scanner for a domain, for instance).
+#
+# The rules are applied exactly as publicsuffixlist does, so this gives
+# the same answers as PublicSuffixList.get_public_suffix() from
+# publicsuffixlist.compat, which this replaces.
+###
+
+PSL_FILENAME = "public-suffix-list.txt"
+
+# Base domains remembered at once.
+default_maxsize = 65536
+
+# Flags for what rules a trie node ends.
+EXACT = 1
+WILDCARD = 2
+EXCEPTION = 4
+
+lock = threading.Lock()
+suffix_list = None
+
+
+class SuffixList(object):
+    """
+    The rules of a Public Suffix List, compiled into a trie.
+
+    Each node is a [flags, children] pair, children being a dict of
+    label to node. A rule like "*.ck" sets WILDCARD on the node for
+    "ck" (and EXACT on its "*" child, as that's also a literal name in
+    the list); "!www.ck" sets EXCEPTION on the node for "www.ck".
+    """
+
+    def __init__(self, lines, maxsize=default_maxsize):
+        self.root = [0, {}]
+        for line in lines:
+            rule = line.lower().split(" ")[0].rstrip()
+            if rule == "" or rule.startswith("//"):
+                continue
+            self.add(rule)
+            # Also match the punycoded form of internationalized rules.
+            encoded = encode_idn(rule.lstrip("!"))
+            self.add(("!" + encoded) if rule.startswith("!") else encoded)
+
+        self.base_domain_for = functools.lru_cache(maxsize=maxsize)(self.find_base_domain)
+
+    def add(self, rule):
+        flag = EXACT
+        if rule.startswith("!"):
+            flag = EXCEPTION
+            rule = rule[1:]
+
+        labels = rule.split(".")
+        node = self.root
+        for label in reversed(labels):
+            node = node[1].setdefault(label, [0, {}])
+        node[0] |= flag
+
+        if labels[0] == "*":
+            parent = self.root
+            for label in reversed(labels[1:]):
+                parent = parent[1].setdefault(label, [0, {}])
+            parent[0] |= WILDCARD
+
+    # How many labels at the end of the hostname are a public suffix.
+    # With more than one rule matching, the longest match wins, and
+    # for the same length: exception, then wildcard, then exact.
+    def public_length(self, labels):
+        count = len(labels)
+        public = 1  # Unknown TLDs are public suffixes too.
+        node = self.root
+        for depth in range(1, count + 1):
+            node = node[1].get(labels[count - depth])
+            if node is None:
+                break
+            flags = node[0]
+            if flags & EXCEPTION:
+                public = depth - 1
+            elif flags & WILDCARD:
+                public = (depth + 1) if depth < count else depth
+            elif flags & EXACT:
+                public = depth
+        return public
+
+    # For "x.y.domain.gov", return "domain.gov". Returns "" for public
+    # suffixes themselves, and for names that aren't valid.
+    def find_base_domain(self, hostname):
+        if hostname.endswith("."):
+            hostname = hostname[:-1]
+        labels = hostname.lower().split(".")
+        if "" in labels or len(labels) < 2:
+            return ""
+
+        public = self.public_length(labels)
+        if len(labels) < public + 1:
+            return ""
+        return ".".join(labels[-(public + 1):])
+
+    def stats(self):
+        info = self.base_domain_for.cache_info()
+        lookups = info.hits + info.misses
+        return {
+            'hits': info.hits,
+            'misses': info.misses,
+            'size': info.currsize,
+            'hit_rate': (info.hits / lookups) if lookups else None
+        }
+
+
+# Load the PSL from the cache directory (downloading it first if it's
+# not there), once per process. Returns None if it can't be had.
+def load(cache_dir="./cache"):
+    global suffix_list
+
+    if suffix_list is not None:
+        return suffix_list
+
+    with lock:
+        if suffix_list is None:
+            suffix_list = load_from_cache(cache_dir)
+    return suffix_list
+
+
+def load_from_cache(cache_dir="./cache"):
+    cached_psl = os.path.join(cache_dir, PSL_FILENAME)
+
+    # make sure the cache directory is present
+    os.makedirs(os.path.dirname(cached_psl) or ".", exist_ok=True)
+
+    # File does not exist, download current list and cache it at given location.
+    if not os.path.exists(cached_psl):
+        logging.debug("Downloading the Public Suffix List...")
+        try:
+            updatePSL(cached_psl)
+        except Exception as err:
+            logging.warning("Unable to download the Public Suffix List...")
+            logging.debug("{}".format(err))
+            return None
+
+    logging.debug("Using cached Public Suffix List...")
+    with codecs.open(cached_psl, encoding='utf-8') as psl_file:
+        return SuffixList(psl_file)
+
+
+# Return base domain for a subdomain, factoring in the Public Suffix List.
+def base_domain_for(subdomain, cache_dir="./cache"):
+    psl = load(cache_dir)
+
+    if psl is None:
+        logging.warning("Error downloading the PSL.")
+        exit(1)
+
+    return psl.base_domain_for(subdomain)
+
+
+# How well the cache of base domains is doing, if the PSL is loaded.
+def stats():
+    if suffix_list is None:
+        return None
+    return suffix_list.stats()
@@ -0,0 +1,222 @@
+import ipaddress
+import logging
+import socket
+import threading
+
+import dns.exception
+import dns.rdatatype
+import dns.resolver
+
+###
+# One DNS cache shared by every scanner in the process.
+#
+# The cache is dnspython's own, which is thread-safe, keeps answers for
+# as long as their TTLs say, and also caches negative answers (NXDOMAIN
+# and NoAnswer). Scanners that talk to dnspython directly get a
+# resolver that uses it from resolver(). Everything that goes through
+# socket.getaddrinfo (sslyze, pshtt, requests...) uses it too once
+# install() has been called, which ./scan does unless --no-dns-cache
+# is given.
+#
+# getaddrinfo() puts IPv6 addresses first if this host can reach IPv6
+# destinations, and IPv4 first if it can't, as RFC 6724's default
+# policy (and so the system resolver) mostly would. It doesn't apply
+# the rest of RFC 6724's rules (like longest matching prefix): within
+# each family, addresses are in the order the DNS gave them.
+###
+
+cache = dns.resolver.Cache()
+
+# Hostnames in the hosts file are left to the system resolver.
+HOSTS_FILE = "/etc/hosts"
+
+# The real socket.getaddrinfo, while install() has replaced it.
+system_getaddrinfo = socket.getaddrinfo
+
+# An IPv6 address to see if there's a route to (2001:db8::/32 is only
+# used in documentation, so nothing is ever sent to it).
+IPV6_PROBE = "2001:db8::1"
+
+lock = threading.Lock()
+installed = False
+hosts_file_names = None
+system_resolver = None
+ipv6_usable = None
+
+
+class Resolver(dns.resolver.Resolver):
+    """
+    A dnspython Resolver that uses the shared cache.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache = cache
+
+
+# A resolver using the shared cache, with the given nameservers (or the
+# system's) and timeouts in seconds.
+def resolver(nameservers=None, timeout=None, lifetime=None):
+    res = Resolver(configure=not nameservers)
+    if nameservers:
+        res.nameservers = list(nameservers)
+    if timeout is not None:
+        res.timeout = float(timeout)
+    if lifetime is not None:
+        res.lifetime = float(lifetime)
+    return res
+
+
+def stats():
+    hits = cache.hits()
+    misses = cache.misses()
+    lookups = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': (hits / lookups) if lookups else None
+    }
+
+
+def is_ip_address(host):
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+def load_hosts_file_names(path=HOSTS_FILE):
+    names = set()
+    try:
+        with open(path) as hosts:
+            for line in hosts:
+                fields = line.split("#", 1)[0].split()
+                names.update(name.lower() for name in fields[1:])
+    except OSError:
+        pass
+    return names
+
+
+def in_hosts_file(host):
+    global hosts_file_names
+
+    with lock:
+        if hosts_file_names is None:
+            hosts_file_names = load_hosts_file_names()
+    return host.rstrip(".").lower() in hosts_file_names
+
+
+# A resolver using the shared cache and the system's nameservers,
+# reading the system configuration only once.
+def default_resolver():
+    global system_resolver
+
+    with lock:
+        if system_resolver is None:
+            system_resolver = resolver()
+        return system_resolver
+
+
+# Whether this host has an IPv6 address it could reach global IPv6
+# destinations from. Connecting a UDP socket sends nothing; it only
+# picks a route and a source address.
+def can_reach_ipv6():
+    try:
+        with socket.socket(socket.AF_INET6, socket.SOCK_DGRAM) as sock:
+            sock.connect((IPV6_PROBE, 53))
+            source = sock.getsockname()[0]
+        return ipaddress.ip_address(source.split("%", 1)[0]).is_global
+    except (OSError, ValueError):
+        return False
+
+
+# Whether to put IPv6 addresses before IPv4 ones, checked only once.
+def prefers_ipv6():
+    global ipv6_usable
+
+    with lock:
+        if ipv6_usable is None:
+            ipv6_usable = can_reach_ipv6()
+        return ipv6_usable
+
+
+# Addresses for a hostname, A records before AAAA, from the shared cache
+# where possible. Raises dns.resolver.NXDOMAIN if the name doesn't exist.
+def addresses_for(host, family=socket.AF_UNSPEC):
+    rdtypes = []
+    if family in (socket.AF_UNSPEC, socket.AF_INET):
+        rdtypes.append(dns.rdatatype.A)
+    if family in (socket.AF_UNSPEC, socket.AF_INET6):
+        rdtypes.append(dns.rdatatype.AAAA)
+
+    res = default_resolver()
+    addresses = []
+    for rdtype in rdtypes:
+        answer = res.resolve(host, rdtype, raise_on_no_answer=False, search=True)
+        if answer.rrset is not None:
+            addresses.extend(rdata.address for rdata in answer.rrset)
+    return addresses
+
+
+# A drop-in replacement for socket.getaddrinfo that looks names up
+# through the shared cache. IP addresses and names in the hosts file go
+# to the system resolver as usual, as does everything if dnspython
+# can't be set up (say, there's no resolv.conf). DNS failures are
+# raised like the system resolver would: asking it too would only wait
+# out the same timeouts again.
+def getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    if isinstance(host, bytes):
+        host = host.decode("idna")
+    if (not host) or (flags & socket.AI_NUMERICHOST) or is_ip_address(host) \
+            or in_hosts_file(host) \
+            or family not in (socket.AF_UNSPEC, socket.AF_INET, socket.AF_INET6):
+        return system_getaddrinfo(host, port, family, type, proto, flags)
+
+    try:
+        addresses = addresses_for(host, family)
+    except dns.resolver.NoResolverConfiguration as err:
+        logging.debug("Can't look up %s with dnspython (%s), asking the system resolver." % (host, err))
+        return system_getaddrinfo(host, port, family, type, proto, flags)
+    except (dns.resolver.NXDOMAIN, dns.exception.SyntaxError):
+        raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+    except dns.exception.DNSException as err:
+        logging.debug("DNS lookup of %s failed: %s" % (host, err))
+        raise socket.gaierror(socket.EAI_AGAIN, "Temporary failure in name resolution")
+
+    if not addresses:
+        raise socket.gaierror(socket.EAI_NODATA, "No address associated with hostname")
+
+    ipv6_first = prefers_ipv6()
+    addresses.sort(key=lambda address: (":" in address) != ipv6_first)
+
+    results = []
+    for address in addresses:
+        results.extend(system_getaddrinfo(address, port, family, type, proto, flags | socket.AI_NUMERICHOST))
+    return results
+
+
+# Route socket.getaddrinfo (and so most Python network libraries)
+# through the shared cache. Safe to call more than once.
+def install():
+    global installed
+
+    with lock:
+        if not installed:
+            socket.getaddrinfo = getaddrinfo
+            installed = True
+
+
+def uninstall():
+    global installed
+
+    with lock:
+        socket.getaddrinfo = system_getaddrinfo
+        installed = False
+
+
+# Like socket.gethostbyname, but through the shared cache.
+def gethostbyname(host):
+    if is_ip_address(host):
+        return host
+    return getaddrinfo(host, None, socket.AF_INET, socket.SOCK_STREAM)[0][4][0]
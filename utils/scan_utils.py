@@ -1,8 +1,8 @@
 import argparse
-import codecs
 import csv
 import datetime
 import errno
+import hashlib
 import importlib
 import json
 import logging
@@ -17,6 +17,7 @@ from typing import (
     Any,
     Iterable,
     List,
+    Optional,
     Tuple,
     Union,
     cast,
@@ -24,18 +25,16 @@ from typing import (
 from types import ModuleType
 from urllib.error import URLError
 
-from publicsuffixlist.compat import PublicSuffixList
-from publicsuffixlist.update import updatePSL
 import requests
 import strict_rfc3339
 
+from utils import phases, psl
+
 
 MANDATORY_SCANNER_PROPERTIES = (
     "headers",
     "to_rows"
 )
-# global in-memory cache
-suffix_list = None
 
 
 # Time Conveniences #
@@ -106,6 +105,23 @@ def write(content: Union[bytes, str], destination: str,
 
 
 # Error Conveniences #
+class DeferredRetry(Exception):
+    """
+    Raised by a scanner that wants a domain scanned again later.
+
+    Rather than sleeping, the worker moves on to other domains; the
+    next attempt runs no sooner than `delay` seconds from now. `state`
+    is handed back to the scanner in that attempt's environment, as
+    "retry_state", so it can pick up where it left off.
+    """
+
+    def __init__(self, delay, reason="", state=None):
+        super().__init__(reason)
+        self.delay = delay
+        self.reason = reason
+        self.state = state
+
+
 def format_last_exception():
     exc_type, exc_value, exc_traceback = sys.exc_info()
     return "\n".join(traceback.format_exception(exc_type, exc_value,
@@ -242,6 +258,13 @@ def write_rows(rows, domain, base_domain, scanner, csv_writer, meta={}):
         meta_fields.append(utc_timestamp(meta.get("start_time")))
         meta_fields.append(utc_timestamp(meta.get("end_time")))
         meta_fields.append(just_microseconds(meta.get("duration")))
+        meta_fields.append(meta.get("retries", 0))
+        meta_fields.append(meta.get("retry_delay", 0))
+
+        # With --meta-phases, the time spent in each phase.
+        if meta.get("phases") is not None:
+            for phase in phases.ROW_PHASES:
+                meta_fields.append(just_microseconds(meta['phases'].get(phase)))
 
         if meta.get("lambda") is not None:
             meta_fields.append(meta['lambda'].get('request_id'))
@@ -292,47 +315,56 @@ def invalid(data=None):
 
 # Return base domain for a subdomain, factoring in the Public Suffix List.
 def base_domain_for(subdomain, cache_dir="./cache"):
-    global suffix_list
-
     """
     For "x.y.domain.gov", return "domain.gov".
 
-    If suffix_list is None, the caches have not been initialized, so do that.
+    The PSL is loaded (once per process) the first time it's needed, if
+    it wasn't already; see utils/psl.py.
     """
-    if suffix_list is None:
-        suffix_list = load_suffix_list(cache_dir=cache_dir)
-
-    if suffix_list is None:
-        logging.warning("Error downloading the PSL.")
-        exit(1)
-
-    return suffix_list.get_public_suffix(subdomain)
-
+    return psl.base_domain_for(subdomain, cache_dir=cache_dir)
+# /Cache Handling #
 
-# Returns an instantiated PublicSuffixList object.
-def load_suffix_list(cache_dir="./cache"):
 
-    cached_psl = cache_single("public-suffix-list.txt", cache_dir=cache_dir)
+# Sharding #
+def parse_shard(value: str) -> Tuple[int, int]:
+    """
+    Parse a --shard value like "2/5" into (2, 5): the second of five
+    shards. Shards are numbered from 1.
+    """
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("--shard should look like 2/5, not %s." % value)
+    if not (1 <= index <= count):
+        raise argparse.ArgumentTypeError("--shard %s isn't one of %i shards." % (value, count))
+    return (index, count)
 
-    # make sure the cache directory is present
-    mkdir_p(os.path.dirname(cached_psl))
 
-    # File does not exist, download current list and cache it at given location.
-    if not os.path.exists(cached_psl):
-        logging.debug("Downloading the Public Suffix List...")
-        try:
-            updatePSL(cached_psl)
-        except Exception as err:
-            logging.warning("Unable to download the Public Suffix List...")
-            logging.debug("{}".format(err))
-            return None
-    
-    logging.debug("Using cached Public Suffix List...")
-    with codecs.open(cached_psl, encoding='utf-8') as psl_file:
-        suffixes = PublicSuffixList(psl_file)
+def shard_for(domain: str, count: int, cache_dir="./cache") -> int:
+    """
+    Which of `count` shards (numbered from 1) a domain belongs to.
 
-    return suffixes
-# /Cache Handling #
+    Domains are partitioned by a hash of their base domain, so that the
+    same machine scans every subdomain of an organization (and
+    --max-per-base-domain still holds across shards), and every
+    machine agrees on where each domain goes.
+    """
+    base = base_domain_for(domain, cache_dir=cache_dir) or domain
+    digest = hashlib.sha1(base.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count + 1
+
+
+# Only the domains in this --shard, if there is one.
+def domains_in_shard(domains: Iterable[str], shard: Optional[Tuple[int, int]],
+                     cache_dir="./cache") -> Iterable[str]:
+    if shard is None:
+        yield from domains
+        return
+    index, count = shard
+    for domain in domains:
+        if shard_for(domain, count, cache_dir=cache_dir) == index:
+            yield domain
+# /Sharding #
 
 
 # Argument Parsing #
@@ -395,12 +427,93 @@ def build_scan_options_parser() -> ArgumentParser:
         "The maximum number of times to retry a Lambda job that fails.  ",
         "If not specified then the value 0 is used."
     ]))
+    parser.add_argument("--max-retries", type=int, help="".join([
+        "The maximum number of times a scanner may put off a domain to ",
+        "retry it later.  If not specified then the value 5 is used."
+    ]))
     parser.add_argument("--meta", action="store_true", help="".join([
         "Append some additional columns to each row with information about ",
         "the scan itself. This includes start/end times and durations, as ",
         "well as any encountered errors. When also using '--lambda', ",
         "additional, Lambda-specific information will be appended.",
     ]))
+    parser.add_argument("--meta-phases", action="store_true", help="".join([
+        "With '--meta', also append how long each phase of the scan took ",
+        "(init_domain, cache read, scan, post_scan, cache write, to_rows and ",
+        "waiting to write the row). Per-scanner histograms of the same are ",
+        "always saved in meta.json.",
+    ]))
+    parser.add_argument("--trace", help="".join([
+        "Write a span for every phase of every domain's scan (and any spans ",
+        "scanners add) to this file, in Chrome's trace event format, for ",
+        "opening in chrome://tracing or https://ui.perfetto.dev.",
+    ]))
+    parser.add_argument("--metrics-port", type=int, help="".join([
+        "Serve live metrics about the scan (domains done, in flight and ",
+        "queued, per scanner; domains/sec; error and timeout rates; cache ",
+        "hit rates) in Prometheus' text format at ",
+        "http://127.0.0.1:<port>/metrics while it runs.",
+    ]))
+    parser.add_argument("--metrics-file", help="".join([
+        "Rewrite the same live metrics to this file every ",
+        "'--metrics-interval' seconds while the scan runs, and once more ",
+        "when it's done.",
+    ]))
+    parser.add_argument("--metrics-interval", type=float, help="".join([
+        "How often to rewrite '--metrics-file', in seconds.  If not ",
+        "specified then the value 15 is used."
+    ]))
+    parser.add_argument("--adaptive-workers", action="store_true", help="".join([
+        "Adjust how many domains each scanner works on at once as the scan ",
+        "goes, from the throughput, latency, errors and timeouts it sees, ",
+        "starting from the usual number of workers. Each change is logged, ",
+        "and the number each scanner settled on is saved in meta.json.",
+    ]))
+    parser.add_argument("--min-workers", type=int, help="".join([
+        "With '--adaptive-workers', the fewest workers to use.  If not ",
+        "specified then the value 1 is used."
+    ]))
+    parser.add_argument("--max-workers", type=int, help="".join([
+        "With '--adaptive-workers', the most workers to use.  If not ",
+        "specified then four times the starting number is used."
+    ]))
+    parser.add_argument("--adaptive-interval", type=float, help="".join([
+        "With '--adaptive-workers', how many seconds of results to look at ",
+        "before each adjustment.  If not specified then the value 10 is used."
+    ]))
+    parser.add_argument("--max-per-base-domain", type=int, help="".join([
+        "Scan at most this many domains with the same base domain (e.g. ",
+        "x.agency.gov and y.agency.gov) at once, per scanner. Workers scan ",
+        "other domains meanwhile.",
+    ]))
+    parser.add_argument("--max-per-ip", type=int, help="".join([
+        "Scan at most this many domains whose web servers share an IP ",
+        "address at once, per scanner. Workers scan other domains ",
+        "meanwhile. Implies '--preresolve'.",
+    ]))
+    parser.add_argument("--shard", type=parse_shard, help="".join([
+        "Scan only one of several shards of the domains, e.g. '--shard 2/5' ",
+        "for the second of five, to spread a scan across machines. Domains ",
+        "are split by a hash of their base domain. Combine the shards' ",
+        "output with ./merge.",
+    ]))
+    parser.add_argument("--coordinator", help="".join([
+        "Rather than scanning, add every (scanner, domain) task to this work ",
+        "queue (a SQLite file, or sqlite:///path), wait for workers started ",
+        "with '--worker' to scan them all, and then write the results. ",
+        "Running it again with the same queue picks up where it left off.",
+    ]))
+    parser.add_argument("--worker", help="".join([
+        "Scan tasks leased from this work queue, made by '--coordinator', ",
+        "sending the rows back to it, until there are none left. Use the ",
+        "same scanners and options as the coordinator. Workers can be ",
+        "started (or stopped) at any time.",
+    ]))
+    parser.add_argument("--lease-time", type=float, help="".join([
+        "With '--worker', how many seconds a task stays leased to a worker ",
+        "that's stopped renewing it (say, because it died) before another ",
+        "worker may take it.  If not specified then the value 60 is used."
+    ]))
     parser.add_argument("--scan", nargs=1, required=True,
                         help="Comma-separated list of scanners (required).")
     parser.add_argument("--sort", action="store_true", help="".join([
@@ -429,6 +542,28 @@ def build_scan_options_parser() -> ArgumentParser:
         "will cause domain-scan to use less memory, but some (possibly ",
         "expensive) network activity or other operations may be repeated."
     ]))
+    parser.add_argument("--fast-cache-ttl", type=float, help="".join([
+        "Keep fast cache entries on disk (in the cache directory) and reuse ",
+        "them in later runs for this many seconds.  Only used by scanners ",
+        "that support it (trustymail and sslyze)."
+    ]))
+    parser.add_argument("--fast-cache-wait", type=float, help="".join([
+        "How many seconds to wait for another worker that is already ",
+        "scanning a shared mail server before scanning it anyway.  ",
+        "If not specified then the value 300 is used."
+    ]))
+    parser.add_argument("--no-dns-cache", action="store_true", help="".join([
+        "Do not share a DNS cache between scanners and domains.  Every ",
+        "lookup will go to the system resolver or the --dns servers."
+    ]))
+    parser.add_argument("--preresolve", action="store_true", help="".join([
+        "Look up every domain (and its www subdomain) before scanning, many ",
+        "at a time, so that scanners can skip domains that don't resolve."
+    ]))
+    parser.add_argument("--preresolve-concurrency", type=int, help="".join([
+        "How many DNS queries --preresolve may have in flight at once.  ",
+        "If not specified then the value 500 is used."
+    ]))
     # TODO: Move the scanner-specific argument parsing to each scanner's code.
 
     # a11y:
@@ -451,11 +586,17 @@ def build_scan_options_parser() -> ArgumentParser:
 
     # sslyze:
     parser.add_argument("--sslyze-serial",
-                        help="sslyze: If set, will use a synchronous (single-threaded in-process) scanner. Defaults to true.")
+                        help="sslyze: If set, will send each of a host's scan commands on its own, one after another, instead of as a single request. Defaults to false.")
     parser.add_argument("--sslyze-certs",
                         help="sslyze: If set, will use the CertificateInfoScanner and return certificate info. Defaults to true.")
     parser.add_argument("--sslyze-reneg",
                         help="sslyze: If set, will use the SessionRenegotiationScanner and return session renegotiation info. Defaults to true.")
+    parser.add_argument("--sslyze-connections-per-server", type=int,
+                        help="sslyze: Maximum number of concurrent connections to any one server. Defaults to 5.")
+    parser.add_argument("--sslyze-concurrent-servers", type=int,
+                        help="sslyze: Maximum number of servers scanned at the same time. Defaults to the number of workers.")
+    parser.add_argument("--sslyze-dedup", choices=["endpoint", "canonical"],
+                        help="sslyze: Scan each TLS endpoint once and share the result between domains, matching on resolved IP, port and SNI name (endpoint) or on hostname and port (canonical).")
     # trustymail:
     parser.add_argument("--starttls", action='store_true', help="".join([
         "trustymail: Only check mx records and STARTTLS support.  ",
@@ -597,18 +738,20 @@ def verify_scanner_properties(scanner: ModuleType) -> None:
         raise ImportError(errmsg)
 
 
-def begin_csv_writing(scanner: ModuleType, options: dict,
-                      base_hdrs: Tuple[List[str], List[str], List[str]]) -> dict:
+def scanner_handle(scanner: ModuleType, options: dict,
+                   base_hdrs: Tuple[List[str], List[str], List[str]],
+                   phase_hdrs: Optional[List[str]]=None) -> dict:
     """
-    Determine the CSV output file path for the scanner, open the file at that
-    path, instantiate a CSV writer for it, determine whether or not to use
-    lambda, determine what the headers are, write the headers to the CSV.
+    Determine the scanner's name, whether or not to use lambda, and what
+    the CSV headers are, without opening a CSV (as for --worker).
+
+    With --meta and --meta-phases, the phase_hdrs columns follow the local
+    ones.
 
     Return a dict containing the above.
     """
     PREFIX_HEADERS, LOCAL_HEADERS, LAMBDA_HEADERS = base_hdrs
     name = scanner.__name__.split(".")[-1]  # e.g. 'pshtt'
-    results_dir = options["_"]["results_dir"]
     meta = options.get("meta")
     lambda_mode = options.get("lambda")
     use_lambda = lambda_mode and \
@@ -620,25 +763,50 @@ def begin_csv_writing(scanner: ModuleType, options: dict,
     # Local scan timing/errors.
     if meta:
         headers += LOCAL_HEADERS
+    # Local time spent in each phase of the scan.
+    if meta and options.get("meta_phases") and phase_hdrs:
+        headers += phase_hdrs
     # Lambda scan timing/errors. (At this step, only partial fields.)
     if meta and use_lambda:
         headers += LAMBDA_HEADERS
 
+    return {
+        'name': name,
+        'headers': headers,
+        'use_lambda': use_lambda,
+    }
+
+
+def begin_csv_writing(scanner: ModuleType, options: dict,
+                      base_hdrs: Tuple[List[str], List[str], List[str]],
+                      phase_hdrs: Optional[List[str]]=None) -> dict:
+    """
+    Determine the CSV output file path for the scanner, open the file at that
+    path, instantiate a CSV writer for it, determine whether or not to use
+    lambda, determine what the headers are, write the headers to the CSV.
+
+    With --meta and --meta-phases, the phase_hdrs columns follow the local
+    ones.
+
+    Return a dict containing the above.
+    """
+    handle = scanner_handle(scanner, options, base_hdrs, phase_hdrs=phase_hdrs)
+    name = handle['name']
+    results_dir = options["_"]["results_dir"]
+
     scanner_csv_path = Path(results_dir, "%s.csv" % name).resolve()
     scanner_file = scanner_csv_path.open('w', newline='')
     scanner_writer = csv.writer(scanner_file)
 
     print("Opening csv file for scanner {}: {}".format(name, scanner_csv_path))
 
-    scanner_writer.writerow(headers)
+    scanner_writer.writerow(handle['headers'])
 
     return {
-        'name': name,
+        **handle,
         'file': scanner_file,
         'filename': str(scanner_csv_path),
         'writer': scanner_writer,
-        'headers': headers,
-        'use_lambda': use_lambda,
     }
 
 
@@ -0,0 +1,231 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+import traceback
+
+# Tasks a Scheduler will set aside, while they're over a limit, before
+# it waits for one to be allowed to run.
+default_lookahead = 1000
+
+# What the task each worker thread is running waited for; see queue_wait().
+local = threading.local()
+
+
+# How long the task the current worker thread is running waited to be
+# picked up, in seconds: since a worker asked for a new task, or since
+# a retried one came due.
+def queue_wait():
+    return getattr(local, 'queue_wait', 0.0)
+
+
+class Scheduler(object):
+    """
+    Run tasks on a fixed pool of worker threads, letting a task be put
+    back to run again no sooner than some number of seconds later.
+
+    `perform(task)` returns None once the task is finished, or a
+    (delay, task) tuple to have `task` run again after `delay` seconds.
+    Workers take any retries that are due first, then new tasks, and
+    only sit idle when everything left is waiting on a retry delay.
+
+    At most `limit` tasks run at once, out of the `workers` threads;
+    set_limit() changes it while the tasks are running.
+
+    To be polite to the servers being scanned, `keys(task)` can give
+    the (kind, value) pairs a task counts against, e.g. ("ip",
+    "192.0.2.1"), and `key_limits` how many tasks of each kind may run
+    at once per value. A task over a limit is set aside for later, and
+    workers get on with other tasks (up to `lookahead` of them set
+    aside) instead of waiting.
+
+    `tasks` may yield None when it has no task yet but isn't finished
+    (e.g. it's fed by a work queue); workers then ask again `poll`
+    seconds later. It's asked without the lock held, by one worker at a
+    time, so a slow one doesn't hold up workers with retries to run or
+    tasks to finish.
+    """
+
+    def __init__(self, perform, workers, limit=None, keys=None, key_limits=None,
+                 lookahead=default_lookahead, poll=1.0):
+        self.perform = perform
+        self.workers = workers
+        self.limit = workers if limit is None else max(1, min(limit, workers))
+        self.condition = threading.Condition()
+        # Heap of (not before, sequence, task).
+        self.deferred = []
+        self.sequence = itertools.count()
+        self.running = 0
+        self.tasks = None
+        self.tasks_error = None
+        # Whether a worker is asking `tasks` for one right now.
+        self.fetching = False
+        self.poll = poll
+        # When to next ask `tasks` for one, after it had none.
+        self.tasks_idle_until = 0.0
+
+        self.keys = keys
+        self.key_limits = key_limits or {}
+        self.lookahead = lookahead
+        # Tasks running per key.
+        self.active = {}
+        # (since, keys, task) for tasks set aside while over a limit,
+        # due retries first.
+        self.ready_retries = []
+        self.set_aside = []
+
+        # Totals across the whole run.
+        self.retries = 0
+        self.retry_delay = 0.0
+        # Times a task was set aside, and the most set aside at once.
+        self.postponed = 0
+        self.most_set_aside = 0
+
+    def run(self, tasks):
+        self.tasks = iter(tasks)
+        threads = [threading.Thread(target=self.work) for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self.tasks_error is not None:
+            raise self.tasks_error
+
+    def set_limit(self, limit):
+        with self.condition:
+            self.limit = max(1, min(limit, self.workers))
+            self.condition.notify_all()
+            return self.limit
+
+    def defer(self, delay, task):
+        with self.condition:
+            heapq.heappush(self.deferred, (time.monotonic() + delay, next(self.sequence), task))
+            self.retries += 1
+            self.retry_delay += delay
+            self.condition.notify_all()
+
+    def keys_for(self, task):
+        if self.keys is None:
+            return ()
+        return tuple(dict.fromkeys(key for key in self.keys(task) if key[0] in self.key_limits))
+
+    def allowed(self, keys):
+        return all(self.active.get(key, 0) < self.key_limits[key[0]] for key in keys)
+
+    # Take the first task in `entries` that's under its limits, if any.
+    def take_allowed(self, entries):
+        for i, (since, keys, task) in enumerate(entries):
+            if self.allowed(keys):
+                del entries[i]
+                return since, keys, task
+        return None
+
+    # Block until there's a task to run, or return None when there's
+    # nothing left to do. Returns the task and the keys it holds.
+    def next_task(self):
+        asked = time.monotonic()
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                if not (self.deferred or self.ready_retries or self.set_aside) \
+                        and self.tasks is None and self.running == 0:
+                    return None
+
+                # Threads beyond the limit wait for it to rise, or for
+                # the work to run out.
+                if self.running >= self.limit:
+                    self.condition.wait()
+                    continue
+
+                while self.deferred and self.deferred[0][0] <= now:
+                    due, sequence, task = heapq.heappop(self.deferred)
+                    self.ready_retries.append((due, self.keys_for(task), task))
+
+                entry = self.take_allowed(self.ready_retries) or self.take_allowed(self.set_aside)
+                if entry is not None:
+                    since, keys, task = entry
+                    return self.start(task, keys, now - since)
+
+                if self.tasks is not None and not self.fetching \
+                        and len(self.set_aside) < self.lookahead and now >= self.tasks_idle_until:
+                    task = self.fetch()
+                    now = time.monotonic()
+                    if task is None:
+                        if self.tasks is not None:
+                            self.tasks_idle_until = now + self.poll
+                        continue
+                    keys = self.keys_for(task)
+                    # Other workers may have reached the limit meanwhile.
+                    if self.running < self.limit and self.allowed(keys):
+                        return self.start(task, keys, now - asked)
+                    self.set_aside.append((now, keys, task))
+                    if not self.allowed(keys):
+                        self.postponed += 1
+                        self.most_set_aside = max(self.most_set_aside, len(self.set_aside))
+                    continue
+
+                # Wait for a retry to come due, or for a running task
+                # to finish (it may defer itself, or free up a limit).
+                wakes = [due for due, sequence, task in self.deferred[:1]]
+                if self.tasks is not None and now < self.tasks_idle_until:
+                    wakes.append(self.tasks_idle_until)
+                self.condition.wait((min(wakes) - now) if wakes else None)
+
+    # The next task from `tasks`, or None if it had none. Called with the
+    # lock held, which is let go while asking.
+    def fetch(self):
+        self.fetching = True
+        self.condition.release()
+        task, finished, error = None, False, None
+        try:
+            task = next(self.tasks)
+        except StopIteration:
+            finished = True
+        except Exception as err:
+            finished, error = True, err
+        finally:
+            self.condition.acquire()
+            self.fetching = False
+            self.condition.notify_all()
+
+        if finished:
+            self.tasks = None
+            self.tasks_error = error
+        return task
+
+    # Called with the lock held.
+    def start(self, task, keys, waited):
+        self.running += 1
+        for key in keys:
+            self.active[key] = self.active.get(key, 0) + 1
+        local.queue_wait = waited
+        return task, keys
+
+    def work(self):
+        while True:
+            entry = self.next_task()
+            if entry is None:
+                return
+            task, keys = entry
+
+            # Like a ThreadPoolExecutor, don't let anything a task
+            # raises (even SystemExit) take down the worker.
+            result = None
+            try:
+                result = self.perform(task)
+            except BaseException:
+                logging.warning(traceback.format_exc())
+
+            if result is not None:
+                delay, task = result
+                self.defer(delay, task)
+
+            with self.condition:
+                self.running -= 1
+                for key in keys:
+                    self.active[key] -= 1
+                    if not self.active[key]:
+                        del self.active[key]
+                self.condition.notify_all()
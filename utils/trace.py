@@ -0,0 +1,201 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+###
+# Spans for every phase of every domain's scan, written as they happen
+# to a file in Chrome's trace event format (--trace), for opening in
+# chrome://tracing or Perfetto (https://ui.perfetto.dev).
+#
+# scan wraps each (scanner, domain) task in task(), so that every span
+# recorded on that worker thread meanwhile is tagged with the scanner
+# and domain. Scanners can add spans of their own, which nest inside
+# the phase they happen in:
+#
+#   from utils import trace
+#
+#   with trace.span("certificate info", hostname=hostname):
+#       ...
+#
+# When tracing is off (including in Lambda), span() does nothing.
+#
+# The file is a JSON array of events, closed when scan finishes. If
+# scan is killed first the closing bracket is missing, which trace
+# viewers allow for.
+###
+
+# The Tracer for this process, while tracing is on.
+tracer = None
+
+# The scanner and domain each worker thread is working on.
+local = threading.local()
+
+
+class Tracer(object):
+    """
+    Writes trace events to `path` as they're added, from any thread.
+    Timestamps are microseconds since the Tracer was created.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, "w", encoding="utf-8")
+        self.file.write("[")
+        self.events = 0
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+        # Threads already given a name in the trace.
+        self.threads = set()
+
+    def timestamp(self, counter):
+        return round((counter - self.origin) * 1e6, 3)
+
+    def add(self, event):
+        thread = threading.current_thread()
+        tid = thread.native_id
+        event['pid'] = self.pid
+        event['tid'] = tid
+        lines = [json.dumps(event, default=str)]
+
+        with self.lock:
+            # Events from threads still running after close() are dropped.
+            if self.file.closed:
+                return
+            if tid not in self.threads:
+                self.threads.add(tid)
+                lines.insert(0, json.dumps({
+                    'name': "thread_name", 'ph': "M", 'pid': self.pid, 'tid': tid,
+                    'args': {'name': thread.name}
+                }))
+            for line in lines:
+                self.file.write(",\n" if self.events else "\n")
+                self.file.write(line)
+                self.events += 1
+
+    def complete(self, name, start, end, args=None):
+        self.add({
+            'name': name, 'cat': context().get('scanner', "scan"), 'ph': "X",
+            'ts': self.timestamp(start), 'dur': round((end - start) * 1e6, 3),
+            'args': {**context(), **(args or {})},
+        })
+
+    def instant(self, name, args=None):
+        self.add({
+            'name': name, 'cat': context().get('scanner', "scan"), 'ph': "i", 's': "t",
+            'ts': self.timestamp(time.perf_counter()),
+            'args': {**context(), **(args or {})},
+        })
+
+    def close(self):
+        with self.lock:
+            self.file.write("\n]\n")
+            self.file.close()
+
+
+class Span(object):
+    """
+    A span from start() (or entering it) to finish() (or leaving it),
+    recorded when it finishes.
+    """
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.started = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        return self
+
+    def finish(self, **args):
+        current = tracer
+        if self.started is not None and current is not None:
+            current.complete(self.name, self.started, time.perf_counter(), {**self.args, **args})
+        self.started = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.finish()
+
+
+class NullSpan(object):
+    """What span() returns while tracing is off."""
+
+    def start(self):
+        return self
+
+    def finish(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+null_span = NullSpan()
+
+
+def start(path):
+    global tracer
+    tracer = Tracer(path)
+    return tracer
+
+
+def stop():
+    global tracer
+    if tracer is not None:
+        tracer.close()
+        tracer = None
+
+
+def enabled():
+    return tracer is not None
+
+
+# What the current thread is working on, e.g. {'scanner': 'pshtt',
+# 'domain': 'example.gov'}, added to the args of every span it records.
+def context():
+    return getattr(local, 'context', {})
+
+
+# A span named `name`, to use as a context manager (or to start() and
+# finish() by hand).
+def span(name, **args):
+    if tracer is None:
+        return null_span
+    return Span(name, args)
+
+
+# Record a span that's already over, from perf_counter() start and end.
+def record(name, start, end, **args):
+    current = tracer
+    if current is not None:
+        current.complete(name, start, end, args)
+
+
+# Record a moment, e.g. a domain being put off to retry later.
+def instant(name, **args):
+    current = tracer
+    if current is not None:
+        current.instant(name, args)
+
+
+# Tag every span the current thread records meanwhile with `args` (the
+# scanner and domain, say), and record one span for the whole of it.
+@contextmanager
+def task(name, **args):
+    previous = context()
+    local.context = {**previous, **args}
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, started, time.perf_counter())
+        local.context = previous
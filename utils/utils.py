@@ -13,15 +13,12 @@ import csv
 import logging
 import datetime
 import strict_rfc3339
-import codecs
 from itertools import chain
 from urllib.error import URLError
 
-from publicsuffixlist.compat import PublicSuffixList
-from publicsuffixlist.update import updatePSL
+from utils import psl
 from utils.scan_utils import options as options_for_scan
-# global in-memory cache
-suffix_list = None
+from utils.scan_utils import DeferredRetry  # noqa: F401
 
 
 # /Time Conveniences #
@@ -173,16 +170,28 @@ def build_gather_options_parser(services):
                         help="Ignore the www. prefixes of hostnames.")
     parser.add_argument("--include-parents", action="store_true",
                         help="Include second-level domains.")
+    parser.add_argument("--incremental", action="store_true", help="".join([
+        "Only fetch certificates added since the last incremental run, ",
+        "and add them to the cached data (censys only)."
+    ]))
     parser.add_argument("--log", nargs=1)
     parser.add_argument("--parents", nargs=1, help="".join([
         "A path or URL to a CSV whose first column is second-level domains. ",
         "Any subdomain not contained within these second-level domains will ",
         "be excluded."
     ]))
+    parser.add_argument("--rdns-workers", nargs=1, help="".join([
+        "How many processes to read an uncompressed --rdns file with. ",
+        "Defaults to the number of CPUs (rdns only)."
+    ]))
     parser.add_argument("--sort", action="store_true", help="".join([
         "Sort result CSVs by domain name, alphabetically. (Note: this causes ",
         "the entire dataset to be read into memory.)",
     ]))
+    parser.add_argument("--dedup-batch", nargs=1, help="".join([
+        "How many hostnames to hold in memory while de-duplicating before ",
+        "spilling them to disk. Defaults to 1000000."
+    ]))
     parser.add_argument("--suffix", nargs=1, required=True, help="".join([
         "Comma-separated list of suffixes, e.g '.gov' ",
         "or '.fed.us' or '.gov,.gov.uk' (required)."
@@ -249,7 +258,9 @@ def options_for_gather():
     single values.
     """
     should_be_singles = [
+        "dedup_batch",
         "parents",
+        "rdns_workers",
         "suffix",
         "output",
     ]
@@ -491,46 +502,13 @@ def local_now():
 
 # Return base domain for a subdomain, factoring in the Public Suffix List.
 def base_domain_for(subdomain, cache_dir="./cache"):
-    global suffix_list
-
     """
     For "x.y.domain.gov", return "domain.gov".
 
-    If suffix_list is None, the caches have not been initialized, so do that.
+    The PSL is loaded (once per process) the first time it's needed, if
+    it wasn't already; see utils/psl.py.
     """
-    if suffix_list is None:
-        suffix_list = load_suffix_list(cache_dir=cache_dir)
-
-    if suffix_list is None:
-        logging.warning("Error downloading the PSL.")
-        exit(1)
-
-    return suffix_list.get_public_suffix(subdomain)
-
-
-# Returns an instantiated PublicSuffixList object.
-def load_suffix_list(cache_dir="./cache"):
-
-    cached_psl = cache_single("public-suffix-list.txt", cache_dir=cache_dir)
-
-    # make sure the cache directory is present
-    mkdir_p(os.path.dirname(cached_psl))
-
-    # File does not exist, download current list and cache it at given location.
-    if not os.path.exists(cached_psl):
-        logging.debug("Downloading the Public Suffix List...")
-        try:
-            updatePSL(cached_psl)
-        except Exception as err:
-            logging.warning("Unable to download the Public Suffix List...")
-            logging.debug("{}".format(err))
-            return None
-
-        logging.debug("Using cached Public Suffix List...")
-    with codecs.open(cached_psl, encoding='utf-8') as psl_file:
-        suffixes = PublicSuffixList(psl_file)
-
-    return suffixes
+    return psl.base_domain_for(subdomain, cache_dir=cache_dir)
 
 
 # Check whether we have HTTP behavior data cached for a domain.
@@ -633,6 +611,25 @@ def domain_not_live(domain, cache_dir="./cache"):
     return (not inspection.get("Live"))
 
 
+# Check whether pre-resolution (--preresolve) found that a hostname has
+# no addresses. False if it wasn't pre-resolved, or couldn't be.
+def host_doesnt_resolve(hostname, environment):
+    dns = environment.get("dns")
+    if not dns:
+        return False
+
+    return dns["addresses"].get(hostname) == []
+
+
+# Check whether pre-resolution found that neither a domain nor its www
+# subdomain has any addresses, so there's no website to scan.
+def domain_doesnt_resolve(domain, environment):
+    return (
+        host_doesnt_resolve(domain, environment) and
+        host_doesnt_resolve("www.%s" % domain, environment)
+    )
+
+
 # Check whether we have HTTP behavior data cached for a domain.
 # If so, check if we know it redirects.
 # Useful for skipping scans on redirect domains.
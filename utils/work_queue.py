@@ -0,0 +1,310 @@
+import collections
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+###
+# A durable queue of (scanner, domain) tasks, for running one scan on
+# many worker processes, on any number of machines (scan --coordinator
+# and scan --worker).
+#
+# The coordinator adds every task, workers lease them one at a time,
+# scan them, and send back the rows; the coordinator writes the CSVs
+# once every task is done. A worker keeps renewing the leases on the
+# tasks it's scanning; if it dies (or can't finish a task), the leases
+# expire and other workers pick the tasks up. Workers can join (or
+# leave) at any time.
+#
+# Backends are picked by URL scheme from BACKENDS. SQLite is the only
+# one so far: fine for workers on one machine, or sharing a file system
+# with working locks.
+###
+
+# Seconds a lease lasts without being renewed.
+default_lease_time = 60
+
+# Tasks whose lease expires this many times are given up on, in case
+# it's the task that keeps killing its workers.
+default_max_leases = 3
+
+# A task a worker is scanning.
+LeasedTask = collections.namedtuple("LeasedTask", ["id", "scanner", "domain"])
+
+# A finished task: its rows for the CSV, or why there aren't any.
+Result = collections.namedtuple("Result", ["domain", "rows", "error"])
+
+
+class WorkQueue(object):
+    """
+    What a work queue backend provides. Every method may be called from
+    any thread.
+    """
+
+    # Add a task for each domain, skipping any already there. Returns
+    # how many were added.
+    def add(self, scanner, domains):
+        raise NotImplementedError
+
+    # The next task for `scanner` that's queued (or whose lease has
+    # expired), leased to `worker` for `lease_time` seconds; or None.
+    def lease(self, worker, scanner, lease_time):
+        raise NotImplementedError
+
+    # Extend `worker`'s leases on the tasks with the given ids by another
+    # `lease_time` seconds.
+    def renew(self, worker, task_ids, lease_time):
+        raise NotImplementedError
+
+    # Finish a task with the rows to write for it, or with None and an
+    # error saying why there aren't any. If another worker already
+    # finished it (after this one's lease expired), the first to finish
+    # wins.
+    def complete(self, task, rows, error=None):
+        raise NotImplementedError
+
+    # How many of `scanner`'s tasks (or everyone's) are in each state.
+    def progress(self, scanner=None):
+        raise NotImplementedError
+
+    # Whether `scanner`'s tasks (or everyone's) are all done.
+    def finished(self, scanner=None):
+        progress = self.progress(scanner)
+        return progress['queued'] == 0 and progress['leased'] == 0
+
+    # Every Result for `scanner`, in the order the tasks were added.
+    def results(self, scanner):
+        raise NotImplementedError
+
+    # Save a worker's meta.json entry for a scanner, and fetch them all.
+    def report(self, worker, scanner, entry):
+        raise NotImplementedError
+
+    def reports(self, scanner):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SQLiteQueue(WorkQueue):
+    """A WorkQueue in a SQLite database file."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY,
+            scanner TEXT NOT NULL,
+            domain TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            worker TEXT,
+            lease_expires REAL,
+            leases INTEGER NOT NULL DEFAULT 0,
+            rows TEXT,
+            error TEXT,
+            UNIQUE (scanner, domain)
+        );
+        CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks (scanner, status, id);
+        CREATE TABLE IF NOT EXISTS reports (
+            worker TEXT NOT NULL,
+            scanner TEXT NOT NULL,
+            report TEXT NOT NULL,
+            PRIMARY KEY (worker, scanner)
+        );
+    """
+
+    def __init__(self, path, max_leases=default_max_leases):
+        self.path = path
+        self.max_leases = max_leases
+        self.lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Autocommit, with explicit transactions where they matter.
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        with self.lock:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(self.SCHEMA)
+
+    def add(self, scanner, domains):
+        with self.lock:
+            before = self.connection.total_changes
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO tasks (scanner, domain) VALUES (?, ?)",
+                ((scanner, domain) for domain in domains))
+            self.connection.execute("COMMIT")
+            return self.connection.total_changes - before
+
+    def lease(self, worker, scanner, lease_time):
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.execute(
+                    "UPDATE tasks SET status = 'done', error = ? "
+                    "WHERE scanner = ? AND status = 'leased' AND lease_expires < ? AND leases >= ?",
+                    ("Gave up after its lease expired %i times." % self.max_leases,
+                     scanner, now, self.max_leases))
+                row = self.connection.execute(
+                    "SELECT id, domain FROM tasks WHERE scanner = ? AND "
+                    "(status = 'queued' OR (status = 'leased' AND lease_expires < ?)) "
+                    "ORDER BY id LIMIT 1", (scanner, now)).fetchone()
+                if row is not None:
+                    self.connection.execute(
+                        "UPDATE tasks SET status = 'leased', worker = ?, lease_expires = ?, "
+                        "leases = leases + 1 WHERE id = ?", (worker, now + lease_time, row[0]))
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return LeasedTask(row[0], scanner, row[1])
+
+    def renew(self, worker, task_ids, lease_time):
+        task_ids = list(task_ids)
+        if not task_ids:
+            return
+        with self.lock:
+            self.connection.execute(
+                "UPDATE tasks SET lease_expires = ? WHERE worker = ? AND status = 'leased' AND id IN (%s)"
+                % ", ".join("?" * len(task_ids)),
+                [time.time() + lease_time, worker] + task_ids)
+
+    def complete(self, task, rows, error=None):
+        with self.lock:
+            self.connection.execute(
+                "UPDATE tasks SET status = 'done', rows = ?, error = ? WHERE id = ? AND status != 'done'",
+                (json.dumps(rows, default=str) if rows is not None else None, error, task.id))
+
+    def progress(self, scanner=None):
+        query = "SELECT status, COUNT(*), SUM(MAX(leases - 1, 0)) FROM tasks"
+        params = ()
+        if scanner is not None:
+            query += " WHERE scanner = ?"
+            params = (scanner,)
+        with self.lock:
+            counts = self.connection.execute(query + " GROUP BY status", params).fetchall()
+        progress = {'queued': 0, 'leased': 0, 'done': 0, 'expired_leases': 0}
+        for status, count, expired in counts:
+            progress[status] = count
+            progress['expired_leases'] += expired or 0
+        return progress
+
+    def results(self, scanner):
+        # A connection of its own, to stream them without the lock.
+        connection = sqlite3.connect(self.path, timeout=60)
+        try:
+            for domain, rows, error in connection.execute(
+                    "SELECT domain, rows, error FROM tasks WHERE scanner = ? AND status = 'done' ORDER BY id",
+                    (scanner,)):
+                yield Result(domain, json.loads(rows) if rows is not None else None, error)
+        finally:
+            connection.close()
+
+    def report(self, worker, scanner, entry):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO reports (worker, scanner, report) VALUES (?, ?, ?)",
+                (worker, scanner, json.dumps(entry, default=str)))
+
+    def reports(self, scanner):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT report FROM reports WHERE scanner = ? ORDER BY worker", (scanner,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+# Backends, by URL scheme.
+BACKENDS = {
+    'sqlite': SQLiteQueue,
+}
+
+
+# Open a queue from a URL like sqlite:///path/to/queue.db, or a plain
+# path to a SQLite file.
+def open_queue(location):
+    scheme, separator, rest = location.partition("://")
+    if not separator:
+        return SQLiteQueue(location)
+    if scheme not in BACKENDS:
+        raise ValueError("No work queue backend for %s:// (try one of %s)." % (scheme, ", ".join(sorted(BACKENDS))))
+    return BACKENDS[scheme](rest)
+
+
+class RowCollector(object):
+    """Stands in for a CSV writer, keeping a task's rows to send back."""
+
+    def __init__(self):
+        self.rows = []
+
+    def writerow(self, row):
+        self.rows.append(list(row))
+
+
+class Worker(object):
+    """
+    One worker process's view of a WorkQueue: leases tasks, keeps the
+    leases alive while they're being scanned, and finishes them.
+    """
+
+    def __init__(self, queue, lease_time=default_lease_time):
+        self.queue = queue
+        self.lease_time = lease_time
+        self.id = "%s:%i:%s" % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.stopping = threading.Event()
+        self.heartbeat = threading.Thread(target=self.renew, daemon=True)
+        # Ids of the tasks leased and not yet finished.
+        self.lock = threading.Lock()
+        self.in_flight = set()
+
+    def start(self):
+        self.heartbeat.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        self.heartbeat.join()
+
+    def renew(self):
+        while not self.stopping.wait(self.lease_time / 3):
+            with self.lock:
+                task_ids = list(self.in_flight)
+            try:
+                self.queue.renew(self.id, task_ids, self.lease_time)
+            except Exception as err:
+                logging.warning("Couldn't renew leases: %s" % err)
+
+    # Finish a task, with its rows or the error that stopped it, and
+    # stop renewing its lease. If the queue can't be told, the lease is
+    # left to run out, and the task goes to another worker.
+    def finish(self, task, rows, error=None):
+        try:
+            self.queue.complete(task, rows, error)
+        except Exception as err:
+            logging.warning("[%s][%s] Couldn't finish task: %s" % (task.domain, task.scanner, err))
+        finally:
+            with self.lock:
+                self.in_flight.discard(task.id)
+
+    # Tasks for `scanner`, as make_params(task) makes them, until all of
+    # its tasks are done. Yields None when there's nothing to lease yet
+    # but other tasks may still come back (see Scheduler).
+    def tasks(self, scanner, make_params):
+        while True:
+            task = self.queue.lease(self.id, scanner, self.lease_time)
+            if task is not None:
+                with self.lock:
+                    self.in_flight.add(task.id)
+                yield make_params(task)
+            elif self.queue.finished(scanner):
+                return
+            else:
+                yield None